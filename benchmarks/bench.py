@@ -0,0 +1,988 @@
+"""
+Repeatable benchmark for every endpoint of src/app.py.
+
+    python benchmarks/bench.py seed --scale 1k              # drops and reseeds the database
+    python benchmarks/bench.py run --mode client --out before.json
+    python benchmarks/bench.py run --mode gunicorn --workers 4 --concurrency 16 --out after.json
+    python benchmarks/bench.py run --mode gunicorn --server-mode async --concurrency 64 --only GET --out async.json
+    python benchmarks/bench.py compare before.json after.json
+    python benchmarks/bench.py favorites-check --mode gunicorn --workers 4 --concurrency 32
+    python benchmarks/bench.py seed --scale 100k && python benchmarks/bench.py encoders
+    python benchmarks/bench.py compression --repeat 20
+    python benchmarks/bench.py write-queries
+    python benchmarks/bench.py startup --gunicorn
+    python benchmarks/bench.py write-contention --workers 4 --concurrency 16
+    python benchmarks/bench.py catalog --format csv
+    python benchmarks/bench.py seed --scale 1m && python benchmarks/bench.py snapshot
+    python benchmarks/bench.py seed --scale 1m && python benchmarks/bench.py indexes
+
+The database is DATABASE_URL (or --database-url), defaulting to the app's sqlite:////tmp/test.db.
+Results are written as JSON (p50/p95/p99 latency in ms, requests per second, errors and peak RSS)
+so runs from different commits can be compared.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+SEED_BATCH = 10000
+FAVORITES_PER_USER = 2
+#Valores variados para que /search tenga términos con distinta selectividad.
+CLIMATES = ('arid', 'temperate', 'frozen', 'murky', 'tropical', 'windy')
+TERRAINS = ('desert', 'forest', 'tundra', 'swamp', 'ocean', 'mountains', 'city')
+SPECIES = ('human', 'droid', 'wookiee', 'hutt', 'ewok', 'twilek', 'rodian', 'gungan')
+
+
+def load_app(database_url):
+    #Los módulos leen la configuración de las variables de entorno (DATABASE_URL, etc.), así que la fijamos antes.
+    os.environ['DATABASE_URL'] = database_url
+    sys.path.insert(0, SRC)
+    from app import create_app
+    return create_app()
+
+
+def counts_for(scale):
+    rows = SCALES[scale]
+    return {'users': rows, 'planets': max(rows // 10, 10), 'characters': rows}
+
+
+def insert_batches(db, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SEED_BATCH:
+            db.session.execute(db.insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+    db.session.commit()
+
+
+def seed(args):
+    app = load_app(args.database_url)
+    from models import db, User, Planet, Character, FavoritePlanets, FavoriteCharacters
+    counts = counts_for(args.scale)
+    started = time.perf_counter()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        insert_batches(db, Planet, ({'name': f'planet-{i}', 'population': i, 'diameter': i % 50000,
+                                     'climated': CLIMATES[i % len(CLIMATES)], 'terrain': TERRAINS[i % len(TERRAINS)]}
+                                    for i in range(counts['planets'])))
+        insert_batches(db, Character, ({'name': f'character-{i}', 'specie': SPECIES[i % len(SPECIES)],
+                                        'gender': 'female' if i % 2 else 'male',
+                                        'age': i % 900, 'height': 100 + i % 120, 'weight': 40 + i % 80,
+                                        'planet_id': 1 + i % counts['planets']} for i in range(counts['characters'])))
+        insert_batches(db, User, ({'name': f'user-{i}', 'email': f'user-{i}@example.com', 'password': 'benchmark',
+                                   'is_active': True} for i in range(counts['users'])))
+        insert_batches(db, FavoritePlanets, ({'user_id': 1 + user, 'planet_id': 1 + (user * 7 + n) % counts['planets']}
+                                             for user in range(counts['users']) for n in range(FAVORITES_PER_USER)))
+        insert_batches(db, FavoriteCharacters, ({'user_id': 1 + user, 'character_id': 1 + (user * 7 + n) % counts['characters']}
+                                                for user in range(counts['users']) for n in range(FAVORITES_PER_USER)))
+        app.extensions['search_index'].rebuild() #Las filas se insertaron sin pasar por los handlers.
+        from counters import reconcile_favorite_counts
+        reconcile_favorite_counts(Planet)
+        reconcile_favorite_counts(Character)
+    print(json.dumps({'scale': args.scale, 'counts': counts, 'seconds': round(time.perf_counter() - started, 2)}))
+
+
+def scenarios(counts, rng):
+    #Cada escenario devuelve (método, url, body) para la iteración i. Las escrituras crean y borran sus propios datos.
+    planet = lambda: rng.randint(1, counts['planets'])
+    character = lambda: rng.randint(1, counts['characters'])
+    user = lambda: rng.randint(1, counts['users'])
+    new_planet = lambda i: {'name': f'bench-p-{i}', 'population': 1, 'diameter': 1, 'climated': 'c', 'terrain': 't'}
+    new_character = lambda i: {'name': f'bench-c-{i}', 'specie': 's', 'gender': 'g', 'age': 1, 'height': 1,
+                               'weight': 1, 'planet_id': 1}
+    return {
+        'GET /users': lambda i: [('GET', '/users', None)],
+        'GET /users?stream': lambda i: [('GET', '/users?stream=true', None)],
+        'GET /user/<id>': lambda i: [('GET', f'/user/{user()}', None)],
+        'GET /user/<id>/favorites': lambda i: [('GET', f'/user/{user()}/favorites', None)],
+        'GET /planets': lambda i: [('GET', '/planets', None)],
+        'GET /planets?stream': lambda i: [('GET', '/planets?stream=true', None)],
+        'GET /planet/<id>': lambda i: [('GET', f'/planet/{planet()}', None)],
+        'GET /characters': lambda i: [('GET', '/characters', None)],
+        'GET /characters?stream': lambda i: [('GET', '/characters?stream=true', None)],
+        'GET /character/<id>': lambda i: [('GET', f'/character/{character()}', None)],
+        'GET /characters?filter&sort': lambda i: [('GET', f'/characters?gender=female&min_age={rng.randint(0, 800)}&sort=-height&limit=20', None)],
+        'GET /characters?planet_id': lambda i: [('GET', f'/characters?planet_id={planet()}', None)],
+        'GET /search?q=<name>': lambda i: [('GET', f'/search?q=character-{character()}', None)],
+        'GET /search?q=<prefix>': lambda i: [('GET', f'/search?q=planet+{rng.randint(1, 99)}&type=planet', None)],
+        'GET /search?q=<common>': lambda i: [('GET', f'/search?q={rng.choice(SPECIES)}+female', None)],
+        'GET /planets?name_prefix': lambda i: [('GET', f'/planets?name_prefix=planet-{rng.randint(1, 9)}&limit=20', None)],
+        'POST+DELETE favorite planet': lambda i: (lambda p, u: [('POST', f'/favorite/planets/{p}/{u}', None),
+                                                                ('DELETE', f'/favorite/planet/{p}/{u}', None)])(planet(), user()),
+        'POST+DELETE favorite character': lambda i: (lambda c, u: [('POST', f'/favorite/characters/{c}/{u}', None),
+                                                                   ('DELETE', f'/favorite/character/{c}/{u}', None)])(character(), user()),
+        'POST /user/<id>/favorites/batch': lambda i: (lambda u, p: [('POST', f'/user/{u}/favorites/batch', {'add_planets': [p]}),
+                                                                    ('POST', f'/user/{u}/favorites/batch', {'remove_planets': [p]})])(user(), planet()),
+        'POST+PUT+DELETE planet': lambda i: [('POST', '/planets', new_planet(i)),
+                                             ('PUT', '/planet/{id}', dict(new_planet(i), population=2)),
+                                             ('DELETE', '/planet/{id}', None)],
+        'POST+PUT+DELETE character': lambda i: [('POST', '/characters', new_character(i)),
+                                                ('PUT', '/character/{id}', dict(new_character(i), age=2)),
+                                                ('DELETE', '/character/{id}', None)],
+        'POST+PUT+DELETE user': lambda i: [('POST', '/user', {'name': 'bench', 'email': f'bench-{i}@example.com', 'password': 'x'}),
+                                           ('PUT', '/users/{id}', {'name': 'bench2', 'email': f'bench-{i}@example.com', 'password': 'x'}),
+                                           ('DELETE', '/user/{id}', None)],
+        'POST+DELETE /planets/bulk': lambda i: [('POST', '/planets/bulk', [new_planet(f'{i}-{n}') for n in range(100)]),
+                                                ('DELETE', '/planets/bulk', {'ids': '{ids}'})],
+    }
+
+
+def run_steps(send, steps):
+    #Ejecuta los pasos de un escenario encadenando el id creado en el primer paso. Devuelve (latencias, errores).
+    latencies, errors, created = [], 0, {}
+    for method, url, body in steps:
+        if '{id}' in url:
+            if 'id' not in created:
+                errors += 1
+                continue
+            url = url.replace('{id}', str(created['id']))
+        if isinstance(body, dict) and body.get('ids') == '{ids}':
+            body = {'ids': created.get('ids', [])}
+        started = time.perf_counter()
+        status, payload = send(method, url, body)
+        latencies.append(time.perf_counter() - started)
+        if status >= 500 or status == 0:
+            errors += 1
+        elif isinstance(payload, dict) and status in (200, 201):
+            if isinstance(payload.get('data'), dict) and 'id' in payload['data']:
+                created['id'] = payload['data']['id']
+            if isinstance(payload.get('results'), list):
+                created['ids'] = [result['id'] for result in payload['results'] if 'id' in result]
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, errors, elapsed):
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+
+
+def client_sender(app):
+    client = app.test_client()
+
+    def send(method, url, body):
+        response = client.open(url, method=method, json=body)
+        payload = response.get_json(silent=True) if response.is_json else None
+        response.close() #Cierra las respuestas en streaming y libera su conexión a la base de datos.
+        return response.status_code, payload
+    return send
+
+
+def http_sender(base_url):
+    def send(method, url, body):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(base_url + url, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                raw = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            raw, status = error.read(), error.code
+        except OSError:
+            return 0, None
+        try:
+            return status, json.loads(raw) if raw else None
+        except ValueError:
+            return status, None
+    return send
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn no respondió en el puerto {port}')
+
+
+def process_tree_peak_rss_kb(pid):
+    #Suma del pico de memoria (VmHWM) del master de gunicorn y sus workers. Solo Linux.
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        return None
+    total = 0
+    for process in pids:
+        try:
+            with open(f'/proc/{process}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def count_rows(app):
+    from models import db, User, Planet, Character
+    with app.app_context():
+        return {'users': db.session.query(User).count(), 'planets': db.session.query(Planet).count(),
+                'characters': db.session.query(Character).count()}
+
+
+def start_sender(args, app):
+    #Devuelve (send, proceso de gunicorn o None).
+    if args.mode != 'gunicorn':
+        return client_sender(app), None
+    port = free_port()
+    #Usamos la misma configuración que el Procfile; SERVER_MODE elige workers síncronos o async.
+    env = dict(os.environ, DATABASE_URL=args.database_url, SERVER_MODE=args.server_mode)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+                               '-b', f'127.0.0.1:{port}', '-w', str(args.workers), '--log-level', 'warning'],
+                              cwd=ROOT, env=env)
+    wait_for_port(port)
+    return http_sender(f'http://127.0.0.1:{port}'), server
+
+
+def run(args):
+    app = load_app(args.database_url)
+    counts = count_rows(app)
+    if not all(counts.values()):
+        raise SystemExit('La base de datos está vacía, ejecuta primero: python benchmarks/bench.py seed --scale 1k')
+    rng = random.Random(args.seed)
+    selected = scenarios(counts, rng)
+    if args.only:
+        selected = {name: factory for name, factory in selected.items() if args.only in name}
+
+    send, server = start_sender(args, app)
+    results = {}
+    try:
+        for name, factory in selected.items():
+            for i in range(args.warmup):
+                run_steps(send, factory(f'warmup-{i}-{time.time_ns()}'))
+            batches = [factory(f'{i}-{time.time_ns()}') for i in range(args.requests)]
+            started = time.perf_counter()
+            if args.concurrency > 1:
+                with ThreadPoolExecutor(args.concurrency) as pool:
+                    outcomes = list(pool.map(lambda steps: run_steps(send, steps), batches))
+            else:
+                outcomes = [run_steps(send, steps) for steps in batches]
+            elapsed = time.perf_counter() - started
+            latencies = [latency for outcome in outcomes for latency in outcome[0]]
+            errors = sum(outcome[1] for outcome in outcomes)
+            results[name] = summarize(latencies, errors, elapsed)
+            print(f'{name:40} {json.dumps(results[name])}', file=sys.stderr)
+        if server is not None:
+            peak_rss_kb = process_tree_peak_rss_kb(server.pid)
+        else:
+            peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'commit': git_commit(),
+        'mode': args.mode,
+        'workers': args.workers if args.mode == 'gunicorn' else None,
+        'server_mode': args.server_mode if args.mode == 'gunicorn' else None,
+        'concurrency': args.concurrency,
+        'database': args.database_url.split('://', 1)[0],
+        'rows': counts,
+        'requests_per_route': args.requests,
+        'peak_rss_kb': peak_rss_kb,
+        'routes': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(output + '\n')
+    print(output)
+
+
+def favorites_check(args):
+    #Prueba de concurrencia de favorite_count: muchos hilos agregan y quitan favoritos de pocos planetas/personajes
+    #(máxima contención) por las rutas individuales y la ruta batch. Al final cada contador tiene que coincidir
+    #exactamente con el número de filas en las tablas de favoritos. La misma comprobación, en un solo proceso,
+    #está en tests/test_counters.py; esta la repite con gunicorn y varios workers.
+    app = load_app(args.database_url)
+    counts = count_rows(app)
+    if not all(counts.values()):
+        raise SystemExit('La base de datos está vacía, ejecuta primero: python benchmarks/bench.py seed --scale 1k')
+    users = range(1, min(counts['users'], args.users) + 1)
+    planets = range(1, min(counts['planets'], args.targets) + 1)
+    characters = range(1, min(counts['characters'], args.targets) + 1)
+
+    def operation(i):
+        local = random.Random(args.seed + i)
+        user, planet, character = local.choice(users), local.choice(planets), local.choice(characters)
+        return local.choice([
+            ('POST', f'/favorite/planets/{planet}/{user}', None),
+            ('DELETE', f'/favorite/planet/{planet}/{user}', None),
+            ('POST', f'/favorite/characters/{character}/{user}', None),
+            ('DELETE', f'/favorite/character/{character}/{user}', None),
+            ('POST', f'/user/{user}/favorites/batch', {'add_planets': [planet], 'remove_characters': [character]}),
+            ('POST', f'/user/{user}/favorites/batch', {'remove_planets': [planet], 'add_characters': [character]}),
+        ])
+
+    send, server = start_sender(args, app)
+    statuses = {}
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            for status, _ in pool.map(lambda i: send(*operation(i)), range(args.requests)):
+                statuses[status] = statuses.get(status, 0) + 1
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    from models import db, Planet, Character
+    from counters import actual_count
+    mismatches = []
+    with app.app_context():
+        for model, ids in ((Planet, planets), (Character, characters)):
+            rows = db.session.execute(db.select(model.id, model.favorite_count, actual_count(model)).where(model.id.in_(ids)))
+            mismatches += [{'table': model.__tablename__, 'id': id, 'favorite_count': stored, 'actual': actual}
+                           for id, stored, actual in rows if stored != actual]
+    print(json.dumps({'requests': args.requests, 'seconds': round(elapsed, 2), 'statuses': statuses,
+                      'mismatches': mismatches}, indent=2))
+    if mismatches:
+        raise SystemExit(1)
+
+
+def encoders(args):
+    #Micro-benchmark de /characters con todas las filas (100k con --scale 100k): encoder de la librería estándar
+    #contra orjson, y objetos del ORM + serialize() contra el camino de filas (list_query).
+    app = load_app(args.database_url)
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import FastJSONProvider, orjson
+    from models import Character
+    from utils import list_query
+    providers = {'stdlib': DefaultJSONProvider(app)}
+    if orjson is not None:
+        providers['orjson'] = FastJSONProvider(app)
+    client = app.test_client()
+
+    def orm_path():
+        return app.json.response({'msg': 'ok', 'data': [row.serialize() for row in Character.query.order_by(Character.id)]})
+
+    def rows_path():
+        query, serialize = list_query(Character.query, Character, None, set())
+        return app.json.response({'msg': 'ok', 'data': [serialize(row) for row in query.order_by(Character.id)]})
+
+    def endpoint():
+        response = client.get('/characters?stream=true')
+        body = response.data
+        response.close()
+        return body
+
+    results = {}
+    with app.app_context():
+        rows = Character.query.count()
+        dicts = [row.serialize() for row in Character.query.order_by(Character.id)]
+        for name, provider in providers.items():
+            app.json = provider
+            cases = {'encode only (dicts ya construidos)': lambda: provider.dumps({'data': dicts}),
+                     'ORM + serialize() + encode': orm_path,
+                     'filas (list_query) + encode': rows_path,
+                     'GET /characters?stream=true': endpoint}
+            for case, function in cases.items():
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    function()
+                    timings.append(time.perf_counter() - started)
+                results[f'{name}: {case}'] = {'best_ms': round(min(timings) * 1000, 1),
+                                              'median_ms': round(statistics.median(timings) * 1000, 1)}
+                print(f'{name + ": " + case:55} {json.dumps(results[f"{name}: {case}"])}', file=sys.stderr)
+    print(json.dumps({'commit': git_commit(), 'characters': rows, 'repeat': args.repeat, 'results': results}, indent=2))
+
+
+COMPRESSION_ROUTES = ('/planets?limit=1000', '/characters?limit=1000', '/planet/1', '/characters?stream=true')
+
+
+def compression(args):
+    #Por ruta y codificación: bytes enviados, latencia de la primera respuesta (comprime) y de las siguientes
+    #(body comprimido servido desde la cache). Al final, bytes ahorrados y CPU de /compression/stats.
+    app = load_app(args.database_url)
+    client = app.test_client()
+    codings = ['identity'] + list(reversed(client.get('/compression/stats').get_json()['data']['codings']))
+    results = {}
+    for path in COMPRESSION_ROUTES:
+        for coding in codings:
+            timings = []
+            for _ in range(args.repeat + 1):
+                started = time.perf_counter()
+                response = client.get(path, headers={'Accept-Encoding': coding})
+                size = len(response.data)
+                timings.append(time.perf_counter() - started)
+                response.close()
+            results[f'{path} {coding}'] = {'bytes': size, 'first_ms': round(timings[0] * 1000, 2),
+                                           'median_ms': round(statistics.median(timings[1:]) * 1000, 2)}
+            print(f'{path + " " + coding:45} {json.dumps(results[f"{path} {coding}"])}', file=sys.stderr)
+    stats = client.get('/compression/stats').get_json()['data']
+    print(json.dumps({'commit': git_commit(), 'repeat': args.repeat, 'results': results, 'stats': stats}, indent=2))
+
+
+def write_queries(args):
+    #Consultas SQL por solicitud en las rutas de escritura (camino feliz y de error), leídas de la cabecera
+    #Server-Timing. Crea sus propias filas con un sufijo único y las borra al final. Los mismos casos, con el número
+    #de consultas esperado, están en tests/test_write_queries.py.
+    os.environ['METRICS_SERVER_TIMING'] = '1'
+    app = load_app(args.database_url)
+    from models import db, User, Planet, Character, FavoritePlanets, FavoriteCharacters
+    client = app.test_client()
+    tag = str(time.time_ns())[-9:]
+    with app.app_context():
+        users = [User(name='wq', email=f'wq{tag}-{i}@bench', password='p', is_active=True) for i in range(2)]
+        planets = [Planet(name=f'wq{tag}-{i}', population=1, diameter=1, climated='arid', terrain='desert') for i in range(2)]
+        db.session.add_all(users + planets)
+        db.session.flush()
+        character = Character(name=f'wq{tag}-c', specie='human', gender='f', age=1, height=1, weight=1, planet_id=planets[0].id)
+        db.session.add(character)
+        db.session.commit()
+        user, other_user = users[0].id, users[1].id
+        planet, other_planet, character = planets[0].id, planets[1].id, character.id
+    user_body = {'name': 'wq', 'email': f'wq{tag}-0@bench', 'password': 'p'}
+    planet_body = {'name': f'wq{tag}-0', 'population': 2, 'diameter': 2, 'climated': 'arid', 'terrain': 'desert'}
+    character_body = {'name': f'wq{tag}-c', 'specie': 'human', 'gender': 'f', 'age': 2, 'height': 2, 'weight': 2}
+    new_planet = dict(planet_body, name=f'wq{tag}-n')
+    new_character = dict(character_body, name=f'wq{tag}-nc', planet_id=planet)
+    steps = [
+        ('POST /user', 'POST', '/user', dict(user_body, email=f'wq{tag}-n@bench'), 201),
+        ('POST /user (email repetido)', 'POST', '/user', user_body, 400),
+        ('PUT /users/<id>', 'PUT', f'/users/{user}', user_body, 200),
+        ('PUT /users/<id> (email de otro)', 'PUT', f'/users/{user}', dict(user_body, email=f'wq{tag}-1@bench'), 400),
+        ('PUT /users/<id> (no existe)', 'PUT', '/users/0', user_body, 404),
+        ('POST /favorite/planets', 'POST', f'/favorite/planets/{planet}/{user}', None, 200),
+        ('POST /favorite/planets (repetido)', 'POST', f'/favorite/planets/{planet}/{user}', None, 400),
+        ('POST /favorite/planets (sin planeta)', 'POST', f'/favorite/planets/0/{user}', None, 404),
+        ('DELETE /favorite/planet', 'DELETE', f'/favorite/planet/{planet}/{user}', None, 204),
+        ('DELETE /favorite/planet (no existe)', 'DELETE', f'/favorite/planet/{planet}/{user}', None, 404),
+        ('DELETE /favorite/planet (sin usuario)', 'DELETE', f'/favorite/planet/{planet}/0', None, 404),
+        ('POST /favorite/characters', 'POST', f'/favorite/characters/{character}/{user}', None, 200),
+        ('POST /favorite/characters (repetido)', 'POST', f'/favorite/characters/{character}/{user}', None, 400),
+        ('DELETE /favorite/character', 'DELETE', f'/favorite/character/{character}/{user}', None, 204),
+        ('DELETE /favorite/character (no existe)', 'DELETE', f'/favorite/character/{character}/{user}', None, 404),
+        ('POST /planets', 'POST', '/planets', new_planet, 201),
+        ('POST /planets (name repetido)', 'POST', '/planets', planet_body, 400),
+        ('PUT /planet/<id>', 'PUT', f'/planet/{planet}', planet_body, 200),
+        ('PUT /planet/<id> (name de otro)', 'PUT', f'/planet/{other_planet}', planet_body, 400),
+        ('POST /characters', 'POST', '/characters', new_character, 201),
+        ('POST /characters (name repetido)', 'POST', '/characters', new_character, 400),
+        ('PUT /character/<id>', 'PUT', f'/character/{character}', character_body, 200),
+        ('PUT /character/<id> (name de otro)', 'PUT', f'/character/{character}', new_character, 400),
+        ('POST /favorite/planets (antes de borrar)', 'POST', f'/favorite/planets/{planet}/{user}', None, 200),
+        ('DELETE /user/<id> (con favoritos)', 'DELETE', f'/user/{user}', None, 204),
+        ('DELETE /user/<id> (no existe)', 'DELETE', '/user/0', None, 404),
+    ]
+    results, unexpected = {}, []
+    for name, method, path, body, expected in steps:
+        response = client.open(path, method=method, json=body)
+        timing = response.headers.get('Server-Timing', '')
+        queries = int(timing.split('desc="')[1].split(' ')[0]) if 'desc="' in timing else None
+        results[name] = {'status': response.status_code, 'queries': queries}
+        if response.status_code != expected:
+            unexpected.append({'step': name, 'expected': expected, 'status': response.status_code})
+        print(f'{name:45} {response.status_code:>4} {queries:>3} consultas', file=sys.stderr)
+    with app.app_context():
+        #Limpieza: favoritos, personajes, planetas y usuarios creados por esta ejecución.
+        character_ids = db.select(Character.id).where(Character.name.like(f'wq{tag}-%'))
+        planet_ids = db.select(Planet.id).where(Planet.name.like(f'wq{tag}-%'))
+        user_ids = db.select(User.id).where(User.email.like(f'wq{tag}-%'))
+        db.session.execute(db.delete(FavoriteCharacters).where(FavoriteCharacters.user_id.in_(user_ids)))
+        db.session.execute(db.delete(FavoritePlanets).where(FavoritePlanets.user_id.in_(user_ids)))
+        db.session.execute(db.delete(Character).where(Character.id.in_(character_ids)))
+        db.session.execute(db.delete(Planet).where(Planet.id.in_(planet_ids)))
+        db.session.execute(db.delete(User).where(User.id.in_(user_ids)))
+        db.session.commit()
+    print(json.dumps({'commit': git_commit(), 'results': results, 'unexpected': unexpected}, indent=2))
+    if unexpected:
+        raise SystemExit(1)
+
+
+#Se ejecuta en un proceso nuevo (src/ como directorio de trabajo): importa wsgi como un worker de gunicorn
+#y mide el import (incluye create_app), la primera solicitud y la segunda.
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+client = wsgi.application.test_client()
+timings = []
+for _ in range(2):
+    before = time.perf_counter()
+    status = client.get('/planets?limit=100').status_code
+    timings.append((time.perf_counter() - before, status))
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': timings[0][0] * 1000,
+                  'second_request_ms': timings[1][0] * 1000, 'status': timings[0][1]}))
+"""
+STARTUP_PROFILES = {
+    'todo activado': {'ENABLE_ADMIN': '1', 'ENABLE_SWAGGER': '1'},
+    'solo API': {'ENABLE_ADMIN': '0', 'ENABLE_SWAGGER': '0'},
+}
+
+
+def importtime_top(stderr, limit):
+    #Paquetes con más tiempo acumulado según python -X importtime (el import más externo de cada paquete).
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = max(packages.get(package, 0), int(cumulative))
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return {package: round(us / 1000, 1) for package, us in slowest}
+
+
+def gunicorn_startup(args, env, preload):
+    #Segundos hasta la primera respuesta 200 de gunicorn y pids de los workers que atendieron las solicitudes.
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD='1' if preload else '0')
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+                               '-b', f'127.0.0.1:{port}', '-w', str(args.workers), '--log-level', 'warning'],
+                              cwd=ROOT, env=env)
+    try:
+        send = http_sender(f'http://127.0.0.1:{port}')
+        wait_for_port(port)
+        while send('GET', '/planets?limit=100', None)[0] != 200:
+            time.sleep(0.05)
+        ready = time.perf_counter() - started
+        statuses, pids = {}, set()
+        for _ in range(args.requests):
+            status, _ = send('GET', '/planet/1', None)
+            statuses[status] = statuses.get(status, 0) + 1
+            status, payload = send('GET', '/pool/stats', None)
+            if payload:
+                pids.add(payload['pid'])
+        return {'ready_seconds': round(ready, 2), 'statuses': statuses, 'worker_pids': len(pids),
+                'peak_rss_kb': process_tree_peak_rss_kb(server.pid)}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def startup(args):
+    #Arranque de un worker: import de wsgi (create_app) y primera solicitud, con y sin los subsistemas opcionales.
+    #Con --gunicorn también compara el arranque de gunicorn con y sin --preload.
+    results = {}
+    for profile, flags in STARTUP_PROFILES.items():
+        env = dict(os.environ, DATABASE_URL=args.database_url, **flags)
+        runs = [json.loads(subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=SRC, env=env, check=True,
+                                          capture_output=True, text=True).stdout) for _ in range(args.repeat)]
+        traced = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import wsgi'], cwd=SRC, env=env,
+                                check=True, capture_output=True, text=True)
+        result = {key: round(statistics.median(run[key] for run in runs), 1)
+                  for key in ('import_ms', 'first_request_ms', 'second_request_ms')}
+        result['status'] = runs[0]['status']
+        result['slowest_imports_ms'] = importtime_top(traced.stderr, args.top)
+        if args.gunicorn:
+            result['gunicorn'] = {'preload' if preload else 'sin preload': gunicorn_startup(args, env, preload)
+                                  for preload in (False, True)}
+        results[profile] = result
+        print(f'{profile:15} {json.dumps({key: result[key] for key in ("import_ms", "first_request_ms", "second_request_ms")})}',
+              file=sys.stderr)
+    print(json.dumps({'commit': git_commit(), 'repeat': args.repeat, 'results': results}, indent=2))
+
+
+CONTENTION_PROFILES = {
+    'sqlite por defecto': {'SQLITE_PROFILE': '0'},
+    'perfil WAL': {'SQLITE_PROFILE': '1', 'SQLITE_WRITE_QUEUE': '0'},
+    'perfil WAL + cola': {'SQLITE_PROFILE': '1', 'SQLITE_WRITE_QUEUE': '1'},
+}
+
+
+def sqlite_copy(source, target):
+    #Copia consistente (API de backup, sirve aunque la original esté en WAL) con el journal por defecto de SQLite:
+    #cada perfil parte de la misma base y el perfil WAL la cambia al conectarse.
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+        dst.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        src.close()
+        dst.close()
+
+
+def write_contention(args):
+    #Escrituras concurrentes (favoritos, POST y PUT de planetas) con algunas lecturas, repartidas entre varios
+    #procesos de gunicorn que comparten un archivo SQLite. Cada perfil corre sobre una copia nueva de la base.
+    if not args.database_url.startswith('sqlite:///'):
+        raise SystemExit('write-contention necesita una base SQLite (sqlite:////ruta/a/la/base.db)')
+    source = args.database_url[len('sqlite:///'):]
+    app = load_app(args.database_url)
+    counts = count_rows(app)
+    if not all(counts.values()):
+        raise SystemExit('La base de datos está vacía, ejecuta primero: python benchmarks/bench.py seed --scale 1k')
+
+    def operation(i):
+        local = random.Random(args.seed + i)
+        user = local.randint(1, min(counts['users'], args.users))
+        planet = local.randint(1, min(counts['planets'], args.targets))
+        character = local.randint(1, min(counts['characters'], args.targets))
+        if local.random() < args.read_ratio:
+            return local.choice([('GET', f'/planet/{planet}', None), ('GET', '/planets?limit=20', None)])
+        return local.choice([
+            ('POST', f'/favorite/planets/{planet}/{user}', None),
+            ('DELETE', f'/favorite/planet/{planet}/{user}', None),
+            ('POST', f'/favorite/characters/{character}/{user}', None),
+            ('DELETE', f'/favorite/character/{character}/{user}', None),
+            ('PUT', f'/planet/{planet}', {'name': f'planet-{planet - 1}', 'population': i, 'diameter': i % 50000,
+                                          'climated': CLIMATES[i % len(CLIMATES)], 'terrain': TERRAINS[i % len(TERRAINS)]}),
+            ('POST', '/planets', {'name': f'wc-{i}', 'population': i, 'diameter': i % 50000,
+                                  'climated': CLIMATES[i % len(CLIMATES)], 'terrain': TERRAINS[i % len(TERRAINS)]}),
+        ])
+
+    def timed(send, i):
+        started = time.perf_counter()
+        status, _ = send(*operation(i))
+        return status, time.perf_counter() - started
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for profile, flags in CONTENTION_PROFILES.items():
+            database = os.path.join(workdir, f'{len(results)}.db')
+            sqlite_copy(source, database)
+            port = free_port()
+            env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', ENABLE_ADMIN='0', ENABLE_SWAGGER='0', **flags)
+            log_path = os.path.join(workdir, f'{len(results)}.log')
+            with open(log_path, 'w') as log:
+                server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+                                           '-b', f'127.0.0.1:{port}', '-w', str(args.workers), '--log-level', 'warning'],
+                                          cwd=ROOT, env=env, stderr=log)
+                try:
+                    wait_for_port(port)
+                    send = http_sender(f'http://127.0.0.1:{port}')
+                    for _ in range(args.workers * 10): #Calienta los workers (imports diferidos, índice de búsqueda).
+                        send('GET', '/planets?limit=20', None)
+                    statuses, latencies, errors = {}, [], 0
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(args.concurrency) as pool:
+                        for status, latency in pool.map(lambda i: timed(send, i), range(args.requests)):
+                            statuses[status] = statuses.get(status, 0) + 1
+                            latencies.append(latency)
+                            errors += status >= 500 or status == 0
+                    elapsed = time.perf_counter() - started
+                finally:
+                    server.terminate()
+                    server.wait()
+            with open(log_path) as log:
+                locked = log.read().count('database is locked')
+            result = summarize(latencies, errors, elapsed)
+            result.update({'error_rate': round(errors / args.requests, 4), 'database_is_locked': locked,
+                           'statuses': statuses})
+            results[profile] = result
+            print(f'{profile:20} {json.dumps(result)}', file=sys.stderr)
+    print(json.dumps({'commit': git_commit(), 'workers': args.workers, 'concurrency': args.concurrency,
+                      'requests': args.requests, 'read_ratio': args.read_ratio, 'results': results}, indent=2))
+
+
+def catalog_roundtrip(args):
+    #flask catalog export de la base poblada y flask catalog import en una base SQLite vacía: filas/s por tabla.
+    app = load_app(args.database_url)
+    from app import create_app
+    from catalog import CATALOG_TABLES, export_table, import_table
+    from models import db
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        target = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(workdir, "import.db")}',
+                             'ADMIN_ENABLED': False, 'SWAGGER_ENABLED': False, 'MIGRATE_ENABLED': False})
+        with target.app_context():
+            db.create_all()
+        for name, model in CATALOG_TABLES.items():
+            path = os.path.join(workdir, f'{name}.{args.format}')
+            with app.app_context():
+                started = time.perf_counter()
+                rows = export_table(model, path, args.format, args.batch_size, True)
+                exported = time.perf_counter() - started
+            with target.app_context():
+                started = time.perf_counter()
+                import_table(model, path, args.format, args.batch_size, True)
+                imported = time.perf_counter() - started
+            results[name] = {'rows': rows, 'bytes': os.path.getsize(path),
+                             'export_seconds': round(exported, 2), 'export_rows_per_second': round(rows / exported),
+                             'import_seconds': round(imported, 2), 'import_rows_per_second': round(rows / imported)}
+            print(f'{name:20} {json.dumps(results[name])}', file=sys.stderr)
+    print(json.dumps({'commit': git_commit(), 'format': args.format, 'batch_size': args.batch_size,
+                      'database': args.database_url.split('://', 1)[0], 'tables': results}, indent=2))
+
+
+SNAPSHOT_ROUTES = ('/planets?limit=100', '/planet/{planet}', '/characters?limit=100', '/character/{character}',
+                   '/characters?sort=-age&limit=100', '/characters?specie=droid&min_height=150&limit=100',
+                   '/characters?planet_id={planet}&sort=name')
+
+
+def current_rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return None
+
+
+def snapshot_memory(args):
+    #Memoria del catálogo en memoria (CATALOG_SNAPSHOT=1) por cada 1M de personajes, con tracemalloc y RSS,
+    #y latencia de las rutas del catálogo con el snapshot contra el camino SQL.
+    os.environ['CATALOG_SNAPSHOT'] = '1'
+    app = load_app(args.database_url)
+    del os.environ['CATALOG_SNAPSHOT']
+    from app import create_app
+    from models import Planet, Character
+    snapshot = app.extensions['catalog_snapshot']
+    def load():
+        started = time.perf_counter()
+        snapshot.version = None #Fuerza la carga completa.
+        snapshot.refresh()
+        load_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for table, model in ((snapshot.planets, Planet), (snapshot.characters, Character)):
+            for column in model.SORTABLE:
+                table.order(column)
+        return load_seconds, time.perf_counter() - started
+
+    with app.app_context():
+        #RSS sin tracemalloc (incluye la memoria que el proceso retiene después de la carga) y luego una segunda
+        #carga medida con tracemalloc: los bytes que siguen vivos son los del snapshot.
+        rss_before = current_rss_kb()
+        load_seconds, orders_seconds = load()
+        rss_after = current_rss_kb()
+        tracemalloc.start()
+        load()
+        total_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    planets, characters = len(snapshot.planets.rows), len(snapshot.characters.rows)
+    per_million = lambda value: round(value / characters * 1000000 / 2 ** 20, 1) if characters else None
+    memory = {'planets': planets, 'characters': characters,
+              'load_seconds': round(load_seconds, 2), 'sort_orders_seconds': round(orders_seconds, 2),
+              'traced_mb': round(total_bytes / 2 ** 20, 1), 'mb_per_1m_characters': per_million(total_bytes),
+              'rss_delta_mb': round((rss_after - rss_before) / 1024, 1) if rss_before is not None else None,
+              'rss_mb_per_1m_characters': per_million((rss_after - rss_before) * 1024) if rss_before is not None else None}
+    print(f'memoria {json.dumps(memory)}', file=sys.stderr)
+
+    rng = random.Random(args.seed)
+    clients = {'sql': create_app().test_client(), 'snapshot': app.test_client()}
+    results = {}
+    for route in SNAPSHOT_ROUTES:
+        for name, client in clients.items():
+            timings = []
+            for _ in range(args.repeat):
+                url = route.format(planet=rng.randint(1, planets), character=rng.randint(1, characters))
+                started = time.perf_counter()
+                response = client.get(url)
+                response.close()
+                timings.append(time.perf_counter() - started)
+            results[f'{route} {name}'] = {'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+                                          'p95_ms': round(percentile(timings, 0.95) * 1000, 3)}
+            print(f'{route + " " + name:65} {json.dumps(results[f"{route} {name}"])}', file=sys.stderr)
+    print(json.dumps({'commit': git_commit(), 'database': args.database_url.split('://', 1)[0], 'memory': memory,
+                      'routes': results}, indent=2))
+
+
+#Consultas que resuelven los índices de los favoritos (user_id, planet_id), (user_id, character_id) y el de
+#character.planet_id. {hint} es '' o NOT INDEXED: la misma consulta sin poder usar ningún índice de la tabla.
+INDEX_QUERIES = {
+    'favorite_planet_pair': 'SELECT id FROM favoriteplanets {hint} WHERE user_id = :user AND planet_id = :planet',
+    'favorite_character_pair': 'SELECT id FROM favoritecharacters {hint} WHERE user_id = :user AND character_id = :character',
+    'user_favorite_planets': 'SELECT planet_id FROM favoriteplanets {hint} WHERE user_id = :user ORDER BY planet_id',
+    'user_favorite_characters': 'SELECT character_id FROM favoritecharacters {hint} WHERE user_id = :user ORDER BY character_id',
+    'planet_residents': 'SELECT id, name FROM character {hint} WHERE planet_id = :planet ORDER BY id',
+    'planet_residents_count': 'SELECT count(*) FROM character {hint} WHERE planet_id = :planet',
+}
+
+
+def indexes(args):
+    #Latencia de cada búsqueda y orden con los índices y con NOT INDEXED (como antes de la migración a3c1f2d9e4b7),
+    #directamente en SQLite para medir solo la consulta. La base se abre en solo lectura.
+    if not args.database_url.startswith('sqlite:///'):
+        raise SystemExit('indexes necesita una base SQLite (sqlite:////ruta/a/la/base.db)')
+    connection = sqlite3.connect(f'file:{args.database_url[len("sqlite:///"):]}?mode=ro', uri=True)
+    counts = {table: connection.execute(f'SELECT max(id) FROM {table}').fetchone()[0] or 0
+              for table in ('user', 'planet', 'character')}
+    if not all(counts.values()):
+        raise SystemExit('La base de datos está vacía, ejecuta primero: python benchmarks/bench.py seed --scale 1m')
+    results = {}
+    for name, query in INDEX_QUERIES.items():
+        result = {}
+        for variant, hint, repeat in (('indexed', '', args.repeat), ('not_indexed', 'NOT INDEXED', args.repeat_unindexed)):
+            statement = query.format(hint=hint)
+            rng = random.Random(args.seed) #Los mismos ids en las dos variantes.
+            timings = []
+            for _ in range(repeat):
+                params = {'user': rng.randint(1, counts['user']), 'planet': rng.randint(1, counts['planet']),
+                          'character': rng.randint(1, counts['character'])}
+                started = time.perf_counter()
+                connection.execute(statement, params).fetchall()
+                timings.append(time.perf_counter() - started)
+            plan = connection.execute(f'EXPLAIN QUERY PLAN {statement}', params).fetchall()
+            result[variant] = {'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+                               'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+                               'plan': ' / '.join(row[-1] for row in plan)}
+        indexed, not_indexed = result['indexed']['p50_ms'], result['not_indexed']['p50_ms']
+        result['speedup'] = round(not_indexed / indexed, 1) if indexed else None
+        results[name] = result
+        print(f'{name:26} {indexed:>9} ms  {not_indexed:>9} ms  x{result["speedup"]}', file=sys.stderr)
+    connection.close()
+    print(json.dumps({'commit': git_commit(), 'counts': counts, 'queries': results}, indent=2))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(args):
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"{'route':40} {'p50 ms':>18} {'p95 ms':>18} {'rps':>18}")
+    for name, new in after['routes'].items():
+        old = before['routes'].get(name)
+        if old is None or 'p50_ms' not in old or 'p50_ms' not in new:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'rps'):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+            cells.append(f'{old[key]:>7}->{new[key]:<7}{change:+.0f}%')
+        print(f'{name:40} ' + ' '.join(f'{cell:>18}' for cell in cells))
+    print(f"peak_rss_kb: {before.get('peak_rss_kb')} -> {after.get('peak_rss_kb')}")
+
+
+def main():
+    default_url = os.getenv('DATABASE_URL', 'sqlite:////tmp/test.db').replace('postgres://', 'postgresql://')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='borra y vuelve a poblar la base de datos')
+    seed_parser.add_argument('--scale', choices=SCALES, default='1k')
+    seed_parser.add_argument('--database-url', default=default_url)
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser('run', help='ejecuta el benchmark contra la base de datos ya poblada')
+    run_parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    run_parser.add_argument('--database-url', default=default_url)
+    run_parser.add_argument('--requests', type=int, default=200, help='iteraciones por ruta')
+    run_parser.add_argument('--warmup', type=int, default=10)
+    run_parser.add_argument('--concurrency', type=int, default=1)
+    run_parser.add_argument('--workers', type=int, default=2)
+    run_parser.add_argument('--server-mode', choices=('sync', 'async'), default='sync', help='SERVER_MODE de gunicorn_config.py')
+    run_parser.add_argument('--seed', type=int, default=42, help='semilla de los ids aleatorios')
+    run_parser.add_argument('--only', help='solo las rutas cuyo nombre contenga este texto')
+    run_parser.add_argument('--out', help='archivo JSON donde guardar los resultados')
+    run_parser.set_defaults(func=run)
+
+    check_parser = commands.add_parser('favorites-check', help='comprueba favorite_count bajo escrituras concurrentes')
+    check_parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    check_parser.add_argument('--database-url', default=default_url)
+    check_parser.add_argument('--requests', type=int, default=2000)
+    check_parser.add_argument('--concurrency', type=int, default=32)
+    check_parser.add_argument('--workers', type=int, default=4)
+    check_parser.add_argument('--server-mode', choices=('sync', 'async'), default='sync')
+    check_parser.add_argument('--users', type=int, default=50, help='usuarios distintos que escriben')
+    check_parser.add_argument('--targets', type=int, default=5, help='planetas y personajes que reciben los favoritos')
+    check_parser.add_argument('--seed', type=int, default=42)
+    check_parser.set_defaults(func=favorites_check)
+
+    encoders_parser = commands.add_parser('encoders', help='micro-benchmark de /characters: stdlib contra orjson')
+    encoders_parser.add_argument('--database-url', default=default_url)
+    encoders_parser.add_argument('--repeat', type=int, default=5)
+    encoders_parser.set_defaults(func=encoders)
+
+    compression_parser = commands.add_parser('compression', help='bytes y latencia por ruta con cada Content-Encoding')
+    compression_parser.add_argument('--database-url', default=default_url)
+    compression_parser.add_argument('--repeat', type=int, default=20)
+    compression_parser.set_defaults(func=compression)
+
+    write_parser = commands.add_parser('write-queries', help='consultas SQL por solicitud en las rutas de escritura')
+    write_parser.add_argument('--database-url', default=default_url)
+    write_parser.set_defaults(func=write_queries)
+
+    startup_parser = commands.add_parser('startup', help='tiempo de import y primera solicitud de un worker')
+    startup_parser.add_argument('--database-url', default=default_url)
+    startup_parser.add_argument('--repeat', type=int, default=5)
+    startup_parser.add_argument('--top', type=int, default=10, help='módulos más lentos de -X importtime')
+    startup_parser.add_argument('--gunicorn', action='store_true', help='compara gunicorn con y sin --preload')
+    startup_parser.add_argument('--workers', type=int, default=2)
+    startup_parser.add_argument('--requests', type=int, default=20, help='solicitudes de comprobación por servidor')
+    startup_parser.set_defaults(func=startup)
+
+    contention_parser = commands.add_parser('write-contention', help='escrituras concurrentes en SQLite desde varios workers')
+    contention_parser.add_argument('--database-url', default=default_url)
+    contention_parser.add_argument('--requests', type=int, default=2000)
+    contention_parser.add_argument('--concurrency', type=int, default=16)
+    contention_parser.add_argument('--workers', type=int, default=4)
+    contention_parser.add_argument('--users', type=int, default=50, help='usuarios distintos que escriben')
+    contention_parser.add_argument('--targets', type=int, default=20, help='planetas y personajes que reciben las escrituras')
+    contention_parser.add_argument('--read-ratio', type=float, default=0.25, help='fracción de solicitudes GET')
+    contention_parser.add_argument('--seed', type=int, default=42)
+    contention_parser.set_defaults(func=write_contention)
+
+    catalog_parser = commands.add_parser('catalog', help='export e import del catálogo (flask catalog) en filas/s')
+    catalog_parser.add_argument('--database-url', default=default_url)
+    catalog_parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    catalog_parser.add_argument('--batch-size', type=int, default=10000)
+    catalog_parser.set_defaults(func=catalog_roundtrip)
+
+    snapshot_parser = commands.add_parser('snapshot', help='memoria y latencia del catálogo en memoria (CATALOG_SNAPSHOT=1)')
+    snapshot_parser.add_argument('--database-url', default=default_url)
+    snapshot_parser.add_argument('--repeat', type=int, default=200)
+    snapshot_parser.add_argument('--seed', type=int, default=42)
+    snapshot_parser.set_defaults(func=snapshot_memory)
+
+    indexes_parser = commands.add_parser('indexes', help='búsquedas por favoritos y residentes con y sin índices (SQLite)')
+    indexes_parser.add_argument('--database-url', default=default_url)
+    indexes_parser.add_argument('--repeat', type=int, default=1000)
+    indexes_parser.add_argument('--repeat-unindexed', type=int, default=20, help='sin índices cada consulta recorre la tabla')
+    indexes_parser.add_argument('--seed', type=int, default=42)
+    indexes_parser.set_defaults(func=indexes)
+
+    compare_parser = commands.add_parser('compare', help='compara dos resultados JSON')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+# Gunicorn settings used by the Procfile (gunicorn -c gunicorn_config.py).
+# SERVER_MODE=async serves the read endpoints on asyncio workers (src/asgi.py) with the same compression,
+# metrics, replica routing and catalog snapshot as the sync app; its dependencies (uvicorn, asgiref,
+# aiosqlite, asyncpg) are in the Pipfile "async" category. Anything else keeps the classic synchronous
+# workers running src/wsgi.py.
+import os
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+
+if os.getenv('SERVER_MODE', 'sync') == 'async':
+    wsgi_app = 'asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'wsgi'
+
+# GUNICORN_PRELOAD=1 builds the app once in the master (create_app opens no database connections)
+# and forks the workers from it: faster startup and worker recycling, shared memory for the code.
+# Each worker drops the inherited connection pools after the fork (see src/pool.py).
+preload_app = os.getenv('GUNICORN_PRELOAD', '0').lower() in ('1', 'true')
@@ -0,0 +1,44 @@
+"""favorites unique pairs and character.planet_id index
+
+Revision ID: a3c1f2d9e4b7
+Revises: 72b0c283045d
+Create Date: 2026-10-17 10:12:41.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1f2d9e4b7'
+down_revision = '72b0c283045d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Remove duplicated favorites (keeping the oldest row) so the unique constraints can be created.
+    op.execute('DELETE FROM favoriteplanets WHERE id NOT IN '
+               '(SELECT MIN(id) FROM favoriteplanets GROUP BY user_id, planet_id)')
+    op.execute('DELETE FROM favoritecharacters WHERE id NOT IN '
+               '(SELECT MIN(id) FROM favoritecharacters GROUP BY user_id, character_id)')
+
+    with op.batch_alter_table('favoriteplanets', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_favoriteplanets_user_planet', ['user_id', 'planet_id'])
+
+    with op.batch_alter_table('favoritecharacters', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_favoritecharacters_user_character', ['user_id', 'character_id'])
+
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_character_planet_id'), ['planet_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_character_planet_id'))
+
+    with op.batch_alter_table('favoritecharacters', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_favoritecharacters_user_character', type_='unique')
+
+    with op.batch_alter_table('favoriteplanets', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_favoriteplanets_user_planet', type_='unique')
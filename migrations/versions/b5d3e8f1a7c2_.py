@@ -0,0 +1,37 @@
+"""catalog_version counter and catalog_change log for the in-memory catalog snapshot
+
+Revision ID: b5d3e8f1a7c2
+Revises: f2a8d6c4e1b9
+Create Date: 2026-10-17 21:06:12.418733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d3e8f1a7c2'
+down_revision = 'f2a8d6c4e1b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('catalog_change',
+    sa.Column('version', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('ids', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('version')
+    )
+    # The single counter row. The write handlers only ever UPDATE it.
+    op.execute('INSERT INTO catalog_version (id, version) VALUES (1, 0)')
+
+
+def downgrade():
+    op.drop_table('catalog_change')
+    op.drop_table('catalog_version')
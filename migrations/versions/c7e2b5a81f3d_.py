@@ -0,0 +1,36 @@
+"""updated_at on planet and character
+
+Revision ID: c7e2b5a81f3d
+Revises: a3c1f2d9e4b7
+Create Date: 2026-10-17 11:02:19.540112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2b5a81f3d'
+down_revision = 'a3c1f2d9e4b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows get the migration time, then the column becomes NOT NULL.
+    for table in ('planet', 'character'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+        op.execute(f'UPDATE "{table}" SET updated_at = CURRENT_TIMESTAMP')
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+            batch_op.create_index(batch_op.f(f'ix_{table}_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('character', 'planet'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_updated_at'))
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,47 @@
+"""indexes for filtering and sorting planets and characters
+
+Revision ID: e4d9a7c3b612
+Revises: c7e2b5a81f3d
+Create Date: 2026-10-17 14:37:52.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4d9a7c3b612'
+down_revision = 'c7e2b5a81f3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Equality filters get a single-column index; sortable columns get (column, id) for keyset pagination.
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_planet_climated'), ['climated'], unique=False)
+        batch_op.create_index(batch_op.f('ix_planet_terrain'), ['terrain'], unique=False)
+        batch_op.create_index('ix_planet_population_id', ['population', 'id'], unique=False)
+        batch_op.create_index('ix_planet_diameter_id', ['diameter', 'id'], unique=False)
+
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_character_specie'), ['specie'], unique=False)
+        batch_op.create_index(batch_op.f('ix_character_gender'), ['gender'], unique=False)
+        batch_op.create_index('ix_character_age_id', ['age', 'id'], unique=False)
+        batch_op.create_index('ix_character_height_id', ['height', 'id'], unique=False)
+        batch_op.create_index('ix_character_weight_id', ['weight', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('character', schema=None) as batch_op:
+        batch_op.drop_index('ix_character_weight_id')
+        batch_op.drop_index('ix_character_height_id')
+        batch_op.drop_index('ix_character_age_id')
+        batch_op.drop_index(batch_op.f('ix_character_gender'))
+        batch_op.drop_index(batch_op.f('ix_character_specie'))
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index('ix_planet_diameter_id')
+        batch_op.drop_index('ix_planet_population_id')
+        batch_op.drop_index(batch_op.f('ix_planet_terrain'))
+        batch_op.drop_index(batch_op.f('ix_planet_climated'))
@@ -0,0 +1,37 @@
+"""full-text search indexes for planet and character (PostgreSQL)
+
+Revision ID: e9b1c4f7a2d5
+Revises: e4d9a7c3b612
+Create Date: 2026-10-17 16:21:08.904517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b1c4f7a2d5'
+down_revision = 'e4d9a7c3b612'
+branch_labels = None
+depends_on = None
+
+# Must match PG_VECTORS in src/search.py, otherwise the planner will not use the index.
+VECTORS = {
+    'planet': "setweight(to_tsvector('simple', name), 'A') || to_tsvector('simple', climated || ' ' || terrain)",
+    'character': "setweight(to_tsvector('simple', name), 'A') || to_tsvector('simple', specie || ' ' || gender)",
+}
+
+
+def upgrade():
+    # SQLite keeps its FTS5 table outside the migrations (src/search.py creates it on first use).
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, vector in VECTORS.items():
+        op.execute(f'CREATE INDEX ix_{table}_search ON "{table}" USING gin (({vector}))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in VECTORS:
+        op.execute(f'DROP INDEX ix_{table}_search')
@@ -0,0 +1,46 @@
+"""favorite_count counters on planet and character
+
+Revision ID: f2a8d6c4e1b9
+Revises: e9b1c4f7a2d5
+Create Date: 2026-10-17 17:48:33.270145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8d6c4e1b9'
+down_revision = 'e9b1c4f7a2d5'
+branch_labels = None
+depends_on = None
+
+TABLES = {'planet': ('favoriteplanets', 'planet_id'), 'character': ('favoritecharacters', 'character_id')}
+
+
+def upgrade():
+    for table, (favorites, column) in TABLES.items():
+        # The backfill and 'flask favorites-reconcile' count favorites per target: index the target column first.
+        with op.batch_alter_table(favorites, schema=None) as batch_op:
+            batch_op.create_index(batch_op.f(f'ix_{favorites}_{column}'), [column], unique=False)
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+
+        # Backfill from the favorites tables; afterwards the API keeps the counters up to date.
+        op.execute(f'UPDATE "{table}" SET favorite_count = '
+                   f'(SELECT count(*) FROM {favorites} WHERE {favorites}.{column} = "{table}".id)')
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table}_favorite_count_id', ['favorite_count', 'id'], unique=False)
+
+
+def downgrade():
+    for table in ('character', 'planet'):
+        favorites, column = TABLES[table]
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_favorite_count_id')
+            batch_op.drop_column('favorite_count')
+
+        with op.batch_alter_table(favorites, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{favorites}_{column}'))
@@ -1,18 +1,245 @@
+"""
+Flask-Admin views tuned for large tables.
+- The list page shows an estimated total (PostgreSQL reltuples, otherwise a COUNT(*) cached for ADMIN_COUNT_TTL
+  seconds) instead of running COUNT(*) on every page. Searches and filters still get an exact count.
+- Only indexed columns can be sorted, searched (by prefix, like ?name_prefix=) and filtered.
+- The relations shown in the list are loaded in the same query; forms look them up with ajax instead of
+  loading the whole related table into a <select>.
+- The CSV export streams the rows in batches of EXPORT_BATCH_SIZE instead of loading the result in memory.
+- Changes made here update the read cache, the search index, the catalog snapshots and favorite_count, as the
+  API handlers do.
+"""
 import os
+from contextvars import ContextVar
+from flask import current_app, g
 from flask_admin import Admin
+from flask_admin.contrib.sqla import ModelView, filters
+from flask_admin.model.helpers import prettify_name
+from sqlalchemy import func, inspect, or_, text
+from cache import LRUCache, user_key, planet_key, character_key
+from counters import bump_favorites
+from utils import prefix_match
+from snapshot import snapshot_changed
 from models import db, User, Planet, Character, FavoriteCharacters, FavoritePlanets #Importamos las tablas.
-from flask_admin.contrib.sqla import ModelView
+
+EXPORT_BATCH_SIZE = 1000
+#Filtros que resuelve un índice B-tree, según el tipo de la columna (nada de LIKE '%...%' ni "distinto de").
+INDEXED_FILTERS = {
+    str: (filters.FilterEqual, filters.FilterInList),
+    int: (filters.IntEqualFilter, filters.IntGreaterFilter, filters.IntSmallerFilter),
+    bool: (filters.BooleanEqualFilter,),
+}
+DATETIME_FILTERS = (filters.DateTimeGreaterFilter, filters.DateTimeSmallerFilter, filters.DateTimeBetweenFilter)
+
+#True mientras get_list no necesita el total exacto (lista sin búsqueda ni filtros, o export).
+_skip_count = ContextVar('admin_skip_count', default=False)
+
+
+def indexed_filters(*columns):
+    result = []
+    for column in columns:
+        python_type = column.type.python_type
+        for filter_class in INDEXED_FILTERS.get(python_type, DATETIME_FILTERS):
+            result.append(filter_class(column, prettify_name(column.key)))
+    return result
+
+def estimated_count(model, cache, ttl):
+    #PostgreSQL: reltuples de pg_class (lo mantienen VACUUM/ANALYZE), sin recorrer la tabla. Vale -1 si la tabla
+    #nunca se analizó; en ese caso, y en los demás motores, COUNT(*) guardado en cache durante ttl segundos.
+    if db.engine.dialect.name == 'postgresql':
+        table = db.engine.dialect.identifier_preparer.quote(model.__tablename__) #"user" es palabra reservada.
+        estimate = db.session.execute(text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)'),
+                                      {'table': table}).scalar()
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+    count = cache.get(model.__tablename__)
+    if count is None:
+        count = db.session.query(func.count('*')).select_from(model).scalar()
+        cache.set(model.__tablename__, count, ttl)
+    return count
+
+
+class ScalableModelView(ModelView):
+    page_size = 50
+    can_set_page_size = False
+    column_default_sort = ('id', True) #Lo más reciente primero, por la clave primaria.
+    can_export = True
+    export_types = ['csv']
+    export_max_rows = 0 #Sin límite: el CSV se escribe a medida que llegan las filas.
+
+    def __init__(self, model, session, count_cache, count_ttl, **kwargs):
+        self.count_cache = count_cache
+        self.count_ttl = count_ttl
+        super().__init__(model, session, **kwargs)
+
+    def get_count_query(self):
+        #Flask-Admin no cuenta si recibe None.
+        return None if _skip_count.get() else super().get_count_query()
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        if search or (filters and self._filters) or _skip_count.get():
+            return super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        #Sin búsqueda ni filtros el total es el de la tabla: usamos la estimación en vez de COUNT(*).
+        token = _skip_count.set(True)
+        try:
+            _, data = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        finally:
+            _skip_count.reset(token)
+        return estimated_count(self.model, self.count_cache, self.count_ttl), data
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        #El buscador de Flask-Admin usa ILIKE '%término%', que recorre la tabla entera. Aquí cada término es un
+        #prefijo de alguna de las columnas buscables (todas indexadas), igual que ?name_prefix= en la API.
+        for term in search.split():
+            criteria = or_(*(prefix_match(getattr(self.model, name), term) for name in self.column_searchable_list))
+            query = query.filter(criteria)
+            if count_query is not None:
+                count_query = count_query.filter(criteria)
+        return query, count_query, joins, count_joins
+
+    def _export_data(self):
+        #Como el de Flask-Admin pero sin contar ni ejecutar la consulta: yield_per trae las filas por lotes
+        #(cursor del servidor en PostgreSQL) y _export_csv las escribe mientras llegan.
+        view_args = self._get_list_extra_args()
+        sort_column = self._get_column_by_idx(view_args.sort)
+        if sort_column is not None:
+            sort_column = sort_column[0]
+        token = _skip_count.set(True)
+        try:
+            _, query = self.get_list(0, sort_column, view_args.sort_desc, view_args.search, view_args.filters,
+                                     execute=False, page_size=self.export_max_rows)
+        finally:
+            _skip_count.reset(token)
+        return None, query.yield_per(EXPORT_BATCH_SIZE)
+
+    #Los cambios hechos desde el admin también tienen que llegar a la cache de los GET, al índice de búsqueda en
+    #memoria y al registro de cambios de los snapshots en memoria, igual que desde los handlers.
+    def cache_keys(self, model):
+        #Claves de la cache que deja de valer un cambio en model. Se calculan antes del commit, cuando todavía se
+        #ven los valores anteriores (p. ej. el planeta del que se muda un personaje).
+        return []
+
+    def on_model_change(self, form, model, is_created):
+        #Antes del commit: el registro de cambios va en la misma transacción que el cambio.
+        g.admin_cache_keys = self.cache_keys(model)
+        if is_created:
+            self.session.flush() #Para tener el id del elemento nuevo.
+        snapshot_changed(self.model, [model.id])
+
+    def on_model_delete(self, model):
+        g.admin_cache_keys = self.cache_keys(model)
+        snapshot_changed(self.model, [model.id])
+
+    def after_model_change(self, form, model, is_created):
+        current_app.extensions['resource_cache'].invalidate(*g.pop('admin_cache_keys', []))
+        current_app.extensions['search_index'].upsert(self.model, [model.id])
+
+    def after_model_delete(self, model):
+        current_app.extensions['resource_cache'].invalidate(*g.pop('admin_cache_keys', []))
+        current_app.extensions['search_index'].remove(self.model, [model.id])
+
+
+class UserView(ScalableModelView):
+    column_list = ('id', 'name', 'email', 'is_active')
+    column_sortable_list = ('id', 'email')
+    column_searchable_list = ('email',)
+    column_filters = indexed_filters(User.email)
+    form_excluded_columns = ('planets_favorites', 'characters_favorites')
+
+    def cache_keys(self, model):
+        return [user_key(model.id)] if model.id is not None else []
+
+
+class PlanetView(ScalableModelView):
+    column_list = ('id', 'name', 'population', 'diameter', 'climated', 'terrain', 'favorite_count', 'updated_at')
+    column_sortable_list = column_list
+    column_searchable_list = ('name', 'climated', 'terrain')
+    column_filters = indexed_filters(Planet.name, Planet.climated, Planet.terrain, Planet.population,
+                                     Planet.diameter, Planet.updated_at)
+    form_excluded_columns = ('residents', 'favorite_by')
+
+    def cache_keys(self, model):
+        #Cada residente guardado en la cache incluye su planeta.
+        if model.id is None:
+            return []
+        return [planet_key(model.id), *[character_key(resident.id) for resident in model.residents]]
+
+
+class CharacterView(ScalableModelView):
+    column_list = ('id', 'name', 'specie', 'gender', 'age', 'height', 'weight', 'planet_relationship',
+                   'favorite_count', 'updated_at')
+    column_sortable_list = ('id', 'name', 'specie', 'gender', 'age', 'height', 'weight', 'favorite_count', 'updated_at')
+    column_searchable_list = ('name', 'specie', 'gender')
+    column_filters = indexed_filters(Character.name, Character.specie, Character.gender, Character.age,
+                                     Character.height, Character.weight, Character.planet_id, Character.updated_at)
+    column_select_related_list = (Character.planet_relationship,) #joinedload: el planeta llega en la misma consulta.
+    form_excluded_columns = ('favorite_by',)
+    form_ajax_refs = {'planet_relationship': {'fields': ('name',)}}
+
+    def cache_keys(self, model):
+        #Antes del flush planet_id todavía es el planeta anterior y planet_relationship el nuevo: los dos
+        #planetas guardados en la cache incluyen al personaje en sus residentes.
+        keys = [character_key(model.id)] if model.id is not None else []
+        planets = {model.planet_id, model.planet_relationship.id if model.planet_relationship is not None else None}
+        return keys + [planet_key(id) for id in planets if id is not None]
+
+
+class FavoritesView(ScalableModelView):
+    #favorite_count se suma y se resta en la misma transacción que el favorito, igual que en los handlers.
+    #counted_model: modelo del contador; target: columna y relación del favorito que apuntan a él.
+    counted_model = None
+    target_column = None
+    target_relationship = None
+
+    def on_model_change(self, form, model, is_created):
+        super().on_model_change(form, model, is_created)
+        #Antes del flush la columna conserva el destino anterior aunque el formulario haya cambiado la relación.
+        old = None if is_created else inspect(model).committed_state.get(self.target_column, getattr(model, self.target_column))
+        target = getattr(model, self.target_relationship)
+        new = target.id if target is not None else getattr(model, self.target_column)
+        if old != new:
+            bump_favorites(self.counted_model, [id for id in (old,) if id is not None], -1)
+            bump_favorites(self.counted_model, [id for id in (new,) if id is not None], 1)
+
+    def on_model_delete(self, model):
+        super().on_model_delete(model)
+        bump_favorites(self.counted_model, [getattr(model, self.target_column)], -1)
+
+
+class FavoritePlanetsView(FavoritesView):
+    counted_model = Planet
+    target_column = 'planet_id'
+    target_relationship = 'planet_relationship'
+    column_list = ('id', 'user_relationship', 'planet_relationship')
+    column_sortable_list = ('id',)
+    column_filters = indexed_filters(FavoritePlanets.user_id, FavoritePlanets.planet_id)
+    column_select_related_list = (FavoritePlanets.user_relationship, FavoritePlanets.planet_relationship)
+    form_ajax_refs = {'user_relationship': {'fields': ('email',)}, 'planet_relationship': {'fields': ('name',)}}
+
+
+class FavoriteCharactersView(FavoritesView):
+    counted_model = Character
+    target_column = 'character_id'
+    target_relationship = 'character_relationship'
+    column_list = ('id', 'user_relationship', 'character_relationship')
+    column_sortable_list = ('id',)
+    column_filters = indexed_filters(FavoriteCharacters.user_id, FavoriteCharacters.character_id)
+    column_select_related_list = (FavoriteCharacters.user_relationship, FavoriteCharacters.character_relationship)
+    form_ajax_refs = {'user_relationship': {'fields': ('email',)}, 'character_relationship': {'fields': ('name',)}}
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    #ADMIN_COUNT_TTL=segundos que se reutiliza el COUNT(*) de cada tabla cuando no hay estimación de PostgreSQL.
+    count_ttl = int(os.getenv('ADMIN_COUNT_TTL', 60))
+    count_cache = LRUCache(max_entries=16)
 
     #Hay que agregar los modelos(tablas) así:
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(FavoritePlanets, db.session))
-    admin.add_view(ModelView(FavoriteCharacters, db.session))
-
-    
\ No newline at end of file
+    admin.add_view(UserView(User, db.session, count_cache, count_ttl))
+    admin.add_view(PlanetView(Planet, db.session, count_cache, count_ttl))
+    admin.add_view(CharacterView(Character, db.session, count_cache, count_ttl))
+    admin.add_view(FavoritePlanetsView(FavoritePlanets, db.session, count_cache, count_ttl))
+    admin.add_view(FavoriteCharactersView(FavoriteCharacters, db.session, count_cache, count_ttl))
+    return admin
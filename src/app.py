@@ -2,81 +2,310 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Flask, Blueprint, request, jsonify, current_app
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, load_only
+from werkzeug.local import LocalProxy
+from utils import APIException, generate_sitemap, keyset_paginate, wants_stream, stream_json_list, make_etag, set_validators, conditional_response, parse_fields, parse_expand, sparse_options, sparse_serializer, parse_sort, parse_filters, list_query, is_unique_violation, collection_version_query, expanded_models, version_last_modified
+from json_provider import FastJSONProvider
+from metrics import setup_metrics
+from compression import setup_compression
+from pool import engine_options_from_env, setup_pool
+from sqlite_profile import setup_sqlite
+from replicas import setup_replicas, read_only, reading_from_replica
+from cache import setup_cache, user_key, planet_key, character_key
+from search import setup_search, parse_search_args
+from catalog import setup_catalog
+from snapshot import setup_snapshot, current_snapshot, snapshot_list, snapshot_changed
+from counters import setup_counters, bump_favorites, top_favorites, TOP_DEFAULT_LIMIT, TOP_MAX_LIMIT
+from bulk import read_bulk_items, read_bulk_ids, read_id_list, validate_items, check_references, bulk_create, bulk_update, bulk_delete, delete_favorites
 from models import db, User, Planet, Character, FavoritePlanets, FavoriteCharacters #Hay que importar las columnas.
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+#Todas las rutas de la API. create_app() las registra en cada app que crea.
+api = Blueprint('api', __name__)
+
+#La cache y el índice de búsqueda son de cada app (los crea create_app): los handlers los usan a través de la app actual.
+CACHE = LocalProxy(lambda: current_app.extensions['resource_cache'])
+SEARCH = LocalProxy(lambda: current_app.extensions['search_index'])
+
+#Campos obligatorios de cada modelo en los endpoints bulk.
+PLANET_FIELDS = ('name', 'population', 'diameter', 'climated', 'terrain')
+CHARACTER_FIELDS = ('name', 'specie', 'gender', 'age', 'height', 'weight', 'planet_id')
+
+
+def env_flag(name, default='1'):
+    return os.getenv(name, default).lower() in ('1', 'true')
+
+def database_url_from_env():
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        return db_url.replace("postgres://", "postgresql://")
+    return "sqlite:////tmp/test.db"
+
+def setup_swagger(app):
+    from flask_swagger import swagger
+
+    @app.route('/swagger.json', methods=['GET'])
+    def swagger_spec():
+        return jsonify(swagger(app)), 200
+
+def create_app(config=None):
+    #config sobreescribe app.config. Interruptores (por defecto desde ENABLE_ADMIN, ENABLE_SWAGGER y ENABLE_MIGRATE):
+    #ADMIN_ENABLED, SWAGGER_ENABLED y MIGRATE_ENABLED. Lo que está apagado ni siquiera se importa: Flask-Admin
+    #y alembic (Flask-Migrate) son la mayor parte del tiempo de arranque de un worker.
+    #No abre conexiones a la base de datos, así que se puede crear en el master de gunicorn (--preload).
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app) #jsonify con orjson si está instalado.
+    app.url_map.strict_slashes = False
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url_from_env()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['ADMIN_ENABLED'] = env_flag('ENABLE_ADMIN')
+    app.config['SWAGGER_ENABLED'] = env_flag('ENABLE_SWAGGER')
+    app.config['MIGRATE_ENABLED'] = env_flag('ENABLE_MIGRATE')
+    app.config.update(config or {})
+    #Tamaño del pool, overflow, recycle y pre-ping se configuran con variables de entorno (DATABASE_POOL_SIZE, etc.).
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options_from_env(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    setup_replicas(app) #Réplicas de lectura opcionales (DATABASE_REPLICA_URLS).
+
+    if app.config['MIGRATE_ENABLED']: #Solo lo necesitan los comandos flask db.
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    db.init_app(app)
+    setup_pool(app, db) #Estadísticas del pool en /pool/stats.
+    setup_sqlite(app, db) #WAL, PRAGMAs y BEGIN IMMEDIATE en las escrituras cuando la base es un archivo SQLite.
+    CORS(app)
+    if app.config['ADMIN_ENABLED']:
+        from admin import setup_admin
+        setup_admin(app)
+    if app.config['SWAGGER_ENABLED']:
+        setup_swagger(app) #Especificación en /swagger.json.
+    setup_metrics(app) #Métricas por endpoint en /metrics.
+    setup_compression(app) #gzip/br/zstd según Accept-Encoding. Estadísticas en /compression/stats.
+    setup_cache(app) #Cache de lectura para los GET de un solo recurso.
+    setup_search(app) #Índice de búsqueda de texto para GET /search.
+    setup_counters(app) #Comando flask favorites-reconcile.
+    setup_catalog(app) #Comandos flask catalog export / flask catalog import.
+    setup_snapshot(app) #Catálogo en memoria para los GET de planetas y personajes (CATALOG_SNAPSHOT=1).
+    app.register_blueprint(api)
+    return app
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
+
+def collection_validators(model, expand, snapshot=None):
+    #Una sola consulta agregada (max(updated_at), count) nos dice si el listado cambió, sin serializarlo.
+    #Las relaciones de ?expand= también van en la versión. Con el snapshot en memoria los valores ya están calculados.
+    if snapshot is not None:
+        version = snapshot.table(model).version()
+        for related in expanded_models(model, expand):
+            version += snapshot.table(related).version()
+    else:
+        version = tuple(db.session.execute(collection_version_query(model, expand)).one())
+    return make_etag(request.full_path, *version), version_last_modified(version)
+
+def is_sparse_request():
+    return 'fields' in request.args or 'expand' in request.args
+
+def load_sparse(model, id, fields, expand):
+    #Con ?fields=/?expand= no usamos la cache: el SELECT trae solo las columnas y relaciones pedidas.
+    row = model.query.options(*sparse_options(model, fields, expand)).filter_by(id = id).first()
+    return sparse_serializer(fields, expand, model)(row) if row is not None else None
+
+@api.route('/search', methods=['GET'])
+@read_only
+def search():
+    #?q=luke sky&type=character&limit=20: resultados de planetas y personajes ordenados por relevancia (rank).
+    terms, kinds, limit = parse_search_args(request.args)
+    return jsonify({'msg': 'ok', 'data': SEARCH.search(terms, kinds, limit)}), 200
+
+def top_response(model):
+    try:
+        limit = int(request.args.get('limit', TOP_DEFAULT_LIMIT))
+    except ValueError:
+        raise APIException('El parámetro limit debe ser un número entero', status_code=400)
+    if limit < 1 or limit > TOP_MAX_LIMIT:
+        raise APIException(f'El parámetro limit debe estar entre 1 y {TOP_MAX_LIMIT}', status_code=400)
+    data = [dict(row.serialize(), favorite_count=row.favorite_count) for row in top_favorites(model, limit)]
+    return jsonify({'msg': 'ok', 'data': data}), 200
+
+@api.route('/planets/top', methods=['GET'])
+@read_only
+def top_planets():
+    #Ranking de los planetas más favoritos (?limit=10) leído del contador favorite_count.
+    return top_response(Planet)
+
+@api.route('/characters/top', methods=['GET'])
+@read_only
+def top_characters():
+    return top_response(Character)
+
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'msg': 'ok', 'data': CACHE.stats()}), 200
 #1)Crear las rutas y sus respectivos métodos.
 #2)All_user es un array de objetos por lo que hay que serializarlo con un for/map(usuario por usuario) y almacenarno en un array vacío.
 #3)Agregamos al body el array con los usuarios serializados.
-@app.route('/users', methods=['GET'])
+@api.route('/users', methods=['GET'])
+@read_only
 def get_users():
-    all_users = User.query.all() #query.all() me trae todos los usuarios del objeto User.
+    fields = parse_fields(request.args, User.SERIALIZE_FIELDS) #?fields=id,name: solo esas columnas en el SELECT y en la respuesta.
+    sort = parse_sort(request.args, User) #Los usuarios solo se ordenan por id (?sort=-id para los más recientes).
+    query, serialize = list_query(User.query, User, fields, set(), sort)
+    if wants_stream(request.args): #?stream=true devuelve la tabla completa por partes (sin paginar).
+        return stream_json_list(query, User, {'msg': 'ok', 'next': None}, serialize, sort), 200
+    #keyset_paginate nos trae solo una página de usuarios (?limit=&after=) en vez de toda la tabla.
+    all_users, next_cursor = keyset_paginate(query, User, request.args, sort)
     all_users_serialize = [] #almacenamos los usuarios ya serializados en un array vacío ya que "all_users" es un array de objetos.
     for user in all_users: #Recorremos cada usuario de "all_users" con un bucle for.
-        all_users_serialize.append(user.serialize()) #Agregamos cada usuario serializado a "all_users_serialize" con el método append()
+        all_users_serialize.append(serialize(user)) #Agregamos cada usuario serializado a "all_users_serialize" con el método append()
     response_body = {'msg': 'ok',
-        'data': all_users_serialize #Agregamos los usuarios al body.
+        'data': all_users_serialize, #Agregamos los usuarios al body.
+        'next': next_cursor #Cursor para pedir la siguiente página (None si no hay más).
     }
 
     return jsonify(response_body), 200 #Retornamos el body y un statuscode 200 (ok).
 
-@app.route('/user/<int:id>', methods=['GET'])
+@api.route('/user/<int:id>', methods=['GET'])
+@read_only
 def get_single_user(id): #Le pasamos el id ya que estamos solicitando información de un solo usuario.
-    single_user = User.query.get(id) #query.get(id) me trae un usuario específico de la tabla User.
-    if single_user is None:
+    def load_user():
+        single_user = User.query.get(id) #query.get(id) me trae un usuario específico de la tabla User.
+        return single_user.serialize() if single_user is not None else None
+    if is_sparse_request():
+        data = load_sparse(User, id, parse_fields(request.args, User.SERIALIZE_FIELDS), parse_expand(request.args, User))
+    else:
+        data = CACHE.get_or_load(user_key(id), load_user, store=not reading_from_replica()) #Solo vamos a la base de datos si no está en la cache.
+    if data is None:
         return jsonify({'msg': f'El usuario con id {id} no existe'}), 404 #StatusCode: Error del cliente.
     return jsonify ({
         'msg':'ok',
-        'data': single_user.serialize()
+        'data': data
     }), 200
 
-@app.route('/user/<int:id>/favorites', methods=['GET'])
+@api.route('/user/<int:id>/favorites', methods=['GET'])
+@read_only
 def get_favorites(id):
-    favorite_planets = FavoritePlanets.query.filter_by(user_id = id).all() #Devuelve todos los resultados que coinciden en forma de lista.
-    favorite_characters = FavoriteCharacters.query.filter_by(user_id = id). all()
+#Cargamos el usuario junto con sus favoritos en un número fijo de consultas (usuario + planetas + personajes)
+#en vez de una consulta por cada favorito (N+1). selectinload trae las listas y joinedload el objeto relacionado.
+#?fields= se aplica a los tres modelos: cada uno recibe los campos pedidos que tenga.
+    fields = parse_fields(request.args, set(User.SERIALIZE_FIELDS) | set(Planet.SERIALIZE_FIELDS) | set(Character.SERIALIZE_FIELDS))
+    user_fields, planet_fields, character_fields = [
+        None if fields is None else tuple(field for field in fields if field in model.SERIALIZE_FIELDS)
+        for model in (User, Planet, Character)]
+    planets_loader = selectinload(User.planets_favorites).joinedload(FavoritePlanets.planet_relationship)
+    characters_loader = selectinload(User.characters_favorites).joinedload(FavoriteCharacters.character_relationship)
+    options = [planets_loader, characters_loader]
+    if fields is not None:
+        options = [load_only(*[getattr(User, field) for field in user_fields]),
+                   planets_loader.load_only(*[getattr(Planet, field) for field in planet_fields]),
+                   characters_loader.load_only(*[getattr(Character, field) for field in character_fields])]
+    user = User.query.options(*options).filter_by(id = id).first()
+    if user is None:
+        return jsonify({'msg': f'El usuario con id {id} no existe'}), 404
     favorite_planets_serialize = []
-    for fav in favorite_planets:
-        favorite_planets_serialize.append(fav.planet_relationship.serialize())
+    for fav in user.planets_favorites:
+        favorite_planets_serialize.append(fav.planet_relationship.serialize(planet_fields))
     favorite_characters_serialize = []
-    for fav in favorite_characters:
-        favorite_characters_serialize.append(fav.character_relationship.serialize())
+    for fav in user.characters_favorites:
+        favorite_characters_serialize.append(fav.character_relationship.serialize(character_fields))
     
     return jsonify({'msg': 'ok',
-                    'user_data': favorite_planets[0].user_relationship.serialize(),
+                    'user_data': user.serialize(user_fields),
                     'favorite_planets': favorite_planets_serialize,
                     'favorite_characters': favorite_characters_serialize}), 200
 
-@app.route('/user', methods=['POST'])
+def duplicate_response(error, msg):
+    #Para los except IntegrityError: si la rechazó una restricción UNIQUE respondemos 400 con msg en vez de
+    #consultar antes si el valor ya existe. Cualquier otro IntegrityError se propaga.
+    db.session.rollback()
+    if not is_unique_violation(error):
+        raise error
+    return jsonify({'msg': msg}), 400
+
+def insert_favorite(favorite_model, column, model, user_id, target_id):
+    #INSERT ... SELECT que solo inserta si existen el usuario y el destino, sin consultarlos antes
+    #(SQLite no comprueba las claves foráneas). Devuelve cuántas filas insertó (0 o 1).
+    #Los duplicados los rechaza la restricción única con IntegrityError.
+    row = db.select(db.literal(user_id, db.Integer), db.literal(target_id, db.Integer)).where(
+        db.select(User.id).where(User.id == user_id).exists(), db.select(model.id).where(model.id == target_id).exists())
+    return db.session.execute(db.insert(favorite_model).from_select(['user_id', column.key], row)).rowcount
+
+def favorite_not_found(user_id, model, target_id, target_msg, favorite_msg):
+    #Solo en el camino de error: una consulta con dos EXISTS elige el mensaje del 404 (usuario, destino o favorito).
+    user_exists, target_exists = db.session.execute(db.select(db.select(User.id).where(User.id == user_id).exists(),
+                                                              db.select(model.id).where(model.id == target_id).exists())).one()
+    if not user_exists:
+        return jsonify({'msg': 'Usuario no encontrado'}), 404
+    if not target_exists:
+        return jsonify({'msg': target_msg}), 404
+    return jsonify({'msg': favorite_msg}), 404
+
+def sync_favorites(user_id, model, favorite_model, column, add_ids, remove_ids):
+    #Aplica la diferencia de un tipo de favorito con consultas por conjuntos: existencia de los destinos,
+    #favoritos actuales, un INSERT con executemany y un DELETE ... IN. No hace commit.
+    existing_targets = set(db.session.scalars(db.select(model.id).where(model.id.in_(add_ids)))) if add_ids else set()
+    missing = sorted(add_ids - existing_targets)
+    if missing:
+        return missing, []
+    current = set(db.session.scalars(db.select(column).where(favorite_model.user_id == user_id)))
+    to_insert = add_ids - current
+    to_delete = remove_ids & current
+    if to_insert:
+        db.session.execute(db.insert(favorite_model), [{'user_id': user_id, column.key: id} for id in to_insert])
+        bump_favorites(model, to_insert, 1)
+    if to_delete:
+        #RETURNING nos dice qué filas se borraron de verdad (otra solicitud pudo borrar alguna antes) para descontar solo esas.
+        deleted = db.session.scalars(db.delete(favorite_model).where(favorite_model.user_id == user_id, column.in_(to_delete))
+                                     .returning(column)).all()
+        bump_favorites(model, deleted, -1)
+    return missing, sorted((current | to_insert) - to_delete)
+
+@api.route('/user/<int:id>/favorites/batch', methods=['POST'])
+def batch_favorites(id):
+#Sincroniza muchos favoritos de un usuario en una sola solicitud y una sola transacción.
+#Body: {"add_planets": [...], "remove_planets": [...], "add_characters": [...], "remove_characters": [...]}
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'msg': 'Debes enviar información en el body'}), 400
+    add_planets = read_id_list(body, 'add_planets')
+    remove_planets = read_id_list(body, 'remove_planets')
+    add_characters = read_id_list(body, 'add_characters')
+    remove_characters = read_id_list(body, 'remove_characters')
+    if add_planets & remove_planets or add_characters & remove_characters:
+        return jsonify({'msg': 'No puedes agregar y eliminar el mismo favorito en la misma solicitud'}), 400
+    if db.session.get(User, id) is None:
+        return jsonify({'msg': 'Usuario no encontrado'}), 404
+
+    try:
+        missing_planets, favorite_planets = sync_favorites(id, Planet, FavoritePlanets, FavoritePlanets.planet_id, add_planets, remove_planets)
+        missing_characters, favorite_characters = sync_favorites(id, Character, FavoriteCharacters, FavoriteCharacters.character_id, add_characters, remove_characters)
+        if missing_planets or missing_characters: #Si algún id no existe no aplicamos nada.
+            db.session.rollback()
+            return jsonify({'msg': 'Algunos favoritos no existen',
+                            'missing_planets': missing_planets,
+                            'missing_characters': missing_characters}), 404
+        db.session.commit()
+    except IntegrityError: #Otra solicitud modificó los mismos favoritos a la vez (el INSERT o el commit fallan).
+        db.session.rollback()
+        return jsonify({'msg': 'Los favoritos cambiaron durante la solicitud, inténtalo de nuevo'}), 409
+
+    return jsonify({'msg': 'Favoritos actualizados exitosamente',
+                    'favorite_planets': favorite_planets,
+                    'favorite_characters': favorite_characters}), 200
+
+@api.route('/user', methods=['POST'])
 def add_user():
     body = request.get_json(silent=True) #Obtenemos los datos de la solicitud y los guardamos en "body".
     if body is None: #Condicionales para saber si el usuario llenó los campos.
@@ -87,173 +316,217 @@ def add_user():
         return jsonify({'msg': 'El campo email es obligatorio'}), 400
     if 'password' not in body:
         return jsonify({'msg': 'El campo password es obligatorio'}), 400
-#Hacemos una consulta a la base de datos para buscar si ya existe un usuario con el nombre proporcionado.
-#first() devuelve la primera coincidencia que encuentre. Si no encuentra ninguna, devuelve None.
-#filter_by sirve para verificar la existencia de múltiples campos en una sola consulta para condiciones simples de igualdad, sin necesidad de escribir ==.
-    existing_email = User.query.filter_by(email=body['email']).first()
-    if existing_email:
-        return jsonify({'msg': 'El email ingresado ya existe, por favor, ingresa otro'}), 400
 
     new_user = User() #Instanciamos el nuevo objeto "User".
     new_user.name = body['name'] # Asignamos el valor de 'name' al atributo name del objeto new_user.
     new_user.email = body['email']
     new_user.password = body['password'] #Hay que configurar el serializador para no serializar las contraseñas.
+    new_user.is_active = True #is_active es obligatorio (NOT NULL): los usuarios nuevos empiezan activos.
     
     db.session.add(new_user) #Agregamos el nuevo usuario.
-    db.session.commit() #Guarda el nuevo usuario.
+#No buscamos antes si el email existe: la restricción única de email rechaza el INSERT y respondemos lo mismo.
+    try:
+        db.session.commit() #Guarda el nuevo usuario.
+    except IntegrityError as error:
+        return duplicate_response(error, 'El email ingresado ya existe, por favor, ingresa otro')
 
     return jsonify({'msg': 'Usuario creado satisfactoriamente', #Retornamos un mensaje.
                     'data': new_user.serialize()}), 201 #Serializamos el nuevo usuario(new_user).
 
-@app.route('/users/<int:id>', methods=['PUT'])
+@api.route('/users/<int:id>', methods=['PUT'])
 def update_user(id):
     body = request.get_json(silent=True)
-    user = User.query.get(id)
-    if user is None:
-        return jsonify({'msg': 'Usuario no encontrado'}), 404
-    if body is None:
-        return jsonify({'msg': 'Debes enviar inforamción en el body'}), 400
-    if 'name' not in body:
-        return jsonify({'msg': 'El campo name es obligatorio'}), 400
-    if 'email' not in body:
-        return jsonify({'msg': 'El campo name es obligatorio'}), 400
-    if 'password' not in body:
+    if body is None or 'name' not in body or 'email' not in body or 'password' not in body:
+        #Solo en el camino de error buscamos al usuario: el 404 tiene prioridad sobre los errores del body.
+        if db.session.get(User, id) is None:
+            return jsonify({'msg': 'Usuario no encontrado'}), 404
+        if body is None:
+            return jsonify({'msg': 'Debes enviar inforamción en el body'}), 400
+        if 'name' not in body:
+            return jsonify({'msg': 'El campo name es obligatorio'}), 400
+        if 'email' not in body:
+            return jsonify({'msg': 'El campo name es obligatorio'}), 400
         return jsonify({'msg': 'El campo password es obligatorio'}), 400
     
-    existing_email = User.query.filter_by(email=body['email']).first()
-    if existing_email and existing_email.id != id:
-        return jsonify({'msg': 'El email ingresado ya existe, porfavor, ingresa otro'}), 400
-    
-    user.name = body.get('name', user.name)
-    user.email = body.get('email', user.email)
-    user.password = body.get('password', user.password) #Hay que configurar el serializador para no serializar las contraseñas.
+    #Un solo UPDATE ... RETURNING: si no devuelve ninguna fila el usuario no existe, y la restricción única
+    #rechaza el email de otro usuario (el mismo usuario puede conservar el suyo).
+    try:
+        user = db.session.execute(db.update(User).where(User.id == id)
+                                  .values(name=body['name'], email=body['email'], password=body['password']) #Hay que configurar el serializador para no serializar las contraseñas.
+                                  .returning(User)).scalar_one_or_none()
+    except IntegrityError as error:
+        return duplicate_response(error, 'El email ingresado ya existe, porfavor, ingresa otro')
+    if user is None:
+        db.session.rollback()
+        return jsonify({'msg': 'Usuario no encontrado'}), 404
+    data = user.serialize() #Antes del commit, que expira los atributos y obligaría a releer la fila.
 
     db.session.commit()
+    CACHE.invalidate(user_key(id))
 
     return jsonify({'msg': 'Usuario actualizado exitosamente',
-                    'data': user.serialize()}), 200
+                    'data': data}), 200
 
-@app.route('/user/<int:id>', methods=['DELETE'])
+@api.route('/user/<int:id>', methods=['DELETE'])
 def delete_user(id):
-    user = User.query.get(id)
-    if user is None:
+    #Sin cargar antes al usuario: borramos sus favoritos (descontando los contadores de cada planeta y personaje)
+    #y después el usuario. Si el DELETE del usuario no borra ninguna fila, no existía.
+    planet_ids = db.session.scalars(db.delete(FavoritePlanets).where(FavoritePlanets.user_id == id)
+                                    .returning(FavoritePlanets.planet_id)).all()
+    character_ids = db.session.scalars(db.delete(FavoriteCharacters).where(FavoriteCharacters.user_id == id)
+                                       .returning(FavoriteCharacters.character_id)).all()
+    deleted = db.session.execute(db.delete(User).where(User.id == id)).rowcount
+    if deleted == 0:
+        db.session.rollback()
         return jsonify({'msg': 'Usuario no encontrado'}), 404
-    
-    db.session.delete(user)
+    bump_favorites(Planet, planet_ids, -1)
+    bump_favorites(Character, character_ids, -1)
     db.session.commit()
+    CACHE.invalidate(user_key(id))
 
     return jsonify({'msg': 'Usuario eliminado exitosamente',}), 204
 
-@app.route('/favorite/planets/<int:planet_id>/<int:user_id>', methods=['POST'])
+@api.route('/favorite/planets/<int:planet_id>/<int:user_id>', methods=['POST'])
 def add_favorite_planet(planet_id, user_id):
     body = request.get_json(silent=True)
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'Usuario no encontrado'}),404
-    planet = Planet.query.get(planet_id)
-    if planet is None:
-        return jsonify({'msg': 'Planeta no encontrado'}), 404
-    
-    existing_favorite = FavoritePlanets.query.filter_by(user_id = user_id, planet_id = planet_id).first()
-    if existing_favorite:
+    #No buscamos antes el usuario, el planeta ni el favorito: el INSERT ... SELECT solo inserta si existen los dos
+    #y la restricción única (user_id, planet_id) rechaza los duplicados.
+    try:
+        inserted = insert_favorite(FavoritePlanets, FavoritePlanets.planet_id, Planet, user_id, planet_id)
+        if inserted:
+            bump_favorites(Planet, [planet_id], 1) #El contador se suma en la misma transacción que el favorito.
+            db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
         return jsonify({'msg': 'El planeta seleccionado ya está en favoritos'}), 400
-    
-    new_favorite = FavoritePlanets(user_id = user_id, planet_id = planet_id)
-    db.session.add(new_favorite)
-    db.session.commit()
+    if not inserted:
+        db.session.rollback()
+        return favorite_not_found(user_id, Planet, planet_id, 'Planeta no encontrado', 'Planeta no encontrado')
 
     return jsonify({'msg': 'Planeta agregado exitosamente'}), 200
 
-@app.route('/favorite/characters/<int:character_id>/<int:user_id>', methods=['POST'])
+@api.route('/favorite/characters/<int:character_id>/<int:user_id>', methods=['POST'])
 def add_favorite_character(character_id, user_id):
     body = request.get_json(silent=True)
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'Usuario no encontrado'}),404
-    character = Character.query.get(character_id)
-    if character is None:
-        return jsonify({'msg': 'Personaje no encontrado'}), 404
-     #Buscar la entrada de favoritos que relaciona al usuario con el planeta
-    existing_favorite = FavoriteCharacters.query.filter_by(user_id = user_id, character_id = character_id).first()
-    if existing_favorite:
+    #La restricción única (user_id, character_id) rechaza los duplicados en el mismo INSERT.
+    try:
+        inserted = insert_favorite(FavoriteCharacters, FavoriteCharacters.character_id, Character, user_id, character_id)
+        if inserted:
+            bump_favorites(Character, [character_id], 1)
+            db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
         return jsonify({'msg': 'El Personaje seleccionado ya está en favoritos'}), 400
-    
-    new_favorite = FavoriteCharacters(user_id = user_id, character_id = character_id)
-    db.session.add(new_favorite)
-    db.session.commit()
+    if not inserted:
+        db.session.rollback()
+        return favorite_not_found(user_id, Character, character_id, 'Personaje no encontrado', 'Personaje no encontrado')
 
     return jsonify({'msg': 'Personaje agregado exitosamente'}), 200
 
-@app.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['DELETE'])
+@api.route('/favorite/planet/<int:planet_id>/<int:user_id>', methods=['DELETE'])
 def delete_favorite_planet(planet_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'Usuario no encontrado'}), 404
-    planet = Planet.query.get(planet_id)
-    if planet is None:
-        return jsonify({'msg': 'Planeta no encontrado'}), 404
-    #Buscar la entrada de favoritos que relaciona al usuario con el planeta
-    favorite = FavoritePlanets.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-    #Verificar si la entrada de favoritos existe
-    if favorite is None:
-        return jsonify({'msg': 'Favorito no encontrado'}), 404
-    #Eliminar la entrada de favoritos
-    db.session.delete(favorite)
+    #Eliminamos la entrada de favoritos con un DELETE directo, sin buscar antes el usuario ni el planeta: rowcount
+    #nos dice si existía, y si dos solicitudes borran el mismo favorito a la vez solo una descuenta el contador.
+    deleted = db.session.execute(db.delete(FavoritePlanets).where(FavoritePlanets.user_id == user_id,
+                                                                  FavoritePlanets.planet_id == planet_id)).rowcount
+    if deleted == 0:
+        db.session.rollback()
+        return favorite_not_found(user_id, Planet, planet_id, 'Planeta no encontrado', 'Favorito no encontrado')
+    bump_favorites(Planet, [planet_id], -deleted)
     db.session.commit()
     
     return jsonify({'msg': 'Planeta eliminado de Favoritos exitosamente'}), 204
 
-@app.route('/favorite/character/<int:character_id>/<int:user_id>', methods=['DELETE'])
+@api.route('/favorite/character/<int:character_id>/<int:user_id>', methods=['DELETE'])
 def delete_favorite_character(character_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return jsonify({'msg': 'Usuario no encontrado'}), 404
-    character = Character.query.get(character_id)
-    if character is None:
-        return jsonify({'msg': 'Personaje no encontrado'}), 404
-    
-    favorite = FavoriteCharacters.query.filter_by(user_id=user_id, character_id=character_id).first()
-    
-    if favorite is None:
-        return jsonify({'msg': 'Favorito no encontrado'}), 404
-   
-    db.session.delete(favorite)
+    deleted = db.session.execute(db.delete(FavoriteCharacters).where(FavoriteCharacters.user_id == user_id,
+                                                                     FavoriteCharacters.character_id == character_id)).rowcount
+    if deleted == 0:
+        db.session.rollback()
+        return favorite_not_found(user_id, Character, character_id, 'Personaje no encontrado', 'Favorito no encontrado')
+    bump_favorites(Character, [character_id], -deleted)
     db.session.commit()
     
     return jsonify({'msg': 'Personaje eliminado de Favoritos exitosamente'}), 204
     
-@app.route('/planets', methods=['GET']) #Definimos la ruta para obtener los planetas.
+@api.route('/planets', methods=['GET']) #Definimos la ruta para obtener los planetas.
+@read_only
 def get_planets(): #Definimos la función que se ejecutará.
-    all_planets = Planet.query.all() #Accedemos al objeto "Planet" y lo traemos.
+    snapshot = current_snapshot() #None salvo con CATALOG_SNAPSHOT=1.
+    expand = parse_expand(request.args, Planet) #?expand=residents incluye los residentes (cargados con selectinload).
+    etag, last_modified = collection_validators(Planet, expand, snapshot)
+    not_modified = conditional_response(etag) #Si el cliente ya tiene este listado devolvemos 304 sin serializar nada.
+    if not_modified is not None:
+        return not_modified
+    fields = parse_fields(request.args, Planet.SERIALIZE_FIELDS)
+    sort = parse_sort(request.args, Planet) #?sort=-height
+    if snapshot is not None: #Filtros, orden y cursor se resuelven en memoria, con el mismo resultado que en SQL.
+        return set_validators(snapshot_list(snapshot, Planet, fields, expand, sort), etag, last_modified), 200
+    #Los filtros (?specie=, ?min_age=, ?name_prefix=...) se resuelven en SQL con los índices de la tabla.
+    query, serialize = list_query(Planet.query.filter(*parse_filters(request.args, Planet)), Planet, fields, expand, sort)
+    if wants_stream(request.args):
+        return set_validators(stream_json_list(query, Planet, {'msg': 'ok', 'next': None}, serialize, sort), etag, last_modified), 200
+    all_planets, next_cursor = keyset_paginate(query, Planet, request.args, sort) #Traemos solo una página de planetas.
     all_planets_serialize = [] #Definimos un array vacío donde guardaremos todos los objetos planet(all_planets)
     for planet in all_planets: #Recorremos cada "planet" del array de objetos "all_planets".
-        all_planets_serialize.append(planet.serialize()) #Serializamos cada planeta y lo almacenamos en nuestro array vacío con el método append()
-        response_body = { #Agregamos un mensaje y el array de planetas ya serializados en una variable.
-            'msg': 'ok',
-            'data': all_planets_serialize
-        }
+        all_planets_serialize.append(serialize(planet)) #Serializamos cada planeta y lo almacenamos en nuestro array vacío con el método append()
+    response_body = { #Agregamos un mensaje y el array de planetas ya serializados en una variable.
+        'msg': 'ok',
+        'data': all_planets_serialize,
+        'next': next_cursor
+    }
     
-    return jsonify(response_body), 200 #Retornamos nuestro diccionario(ya serializado) y lo convertimos en formato JSON(jsonify).
+    return set_validators(jsonify(response_body), etag, last_modified), 200 #Retornamos nuestro diccionario(ya serializado) y lo convertimos en formato JSON(jsonify).
     
-@app.route('/planet/<int:id>', methods=['GET'])
+@api.route('/planet/<int:id>', methods=['GET'])
+@read_only
 def single_planet(id):
-    single_planet = Planet.query.get(id) #query.get(id): Nos deja traer un planeta por el id del array de objetos Planet
-    if single_planet is None: #Condicional para saber si ese planeta existe.
+    #El planeta incluye sus residentes, así que la versión depende también de ellos (última modificación y cantidad).
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        version = snapshot.planet_version(id)
+    else:
+        residents_updated_at = db.select(func.max(Character.updated_at)).where(Character.planet_id == Planet.id).scalar_subquery()
+        residents_count = db.select(func.count(Character.id)).where(Character.planet_id == Planet.id).scalar_subquery()
+        version = db.session.query(Planet.updated_at, residents_updated_at, residents_count).filter(Planet.id == id).first()
+    if version is None: #Condicional para saber si ese planeta existe.
         return jsonify ({'msg': f'El planeta con id {id} no existe'}), 404 #Si el planeta no existe retornamos un mensaje, siempre en formato "jsonify".
-    residents_serialize = [] #Definimos un array donde guardaremos cada objeto(character).
-    for resident in single_planet.residents: #Iteramos cada personaje de la llave que relaciona los personajes con los planetas(residents).
-        residents_serialize.append(resident.serialize()) #Agregamos a nuestro array cada personaje(resident) y lo serializamos.
-    data = single_planet.serialize() #Serializamos el planeta.
-    data['residents'] = residents_serialize
+    last_modified = max(date for date in version[:2] if date is not None)
+    etag = make_etag('planet', id, *version)
+    if is_sparse_request(): #Cada combinación de fields/expand es una representación distinta.
+        etag = make_etag(etag, request.args.get('fields'), request.args.get('expand'))
+    not_modified = conditional_response(etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    def load_planet():
+        single_planet = Planet.query.get(id) #query.get(id): Nos deja traer un planeta por el id del array de objetos Planet
+        if single_planet is None:
+            return None
+        residents_serialize = [] #Definimos un array donde guardaremos cada objeto(character).
+        for resident in single_planet.residents: #Iteramos cada personaje de la llave que relaciona los personajes con los planetas(residents).
+            residents_serialize.append(resident.serialize()) #Agregamos a nuestro array cada personaje(resident) y lo serializamos.
+        data = single_planet.serialize() #Serializamos el planeta.
+        data['residents'] = residents_serialize
 #Asignamos el valor de residents_serialize a la llave 'residents' en el diccionario "data".
 #Puede ser cualquier variable y llave ya que lo que lo víncula es el serialize() de single_planet (planet=single_planet.serialize()).
-
-    return jsonify ({ #Retornamos un jsonify con un mensaje y la data(objeto).
+        return data
+    if snapshot is not None: #Sin ?fields= ni ?expand= el planeta incluye sus residentes, igual que load_planet.
+        data = snapshot.get(Planet, id, parse_fields(request.args, Planet.SERIALIZE_FIELDS),
+                            parse_expand(request.args, Planet, default=() if is_sparse_request() else ('residents',)))
+    elif is_sparse_request(): #Los residentes solo se cargan si se piden con ?expand=residents.
+        data = load_sparse(Planet, id, parse_fields(request.args, Planet.SERIALIZE_FIELDS), parse_expand(request.args, Planet))
+    else:
+        #Los planetas casi no cambian: los servimos desde la cache, siempre en la versión del ETag.
+        data = CACHE.get_or_load(planet_key(id), load_planet, version=etag, store=not reading_from_replica())
+    if data is None:
+        return jsonify ({'msg': f'El planeta con id {id} no existe'}), 404
+
+    return set_validators(jsonify ({ #Retornamos un jsonify con un mensaje y la data(objeto).
         'msg':'ok',
         'data': data #data es nuestro planeta. Ya serializado.
-    }), 200 #StatusCode: Ok
+    }), etag, last_modified), 200 #StatusCode: Ok
 
-@app.route('/planets', methods=['POST'])
+@api.route('/planets', methods=['POST'])
 def add_planets():
     body = request.get_json(silent=True)
     if body is None:
@@ -269,10 +542,6 @@ def add_planets():
     if 'terrain' not in body:
         return jsonify({'msg': 'El campo terrain es obligatorio'}), 400
     
-    existing_name = Planet.query.filter_by(name=body['name']).first()
-    if existing_name:
-        return jsonify({'msg': 'El name ingresado ya existe, por favor, ingresa otro'}), 400
-    
     new_planet = Planet() 
     new_planet.name = body['name']
     new_planet.population = body['population']
@@ -281,13 +550,19 @@ def add_planets():
     new_planet.terrain = body['terrain']
 
     db.session.add(new_planet)
-    db.session.commit()
+    try: #La restricción única de name rechaza los nombres repetidos: no hace falta buscarlos antes.
+        db.session.flush() #El INSERT nos da el id que registramos para los snapshots, en la misma transacción.
+        snapshot_changed(Planet, [new_planet.id])
+        db.session.commit()
+    except IntegrityError as error:
+        return duplicate_response(error, 'El name ingresado ya existe, por favor, ingresa otro')
+    SEARCH.upsert(Planet, [new_planet.id]) #El índice de búsqueda se actualiza fila a fila, nunca se reconstruye por consulta.
 
     return jsonify({
         'msg': 'Planeta creado satisfactoriamente',
         'data': new_planet.serialize()}), 201
 
-@app.route('/planet/<int:id>', methods=['PUT'])
+@api.route('/planet/<int:id>', methods=['PUT'])
 def update_planet(id):
     body = request.get_json(silent=True) #Obtenemos el "json" del cuerpo de la solicitud.
     planet = Planet.query.get(id) #Obtenemos el planeta por su id de la tabla Planet.
@@ -305,11 +580,6 @@ def update_planet(id):
         return jsonify({'msg': 'El campo climated es obligatorio'}), 400
     if 'terrain' not in body:
         return jsonify({'msg': 'El campo terrain es obligatorio'}), 400
-#Verificamos si name existe en los registros actuales.
-    existing_name = Planet.query.filter_by(name=body['name']).first()
-    #funciona=?
-    if existing_name and existing_name.id != id: #Aseguramos que el planeta que ya tiene el nombre no es el mismo planeta que estamos actualizando.
-        return jsonify({'msg': 'El name ingresado ya existe, por favor, ingresa otro'}), 400
 #No instanciamos planet ya que no estamos creando un nuevo objeto sino actualizando uno existente.
     planet.name = body.get('name', planet.name) #body.get('name'): Intentamos obtener el valor asociado a la llave 'name' del body
     planet.population = body.get('population',planet.population) #(planet.name): Si 'name' no está presente en body, se usa el valor actual de planet.name
@@ -317,12 +587,19 @@ def update_planet(id):
     planet.climated = body.get('climated', planet.climated)
     planet.terrain = body.get('terrain', planet.terrain)
 
-    db.session.commit() #Solo necesitamos guardarlo.
+    try:
+        snapshot_changed(Planet, [id])
+        db.session.commit() #Solo necesitamos guardarlo. Si name ya es de otro planeta, la restricción única lo rechaza.
+    except IntegrityError as error:
+        return duplicate_response(error, 'El name ingresado ya existe, por favor, ingresa otro')
+    #Los personajes guardados en cache incluyen su planeta, así que también los invalidamos.
+    CACHE.invalidate(planet_key(id), *[character_key(resident.id) for resident in planet.residents])
+    SEARCH.upsert(Planet, [id])
 #db.session.add() Solo se usa cuando vamos a agregar un nuevo registro.
     return jsonify ({'msg': 'Planeta actualizado existosamente',
                      'data': planet.serialize()}), 200
 
-@app.route('/planet/<int:id>', methods=['DELETE'])
+@api.route('/planet/<int:id>', methods=['DELETE'])
 def delete_planet(id):
     planet = Planet.query.get(id) #Buscamos el planeta por su id en la tabla "Planet".
     if planet is None: #Si no existe ese planeta devolvemos el jsonify con un mensaje y un status code.
@@ -335,39 +612,106 @@ def delete_planet(id):
 
     #serialize_planet = planet.serialize() Podemos serializar o no, dependiendo de si queremos mostrar más detalles del recurso eliminado. 
     
+    if planet.residents: #Como en DELETE /planets/bulk: planet_id de los personajes es obligatorio.
+        return jsonify({'msg': 'El planeta tiene residentes'}), 400
+    db.session.execute(delete_favorites(FavoritePlanets.planet_id, [id])) #Igual que en DELETE /planets/bulk.
     db.session.delete(planet) #Eliminamos el planeta.
+    snapshot_changed(Planet, [id])
     db.session.commit() #Guardamos los cambios.
+    CACHE.invalidate(planet_key(id))
+    SEARCH.remove(Planet, [id])
     
     return jsonify({'msg': 'Planeta eliminado existosamente'}),204 #No Content: el recurso se ha eliminado correctamente
 
-@app.route('/characters', methods=['GET'])
+#Endpoints bulk: reciben miles de elementos, validan en una pasada, comprueban la base de datos
+#con consultas IN y escriben todo en una sola transacción. Devuelven el resultado de cada elemento.
+@api.route('/planets/bulk', methods=['POST'])
+def bulk_add_planets():
+    items = read_bulk_items()
+    errors = validate_items(items, PLANET_FIELDS)
+    results, created = bulk_create(Planet, items, PLANET_FIELDS, errors)
+    created_ids = [result['id'] for result in results if result['status'] == 201]
+    SEARCH.upsert(Planet, created_ids)
+    return jsonify({'msg': f'{created} planetas creados', 'results': results}), 200
+
+@api.route('/planets/bulk', methods=['PUT'])
+def bulk_update_planets():
+    items = read_bulk_items()
+    errors = validate_items(items, PLANET_FIELDS, require_id=True)
+    results, updated = bulk_update(Planet, items, PLANET_FIELDS, errors)
+    updated_ids = [result['id'] for result in results if result['status'] == 200]
+    if updated_ids: #Los personajes en cache incluyen su planeta.
+        residents = db.session.scalars(db.select(Character.id).where(Character.planet_id.in_(updated_ids))).all()
+        CACHE.invalidate(*[planet_key(id) for id in updated_ids], *[character_key(id) for id in residents])
+        SEARCH.upsert(Planet, updated_ids)
+    return jsonify({'msg': f'{updated} planetas actualizados', 'results': results}), 200
+
+@api.route('/planets/bulk', methods=['DELETE'])
+def bulk_delete_planets():
+    ids = read_bulk_ids()
+    #Igual que en delete_planet, un planeta con residentes no se puede eliminar.
+    with_residents = db.session.scalars(db.select(Character.planet_id).where(Character.planet_id.in_(ids)).distinct())
+    blocked = {id: 'El planeta tiene residentes' for id in with_residents}
+    results, deleted = bulk_delete(Planet, ids, blocked, FavoritePlanets.planet_id)
+    CACHE.invalidate(*[planet_key(id) for id in deleted])
+    SEARCH.remove(Planet, deleted)
+    return jsonify({'msg': f'{len(deleted)} planetas eliminados', 'results': results}), 200
+
+@api.route('/characters', methods=['GET'])
+@read_only
 def get_characters():
-    all_characters = Character.query.all()
+    snapshot = current_snapshot()
+    expand = parse_expand(request.args, Character) #?expand=planet incluye el planeta (joinedload).
+    etag, last_modified = collection_validators(Character, expand, snapshot)
+    not_modified = conditional_response(etag)
+    if not_modified is not None:
+        return not_modified
+    fields = parse_fields(request.args, Character.SERIALIZE_FIELDS)
+    sort = parse_sort(request.args, Character) #?sort=-height
+    if snapshot is not None:
+        return set_validators(snapshot_list(snapshot, Character, fields, expand, sort), etag, last_modified), 200
+    #Los filtros (?specie=, ?min_age=, ?name_prefix=...) se resuelven en SQL con los índices de la tabla.
+    query, serialize = list_query(Character.query.filter(*parse_filters(request.args, Character)), Character, fields, expand, sort)
+    if wants_stream(request.args):
+        return set_validators(stream_json_list(query, Character, {'msg': 'ok', 'next': None}, serialize, sort), etag, last_modified), 200
+    all_characters, next_cursor = keyset_paginate(query, Character, request.args, sort)
     all_characters_serialize = [] 
     for character in all_characters:
-        all_characters_serialize.append(character.serialize())
+        all_characters_serialize.append(serialize(character))
 
-    return ({
+    return set_validators(jsonify({
         'msg': 'ok',
-        'data': all_characters_serialize
-    }), 200
+        'data': all_characters_serialize,
+        'next': next_cursor
+    }), etag, last_modified), 200
 
-@app.route('/character/<int:id>', methods=['GET'])
+@api.route('/character/<int:id>', methods=['GET'])
+@read_only
 def get_single_character(id):
-    single_character = Character.query.get(id)
-    if single_character is None:
-        return jsonify({'msg': f'El character con id {id} no existe'}), 404
-    
-    data = single_character.serialize() #Serializamos el personaje y almacenamos en variable.
+    def load_character():
+        single_character = Character.query.get(id)
+        if single_character is None:
+            return None
+        data = single_character.serialize() #Serializamos el personaje y almacenamos en variable.
 #Asignamos la llave 'data' al diccionario "character" y su valor es un diccionario contenido en single_character(planet_relationship).
 #es decir, la relación entre character y planet(un planeta) serializado.
-    data['planet'] = single_character.planet_relationship.serialize()
+        data['planet'] = single_character.planet_relationship.serialize()
+        return data
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        data = snapshot.get(Character, id, parse_fields(request.args, Character.SERIALIZE_FIELDS),
+                            parse_expand(request.args, Character, default=() if is_sparse_request() else ('planet',)))
+    elif is_sparse_request():
+        data = load_sparse(Character, id, parse_fields(request.args, Character.SERIALIZE_FIELDS), parse_expand(request.args, Character))
+    else:
+        data = CACHE.get_or_load(character_key(id), load_character, store=not reading_from_replica())
+    if data is None:
+        return jsonify({'msg': f'El character con id {id} no existe'}), 404
 
-    
     return jsonify({'msg': 'ok',
                     'data': data}), 200
 
-@app.route('/characters', methods=['POST'])
+@api.route('/characters', methods=['POST'])
 def add_characters():
     body = request.get_json(silent=True)
     if body is None:
@@ -384,10 +728,10 @@ def add_characters():
         return jsonify({'msg': 'El campo height es obligatorio'}), 400
     if 'weight' not in body:
         return jsonify({'msg': 'El campo weight es obligatorio'}), 400
-    
-    existing_name = Character.query.filter_by(name=body['name']).first()
-    if existing_name:
-        return jsonify({'msg': 'El name ingresado ya existe, por favor, ingresa otro'}), 400
+    if 'planet_id' not in body:
+        return jsonify({'msg': 'El campo planet_id es obligatorio'}), 400
+    if Planet.query.get(body['planet_id']) is None:
+        return jsonify({'msg': 'Planeta no encontrado'}), 404
     
     new_character = Character()
     new_character.name = body['name']
@@ -396,14 +740,22 @@ def add_characters():
     new_character.age = body['age']
     new_character.height = body['height']
     new_character.weight = body['weight']
+    new_character.planet_id = body['planet_id']
 
     db.session.add(new_character)
-    db.session.commit()
+    try: #La restricción única de name rechaza los nombres repetidos.
+        db.session.flush()
+        snapshot_changed(Character, [new_character.id])
+        db.session.commit()
+    except IntegrityError as error:
+        return duplicate_response(error, 'El name ingresado ya existe, por favor, ingresa otro')
+    CACHE.invalidate(planet_key(new_character.planet_id)) #El planeta tiene un nuevo residente.
+    SEARCH.upsert(Character, [new_character.id])
 
     return jsonify({'msg': 'Personaje creado satisfactoriamente',
                     'data': new_character.serialize()}), 201 #Created: Nuevo recurso se ha creado exitosamente.
 
-@app.route('/character/<int:id>', methods=['PUT'])
+@api.route('/character/<int:id>', methods=['PUT'])
 def update_character(id):
      #Obtenemos los datos JSON del cuerpo de la solicitud.
     body = request.get_json(silent=True)
@@ -426,10 +778,13 @@ def update_character(id):
         return jsonify({'msg': 'El campo height es obligatorio'}), 400
     if 'weight' not in body:
         return jsonify({'msg': 'El campo weight es obligatorio'}), 400
-    
-    existing_name = Character.query.filter_by(name=body['name']).first()
-    if existing_name and existing_name.id != id:
-        return jsonify({'msg': 'El name ingresado ya existe, por favor, ingresa otro'}), 400
+    #planet_id es opcional: permite mudar al personaje a otro planeta. Lo comprobamos porque SQLite no valida las claves foráneas.
+    if 'planet_id' in body and Planet.query.get(body['planet_id']) is None:
+        #Solo en el camino de error: un name repetido tiene prioridad sobre el planeta inexistente.
+        if db.session.scalar(db.select(Character.id).where(Character.name == body['name'], Character.id != id)) is not None:
+            return jsonify({'msg': 'El name ingresado ya existe, por favor, ingresa otro'}), 400
+        return jsonify({'msg': 'Planeta no encontrado'}), 404
+    old_planet_id = character.planet_id
     #Actualizamos los atributos del personaje con los datos proporcionados.
     character.name = body.get('name', character.name)
     character.specie = body.get('specie', character.specie)
@@ -437,24 +792,73 @@ def update_character(id):
     character.age = body.get('age', character.age)
     character.height = body.get('height', character.height)
     character.weight = body.get('weight', character.weight)
-    #Guardamos los cambios en la base de datos.
-    db.session.commit()
+    character.planet_id = body.get('planet_id', character.planet_id)
+    #Guardamos los cambios en la base de datos. Si name ya es de otro personaje, la restricción única lo rechaza.
+    try:
+        snapshot_changed(Character, [id])
+        db.session.commit()
+    except IntegrityError as error:
+        return duplicate_response(error, 'El name ingresado ya existe, por favor, ingresa otro')
+    #Invalidamos el personaje y los residentes del planeta anterior y del nuevo.
+    CACHE.invalidate(character_key(id), planet_key(old_planet_id), planet_key(character.planet_id))
+    SEARCH.upsert(Character, [id])
     #Devolvemos el objeto actualizado y serializado
     return jsonify({'msg': 'Personaje actualizado exitosamente',
                     'data': character.serialize()}), 200
 
-@app.route('/character/<int:id>', methods=['DELETE'])
+@api.route('/character/<int:id>', methods=['DELETE'])
 def delete_character(id):
     character = Character.query.get(id)
     if character is None:
         return jsonify({'msg': 'Personaje no encontrado'}), 404
     
+    planet_id = character.planet_id
+    db.session.execute(delete_favorites(FavoriteCharacters.character_id, [id])) #Igual que en DELETE /characters/bulk.
     db.session.delete(character)
+    snapshot_changed(Character, [id])
     db.session.commit()
+    CACHE.invalidate(character_key(id), planet_key(planet_id))
+    SEARCH.remove(Character, [id])
 
     return jsonify({'msg': 'Personaje eliminado exitosamente',}), 204
 
+@api.route('/characters/bulk', methods=['POST'])
+def bulk_add_characters():
+    items = read_bulk_items()
+    errors = validate_items(items, CHARACTER_FIELDS)
+    check_references(items, errors, 'planet_id', Planet, 'Planeta no encontrado')
+    results, created = bulk_create(Character, items, CHARACTER_FIELDS, errors)
+    created_planets = {items[result['index']]['planet_id'] for result in results if result['status'] == 201}
+    CACHE.invalidate(*[planet_key(id) for id in created_planets])
+    created_ids = [result['id'] for result in results if result['status'] == 201]
+    SEARCH.upsert(Character, created_ids)
+    return jsonify({'msg': f'{created} personajes creados', 'results': results}), 200
+
+@api.route('/characters/bulk', methods=['PUT'])
+def bulk_update_characters():
+    items = read_bulk_items()
+    errors = validate_items(items, CHARACTER_FIELDS, require_id=True)
+    check_references(items, errors, 'planet_id', Planet, 'Planeta no encontrado')
+    ids = [item['id'] for index, item in enumerate(items) if index not in errors]
+    old_planets = set(db.session.scalars(db.select(Character.planet_id).where(Character.id.in_(ids)))) if ids else set()
+    results, updated = bulk_update(Character, items, CHARACTER_FIELDS, errors)
+    updated_items = [items[result['index']] for result in results if result['status'] == 200]
+    new_planets = {item['planet_id'] for item in updated_items}
+    CACHE.invalidate(*[character_key(item['id']) for item in updated_items], *[planet_key(id) for id in old_planets | new_planets])
+    updated_ids = [item['id'] for item in updated_items]
+    SEARCH.upsert(Character, updated_ids)
+    return jsonify({'msg': f'{updated} personajes actualizados', 'results': results}), 200
+
+@api.route('/characters/bulk', methods=['DELETE'])
+def bulk_delete_characters():
+    ids = read_bulk_ids()
+    planets = set(db.session.scalars(db.select(Character.planet_id).where(Character.id.in_(ids))))
+    results, deleted = bulk_delete(Character, ids, favorites=FavoriteCharacters.character_id)
+    CACHE.invalidate(*[character_key(id) for id in deleted], *[planet_key(id) for id in planets])
+    SEARCH.remove(Character, deleted)
+    return jsonify({'msg': f'{len(deleted)} personajes eliminados', 'results': results}), 200
+
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
 #Preguntar: orden de objetos (relación characters/planet) en postman aparece el objeto planet en medio del objeto character.
\ No newline at end of file
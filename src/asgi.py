@@ -0,0 +1,379 @@
+"""
+Async serving mode (SERVER_MODE=async, see gunicorn_config.py).
+
+The read endpoints (/users, /planets, /characters, the single-resource GETs and /user/<id>/favorites)
+run on the asyncio event loop with an async SQLAlchemy engine (aiosqlite / asyncpg), so a worker keeps
+serving other requests while it waits on the database. Every other route is forwarded to the Flask app.
+Responses are the same as in the synchronous mode: body, status, ETag/Last-Modified and 304s, plus the
+layers the Flask app adds around its routes:
+- compression (compression.py): same negotiation, codecs, cache, ETag suffix and /compression/stats;
+- /metrics (metrics.py): duration, DB time, query count and size under the same route labels;
+- read replicas (replicas.py): one async engine per DATABASE_REPLICA_URLS entry, round robin, and the primary
+  inside the read-your-writes window; replica reads do not fill the read cache;
+- catalog snapshot (snapshot.py): with CATALOG_SNAPSHOT=1 the planet and character routes are forwarded to the
+  Flask app, which serves them from memory.
+
+Needs: uvicorn, asgiref, sqlalchemy[asyncio] and aiosqlite (SQLite) or asyncpg (PostgreSQL),
+the [async] category of the Pipfile (pipenv install --categories async).
+"""
+import itertools
+import re
+import time
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import joinedload, selectinload, load_only
+from werkzeug.http import http_date, parse_cookie, parse_date, parse_etags, quote_etag
+from app import create_app
+from cache import user_key, planet_key, character_key
+from metrics import track_queries
+from replicas import replica_urls_from_env, recent_write
+from sqlite_profile import apply_pragmas, sqlite_file
+from models import User, Planet, Character, FavoritePlanets, FavoriteCharacters
+from utils import (APIException, parse_page_args, make_etag, STREAM_BATCH_SIZE, parse_fields, parse_expand,
+                   sparse_options, sparse_serializer, parse_sort, parse_filters, sort_order, keyset_after, next_page,
+                   row_columns, etag_variants, collection_version_query, version_last_modified)
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+#Las rutas que no son async las atiende esta app Flask. Los workers nunca ejecutan migraciones.
+flask_app = create_app({'MIGRATE_ENABLED': False})
+CACHE = flask_app.extensions['resource_cache']
+COMPRESSION = flask_app.extensions['response_compression']
+METRICS = flask_app.extensions['request_metrics']
+
+#Las mismas réplicas que registra setup_replicas, en el mismo orden.
+REPLICA_URLS = replica_urls_from_env()
+_replica_cycle = itertools.cycle(REPLICA_URLS) if REPLICA_URLS else None
+
+_sessionmakers = {}
+
+def async_database_url(url):
+    scheme, rest = url.split('://', 1)
+    return ASYNC_DRIVERS.get(scheme, scheme) + '://' + rest
+
+def get_sessionmaker(url=None):
+    #Un engine por base (el primario con url=None y cada réplica). Se crea en el primer request de cada worker,
+    #nunca antes del fork de gunicorn.
+    url = url or flask_app.config['SQLALCHEMY_DATABASE_URI']
+    if url not in _sessionmakers:
+        engine = create_async_engine(async_database_url(url))
+        if 'sqlite_pragmas' in flask_app.extensions and sqlite_file(engine.sync_engine):
+            apply_pragmas(engine.sync_engine, flask_app.extensions['sqlite_pragmas']) #Mismos PRAGMA que las conexiones síncronas.
+        _sessionmakers[url] = async_sessionmaker(engine, expire_on_commit=False)
+    return _sessionmakers[url]
+
+def replica_url(request):
+    #Igual que @read_only: una réplica por turnos, o None (el primario) dentro de la ventana read-your-writes.
+    if _replica_cycle is None or recent_write(request.cookies):
+        return None
+    return next(_replica_cycle)
+
+
+def dumps(data):
+    #Mismo formato que jsonify fuera de debug: claves ordenadas, separadores compactos y salto de línea final.
+    return (flask_app.json.dumps(data, separators=(',', ':')) + '\n').encode()
+
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = dict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+        self.replica_url = replica_url(self) #None: las consultas van al primario.
+
+    @property
+    def full_path(self):
+        #Igual que request.full_path en Flask (se usa en los ETag de los listados).
+        return f'{self.path}?{self.query_string}'
+
+    def is_fresh(self, etag, last_modified=None):
+        if 'if-none-match' in self.headers:
+            etags = parse_etags(self.headers['if-none-match'])
+            return any(etags.contains(tag) for tag in etag_variants(etag))
+        since = parse_date(self.headers.get('if-modified-since'))
+        if since is not None and last_modified is not None:
+            return last_modified.replace(tzinfo=since.tzinfo, microsecond=0) <= since
+        return False
+
+
+class JSONResponse:
+    def __init__(self, data, status=200, etag=None, last_modified=None, body=None):
+        self.body = dumps(data) if body is None else body
+        self.status = status
+        self.etag = etag
+        self.last_modified = last_modified
+        self.coding = None #Content-Encoding, si se comprimió.
+        self.vary = False #Vary: Accept-Encoding.
+        self.extra_headers = []
+
+    def compress(self, request, route):
+        #Las mismas reglas que compress_response en compression.py.
+        coding = COMPRESSION.negotiate(request.headers.get('accept-encoding'))
+        if self.status == 304:
+            #El cliente revalida la versión comprimida: el 304 lleva el mismo ETag que tendría el 200.
+            if self.etag and coding and parse_etags(request.headers.get('if-none-match')).contains(f'{self.etag}-{coding}'):
+                self.etag = f'{self.etag}-{coding}'
+                self.vary = True
+            return
+        if self.status < 200 or self.status == 204 or len(self.body) < COMPRESSION.min_size:
+            return
+        self.vary = True
+        if coding is None:
+            return
+        self.body = COMPRESSION.compress_body(route, coding, self.body)
+        self.set_coding(coding)
+
+    def set_coding(self, coding):
+        self.coding = coding
+        if self.etag is not None:
+            self.etag = f'{self.etag}-{coding}'
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def headers(self):
+        headers = [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]
+        if self.etag is not None:
+            headers.append((b'etag', quote_etag(self.etag).encode()))
+        if self.last_modified is not None:
+            headers.append((b'last-modified', http_date(self.last_modified).encode()))
+        if self.vary:
+            headers.append((b'vary', b'Accept-Encoding'))
+        if self.coding is not None:
+            headers.append((b'content-encoding', self.coding.encode()))
+        return headers + self.extra_headers
+
+    async def send(self, send):
+        headers = self.headers() + [(b'content-length', str(len(self.body)).encode())]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def not_modified(etag, last_modified=None):
+    return JSONResponse(None, status=304, etag=etag, last_modified=last_modified, body=b'')
+
+
+class StreamingJSONResponse(JSONResponse):
+    #Equivalente a stream_json_list: escribe el array por lotes mientras se recorre la consulta.
+    def __init__(self, statement, envelope, etag, last_modified, serialize, scalars, database_url):
+        super().__init__(None, etag=etag, last_modified=last_modified, body=b'')
+        self.statement = statement
+        self.envelope = envelope
+        self.serialize = serialize
+        self.scalars = scalars #True si el statement devuelve objetos del ORM, False si son filas de columnas.
+        self.database_url = database_url
+        self.stream = None #StreamCompressor si se comprime.
+
+    def compress(self, request, route):
+        #Como en compress_response: las respuestas en streaming se comprimen parte a parte, sin tamaño mínimo.
+        self.vary = True
+        coding = COMPRESSION.negotiate(request.headers.get('accept-encoding'))
+        if coding is not None:
+            self.stream = COMPRESSION.stream_compressor(route, coding)
+            self.set_coding(coding)
+
+    @property
+    def size(self):
+        return None #Igual que en Flask: el tamaño no se conoce al terminar la solicitud.
+
+    async def send(self, send):
+        async def send_part(part, more_body=True):
+            if self.stream is not None:
+                part = self.stream.compress(part) + (b'' if more_body else self.stream.finish())
+            if part or not more_body:
+                await send({'type': 'http.response.body', 'body': part, 'more_body': more_body})
+
+        head, tail = dumps(dict(self.envelope, data=[]))[:-1].split(b'[]', 1)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': self.headers()})
+        try:
+            await send_part(head + b'[')
+            separator = b''
+            async with get_sessionmaker(self.database_url)() as session:
+                result = await session.stream(self.statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+                if self.scalars:
+                    result = result.scalars()
+                async for rows in result.partitions():
+                    #Un dumps() por lote sin los corchetes ni el salto de línea final, igual que stream_json_list.
+                    await send_part(separator + dumps([self.serialize(row) for row in rows])[1:-2])
+                    separator = b','
+
+            await send_part(b']' + tail + b'\n', more_body=False)
+        finally:
+            if self.stream is not None:
+                self.stream.close()
+
+
+async def list_resource(request, session, model, conditional=True):
+    etag = last_modified = None
+    expand = parse_expand(request.args, model)
+    if conditional: #Igual que collection_validators: las relaciones de ?expand= también van en la versión.
+        version = tuple((await session.execute(collection_version_query(model, expand))).one())
+        etag, last_modified = make_etag(request.full_path, *version), version_last_modified(version)
+        if request.is_fresh(etag):
+            return not_modified(etag)
+    fields = parse_fields(request.args, model.SERIALIZE_FIELDS)
+    sort = parse_sort(request.args, model)
+    if expand: #Igual que list_query: objetos del ORM solo si hay relaciones que cargar.
+        statement = select(model).options(*sparse_options(model, fields, expand, sort))
+        serialize = sparse_serializer(fields, expand, model)
+    else:
+        columns, serialize = row_columns(model, fields, sort)
+        statement = select(*columns)
+    statement = statement.where(*parse_filters(request.args, model)).order_by(*sort_order(model, sort))
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return StreamingJSONResponse(statement, {'msg': 'ok', 'next': None}, etag, last_modified, serialize, bool(expand),
+                                     request.replica_url)
+    limit, after = parse_page_args(request.args, sort)
+    statement = statement.limit(limit + 1)
+    if after is not None:
+        statement = statement.where(keyset_after(model, sort, after))
+    result = await session.execute(statement)
+    rows, next_cursor = next_page((result.scalars() if expand else result).all(), limit, sort)
+    return JSONResponse({'msg': 'ok', 'data': [serialize(row) for row in rows], 'next': next_cursor},
+                        etag=etag, last_modified=last_modified)
+
+def is_sparse_request(request):
+    return 'fields' in request.args or 'expand' in request.args
+
+async def load_sparse(session, model, id, request):
+    #Con ?fields=/?expand= no usamos la cache, igual que en app.py.
+    fields = parse_fields(request.args, model.SERIALIZE_FIELDS)
+    expand = parse_expand(request.args, model)
+    row = (await session.scalars(select(model).where(model.id == id).options(*sparse_options(model, fields, expand)))).first()
+    return sparse_serializer(fields, expand, model)(row) if row is not None else None
+
+async def get_users(request, session):
+    return await list_resource(request, session, User, conditional=False)
+
+async def get_planets(request, session):
+    return await list_resource(request, session, Planet)
+
+async def get_characters(request, session):
+    return await list_resource(request, session, Character)
+
+async def get_single_user(request, session, id):
+    async def load_user():
+        user = await session.get(User, id)
+        return user.serialize() if user is not None else None
+    if is_sparse_request(request):
+        data = await load_sparse(session, User, id, request)
+    else:
+        data = await CACHE.aget_or_load(user_key(id), load_user, store=request.replica_url is None)
+    if data is None:
+        return JSONResponse({'msg': f'El usuario con id {id} no existe'}, status=404)
+    return JSONResponse({'msg': 'ok', 'data': data})
+
+async def get_favorites(request, session, id):
+    fields = parse_fields(request.args, set(User.SERIALIZE_FIELDS) | set(Planet.SERIALIZE_FIELDS) | set(Character.SERIALIZE_FIELDS))
+    user_fields, planet_fields, character_fields = [
+        None if fields is None else tuple(field for field in fields if field in model.SERIALIZE_FIELDS)
+        for model in (User, Planet, Character)]
+    planets_loader = selectinload(User.planets_favorites).joinedload(FavoritePlanets.planet_relationship)
+    characters_loader = selectinload(User.characters_favorites).joinedload(FavoriteCharacters.character_relationship)
+    options = [planets_loader, characters_loader]
+    if fields is not None:
+        options = [load_only(*[getattr(User, field) for field in user_fields]),
+                   planets_loader.load_only(*[getattr(Planet, field) for field in planet_fields]),
+                   characters_loader.load_only(*[getattr(Character, field) for field in character_fields])]
+    user = (await session.scalars(select(User).where(User.id == id).options(*options))).first()
+    if user is None:
+        return JSONResponse({'msg': f'El usuario con id {id} no existe'}, status=404)
+    return JSONResponse({'msg': 'ok',
+                         'user_data': user.serialize(user_fields),
+                         'favorite_planets': [fav.planet_relationship.serialize(planet_fields) for fav in user.planets_favorites],
+                         'favorite_characters': [fav.character_relationship.serialize(character_fields) for fav in user.characters_favorites]})
+
+async def single_planet(request, session, id):
+    residents_updated_at = select(func.max(Character.updated_at)).where(Character.planet_id == Planet.id).scalar_subquery()
+    residents_count = select(func.count(Character.id)).where(Character.planet_id == Planet.id).scalar_subquery()
+    version = (await session.execute(select(Planet.updated_at, residents_updated_at, residents_count).where(Planet.id == id))).first()
+    if version is None:
+        return JSONResponse({'msg': f'El planeta con id {id} no existe'}, status=404)
+    last_modified = max(date for date in version[:2] if date is not None)
+    etag = make_etag('planet', id, *version)
+    if is_sparse_request(request): #Cada combinación de fields/expand es una representación distinta.
+        etag = make_etag(etag, request.args.get('fields'), request.args.get('expand'))
+    if request.is_fresh(etag, last_modified):
+        return not_modified(etag, last_modified)
+
+    async def load_planet():
+        planet = (await session.scalars(select(Planet).where(Planet.id == id).options(selectinload(Planet.residents)))).first()
+        if planet is None:
+            return None
+        data = planet.serialize()
+        data['residents'] = [resident.serialize() for resident in planet.residents]
+        return data
+    if is_sparse_request(request):
+        data = await load_sparse(session, Planet, id, request)
+    else:
+        data = await CACHE.aget_or_load(planet_key(id), load_planet, version=etag, store=request.replica_url is None) #Igual que en app.py.
+    if data is None:
+        return JSONResponse({'msg': f'El planeta con id {id} no existe'}, status=404)
+    return JSONResponse({'msg': 'ok', 'data': data}, etag=etag, last_modified=last_modified)
+
+async def get_single_character(request, session, id):
+    async def load_character():
+        character = (await session.scalars(select(Character).where(Character.id == id).options(joinedload(Character.planet_relationship)))).first()
+        if character is None:
+            return None
+        data = character.serialize()
+        data['planet'] = character.planet_relationship.serialize()
+        return data
+    if is_sparse_request(request):
+        data = await load_sparse(session, Character, id, request)
+    else:
+        data = await CACHE.aget_or_load(character_key(id), load_character, store=request.replica_url is None)
+    if data is None:
+        return JSONResponse({'msg': f'El character con id {id} no existe'}, status=404)
+    return JSONResponse({'msg': 'ok', 'data': data})
+
+
+#(patrón, handler, regla de la ruta en Flask (etiqueta de /metrics y /compression/stats), ruta del catálogo).
+ROUTES = [
+    (re.compile(r'^/users/?$'), get_users, '/users', False),
+    (re.compile(r'^/user/(\d+)/?$'), get_single_user, '/user/<int:id>', False),
+    (re.compile(r'^/user/(\d+)/favorites/?$'), get_favorites, '/user/<int:id>/favorites', False),
+    (re.compile(r'^/planets/?$'), get_planets, '/planets', True),
+    (re.compile(r'^/planet/(\d+)/?$'), single_planet, '/planet/<int:id>', True),
+    (re.compile(r'^/characters/?$'), get_characters, '/characters', True),
+    (re.compile(r'^/character/(\d+)/?$'), get_single_character, '/character/<int:id>', True),
+]
+#Con el snapshot en memoria las rutas del catálogo no consultan la base de datos: las atiende la app Flask.
+SNAPSHOT_ENABLED = 'catalog_snapshot' in flask_app.extensions
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+async def handle(scope, handler, route, match):
+    started = time.perf_counter()
+    request = Request(scope)
+    with track_queries() as queries:
+        try:
+            async with get_sessionmaker(request.replica_url)() as session:
+                response = await handler(request, session, *[int(group) for group in match.groups()])
+        except APIException as error:
+            response = JSONResponse(error.to_dict(), status=error.status_code)
+    response.compress(request, route)
+    #Como el after_request de metrics.py: se mide antes de enviar el body (en streaming, antes de recorrer la consulta).
+    timing = METRICS.finish('GET', route, request.path, response.status, time.perf_counter() - started,
+                            queries[1], queries[0], response.size)
+    if timing is not None:
+        response.extra_headers.append((b'server-timing', timing.encode()))
+    return response
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        for pattern, handler, route, catalog in ROUTES:
+            match = pattern.match(scope['path'])
+            if match is None or (catalog and SNAPSHOT_ENABLED):
+                continue
+            response = await handle(scope, handler, route, match)
+            await response.send(send)
+            return
+    #Escrituras, admin, métricas, etc.: las atiende la app Flask en un hilo.
+    await flask_asgi(scope, receive, send)
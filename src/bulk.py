@@ -0,0 +1,164 @@
+"""
+Helpers for the bulk endpoints (/planets/bulk, /characters/bulk).
+Every request is validated in one pass, checked against the database with set-based IN queries
+and written with a single executemany inside one transaction.
+"""
+from flask import request
+from sqlalchemy.exc import IntegrityError
+from utils import APIException
+from snapshot import snapshot_changed
+from models import db, utcnow
+
+BULK_MAX_ITEMS = 5000
+
+def read_bulk_items():
+    body = request.get_json(silent=True)
+    if not isinstance(body, list) or len(body) == 0:
+        raise APIException('Debes enviar un array con al menos un elemento en el body', status_code=400)
+    if len(body) > BULK_MAX_ITEMS:
+        raise APIException(f'Puedes enviar como máximo {BULK_MAX_ITEMS} elementos por solicitud', status_code=400)
+    return body
+
+def read_bulk_ids():
+    body = request.get_json(silent=True)
+    ids = body.get('ids') if isinstance(body, dict) else None
+    if not isinstance(ids, list) or len(ids) == 0:
+        raise APIException('Debes enviar {"ids": [...]} con al menos un id en el body', status_code=400)
+    if len(ids) > BULK_MAX_ITEMS:
+        raise APIException(f'Puedes enviar como máximo {BULK_MAX_ITEMS} ids por solicitud', status_code=400)
+    if not all(isinstance(id, int) for id in ids):
+        raise APIException('Los ids deben ser números enteros', status_code=400)
+    return list(dict.fromkeys(ids)) #Quitamos repetidos manteniendo el orden.
+
+def read_id_list(body, key):
+    ids = body.get(key, [])
+    if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+        raise APIException(f'El campo {key} debe ser un array de ids enteros', status_code=400)
+    if len(ids) > BULK_MAX_ITEMS:
+        raise APIException(f'Puedes enviar como máximo {BULK_MAX_ITEMS} ids en {key}', status_code=400)
+    return set(ids)
+
+def validate_items(items, fields, require_id=False):
+    #Una sola pasada: campos obligatorios, nombres e ids repetidos dentro de la misma solicitud.
+    errors = {}
+    seen_names = set()
+    seen_ids = set()
+    required = ('id',) + fields if require_id else fields
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = (400, 'Cada elemento debe ser un objeto')
+            continue
+        missing = next((field for field in required if field not in item), None)
+        if missing is not None:
+            errors[index] = (400, f'El campo {missing} es obligatorio')
+            continue
+        if item['name'] in seen_names:
+            errors[index] = (400, 'El name está repetido en la solicitud')
+            continue
+        if require_id and item['id'] in seen_ids:
+            errors[index] = (400, 'El id está repetido en la solicitud')
+            continue
+        seen_names.add(item['name'])
+        if require_id:
+            seen_ids.add(item['id'])
+    return errors
+
+def check_references(items, errors, column, model, message):
+    #Marca como 404 los elementos cuya FK (p. ej. planet_id) no existe, con una sola consulta IN.
+    values = {items[index][column] for index in range(len(items)) if index not in errors}
+    existing = set(db.session.scalars(db.select(model.id).where(model.id.in_(values)))) if values else set()
+    for index, item in enumerate(items):
+        if index not in errors and item[column] not in existing:
+            errors[index] = (404, message)
+
+def execute_and_commit(statement, rows=None, before=(), after=None):
+    #Todo va en una sola transacción: si la base de datos rechaza algo no se aplica ningún cambio.
+    #before: sentencias que se ejecutan antes en la misma transacción (p. ej. borrar los favoritos).
+    #after(): se llama después, antes del commit (p. ej. registrar los ids cambiados para los snapshots).
+    try:
+        for previous in before:
+            db.session.execute(previous)
+        result = db.session.execute(statement, rows) if rows is not None else db.session.execute(statement)
+        if after is not None:
+            after()
+        db.session.commit()
+        return result
+    except IntegrityError:
+        db.session.rollback()
+        raise APIException('La base de datos rechazó la operación, no se aplicó ningún cambio', status_code=409)
+
+def build_results(items, errors, ok_status, ids):
+    results = []
+    for index in range(len(items)):
+        if index in errors:
+            status, msg = errors[index]
+            results.append({'index': index, 'status': status, 'msg': msg})
+        else:
+            results.append({'index': index, 'status': ok_status, 'id': ids[index]})
+    return results
+
+def bulk_create(model, items, fields, errors):
+    valid = [index for index in range(len(items)) if index not in errors]
+    names = [items[index]['name'] for index in valid]
+    taken = set(db.session.scalars(db.select(model.name).where(model.name.in_(names)))) if names else set()
+    for index in valid:
+        if items[index]['name'] in taken:
+            errors[index] = (400, 'El name ingresado ya existe, por favor, ingresa otro')
+    valid = [index for index in valid if index not in errors]
+    new_ids = {}
+    if valid:
+        rows = [{field: items[index][field] for field in fields} for index in valid]
+        def log_new_ids():
+            #Los names son únicos, así que recuperamos los ids nuevos con una sola consulta IN.
+            new_names = [row['name'] for row in rows]
+            new_ids.update(db.session.execute(db.select(model.name, model.id).where(model.name.in_(new_names))).all())
+            snapshot_changed(model, new_ids.values())
+        execute_and_commit(db.insert(model), rows, after=log_new_ids) #INSERT con executemany.
+    ids = {index: new_ids[items[index]['name']] for index in valid}
+    return build_results(items, errors, 201, ids), len(valid)
+
+def bulk_update(model, items, fields, errors):
+    valid = [index for index in range(len(items)) if index not in errors]
+    requested_ids = {items[index]['id'] for index in valid}
+    existing = set(db.session.scalars(db.select(model.id).where(model.id.in_(requested_ids)))) if requested_ids else set()
+    names = [items[index]['name'] for index in valid]
+    owners = dict(db.session.execute(db.select(model.name, model.id).where(model.name.in_(names))).all()) if names else {}
+    for index in valid:
+        item = items[index]
+        if item['id'] not in existing:
+            errors[index] = (404, 'Elemento no encontrado')
+        elif owners.get(item['name'], item['id']) != item['id']:
+            errors[index] = (400, 'El name ingresado ya existe, por favor, ingresa otro')
+    valid = [index for index in valid if index not in errors]
+    if valid:
+        now = utcnow()
+        rows = [dict({field: items[index][field] for field in ('id',) + fields}, updated_at=now) for index in valid]
+        updated_ids = [row['id'] for row in rows]
+        execute_and_commit(db.update(model), rows, after=lambda: snapshot_changed(model, updated_ids)) #UPDATE por clave primaria con executemany.
+    return build_results(items, errors, 200, {index: items[index]['id'] for index in valid}), len(valid)
+
+def delete_favorites(favorites, ids):
+    #favorites: columna de la tabla de favoritos que apunta al modelo (p. ej. FavoritePlanets.planet_id).
+    #Se ejecuta antes de borrar los elementos y en la misma transacción: la FK es NOT NULL, así que no pueden
+    #quedar huérfanos. Los contadores no cambian porque los favoritos apuntan a los elementos que se borran.
+    return db.delete(favorites.class_).where(favorites.in_(ids))
+
+def bulk_delete(model, ids, blocked=None, favorites=None):
+    #blocked: {id: mensaje} para los elementos que no se pueden borrar (p. ej. planetas con residentes).
+    #favorites: columna de la tabla de favoritos que apunta a model (ver delete_favorites).
+    blocked = blocked or {}
+    existing = set(db.session.scalars(db.select(model.id).where(model.id.in_(ids))))
+    deletable = [id for id in ids if id in existing and id not in blocked]
+    if deletable:
+        before = [delete_favorites(favorites, deletable)] if favorites is not None else []
+        execute_and_commit(db.delete(model).where(model.id.in_(deletable)), before=before,
+                           after=lambda: snapshot_changed(model, deletable))
+    results = []
+    for id in ids:
+        if id not in existing:
+            results.append({'id': id, 'status': 404, 'msg': 'Elemento no encontrado'})
+        elif id in blocked:
+            results.append({'id': id, 'status': 400, 'msg': blocked[id]})
+        else:
+            results.append({'id': id, 'status': 204})
+    return results, deletable
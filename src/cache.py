@@ -0,0 +1,161 @@
+"""
+Read-through cache for the single-resource GET endpoints (user, planet, character).
+The handlers store the already serialized payload; the write handlers and the admin invalidate it.
+The default LRUCache lives in each worker process, and invalidation only reaches the worker that handled the
+write: the other workers can serve the previous user or character payload for up to CACHE_TTL seconds. With
+several workers set CACHE_URL (shared Redis cache), or a short CACHE_TTL if that staleness is not acceptable.
+Planets are stored with their version (the ETag), so a planet payload always matches its validators.
+Reads routed to a replica never fill the cache: a lagging replica could otherwise hand the previous row
+to a client inside its read-your-writes window.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheBackend:
+    #Interfaz mínima que tiene que cumplir cualquier backend.
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    #Cache en memoria del proceso: LRU con tamaño máximo y expiración (TTL) por entrada.
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+class SharedCache(CacheBackend):
+    #Cache compartida entre workers. "client" es cualquier objeto con get/setex/delete (redis.Redis o un sustituto local).
+    def __init__(self, client, prefix='starwars:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, ttl, json.dumps(value))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+class ResourceCache:
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, version):
+        #Cada entrada es (versión, payload): una entrada de otra versión cuenta como fallo.
+        entry = self.backend.get(key)
+        value = entry[1] if entry is not None and entry[0] == version else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def _store(self, key, value, version, store):
+        if value is not None and store:
+            self.backend.set(key, (version, value), self.ttl)
+        return value
+
+    def get_or_load(self, key, loader, version=None, store=True):
+        #Devuelve el payload guardado o lo calcula con loader(). Si loader devuelve None (no existe) no se guarda nada.
+        #version: la del recurso en la base de datos (p. ej. el ETag). Con ella una entrada que otro worker dejó
+        #vieja no se sirve nunca con los validadores de la versión nueva.
+        #store=False: solo se lee la cache (p. ej. si loader lee de una réplica que puede estar atrasada).
+        value = self._lookup(key, version)
+        if value is None:
+            value = self._store(key, loader(), version, store)
+        return value
+
+    async def aget_or_load(self, key, loader, version=None, store=True):
+        #Igual que get_or_load pero con un loader asíncrono (modo de servidor async).
+        value = self._lookup(key, version)
+        if value is None:
+            value = self._store(key, await loader(), version, store)
+        return value
+
+    def invalidate(self, *keys):
+        self.backend.delete(*keys)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': type(self.backend).__name__,
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0
+        }
+
+
+def user_key(id):
+    return f'user:{id}'
+
+def planet_key(id):
+    return f'planet:{id}'
+
+def character_key(id):
+    return f'character:{id}'
+
+
+def setup_cache(app):
+    #CACHE_URL=redis://... usa la cache compartida (requiere el paquete redis). Si no, LRU en memoria de cada
+    #worker: las invalidaciones no llegan a los demás workers (ver el docstring del módulo).
+    ttl = int(os.getenv('CACHE_TTL', 60))
+    cache_url = os.getenv('CACHE_URL')
+    if cache_url is not None:
+        import redis
+        backend = SharedCache(redis.Redis.from_url(cache_url))
+    else:
+        backend = LRUCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 1024)))
+    cache = ResourceCache(backend, ttl=ttl)
+    app.extensions['resource_cache'] = cache
+    return cache
@@ -0,0 +1,330 @@
+"""
+Backup and bulk load of the catalog: 'flask catalog export DIR' and 'flask catalog import DIR'.
+One file per table (planets, characters, users, favorite_planets, favorite_characters) in NDJSON or CSV,
+read and written in batches of --batch-size rows, so memory stays bounded whatever the size of the table.
+Import uses COPY FROM STDIN on PostgreSQL (through a staging table) and executemany elsewhere; rows that
+already exist (same id or same unique key) are skipped. Characters reference their planet by name
+("planet", what export writes) or by id ("planet_id").
+Progress is saved after every batch in <file>.checkpoint: running the same command again after an
+interruption continues where it stopped (--restart starts over).
+"""
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import sqlite
+from counters import reconcile_favorite_counts
+from snapshot import snapshot_changed_all
+from models import db, User, Planet, Character, FavoritePlanets, FavoriteCharacters
+
+try:
+    import orjson
+except ImportError: #Sin orjson usamos el módulo json de la librería estándar.
+    orjson = None
+
+#Nombre del archivo -> modelo, en el orden en que hay que importarlos (referencias primero).
+CATALOG_TABLES = {
+    'planets': Planet,
+    'characters': Character,
+    'users': User,
+    'favorite_planets': FavoritePlanets,
+    'favorite_characters': FavoriteCharacters,
+}
+FORMATS = ('ndjson', 'csv')
+DEFAULT_BATCH_SIZE = 10000
+
+
+def dumps_line(record):
+    if orjson is not None:
+        return orjson.dumps(record) + b'\n' #Las fechas salen en ISO 8601.
+    return json.dumps(record, default=datetime.isoformat).encode() + b'\n'
+
+def loads_line(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+def csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+def copy_value(value):
+    #Formato de texto de COPY: \N es NULL; barra invertida, tabulador y saltos de línea van escapados.
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def converter(column):
+    #Los valores de CSV llegan como texto y las fechas de NDJSON como texto ISO 8601.
+    python_type = column.type.python_type
+    if python_type is bool:
+        return lambda value: value.lower() in ('1', 'true') if isinstance(value, str) else bool(value)
+    if python_type is datetime:
+        return lambda value: datetime.fromisoformat(value) if isinstance(value, str) else value
+    return python_type
+
+def default_factory(column):
+    #default=... de la columna (valor fijo o función como utcnow), o None si el campo es obligatorio.
+    default = column.default
+    if default is None:
+        return None
+    if default.is_callable:
+        return lambda: default.arg(None)
+    return lambda: default.arg
+
+def column_plan(model, with_ids):
+    #Se calcula una vez por archivo: (columna, conversión, valor por defecto) para cada columna de la tabla.
+    return [(column.key, converter(column), default_factory(column)) for column in model.__table__.columns
+            if with_ids or column.key != 'id']
+
+
+class Checkpoint:
+    #<archivo>.checkpoint guarda la posición del archivo y las filas procesadas después de cada lote.
+    def __init__(self, path, restart):
+        self.path = path + '.checkpoint'
+        if restart and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as state:
+                return json.load(state)
+        except FileNotFoundError:
+            return None
+
+    def save(self, **state):
+        #Se escribe a un temporal y se renombra: una interrupción nunca deja el checkpoint a medias.
+        with open(self.path + '.tmp', 'w') as tmp:
+            json.dump(state, tmp)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def export_statement(model):
+    #Los personajes se exportan con el nombre de su planeta en vez de planet_id: el archivo sirve en otra base.
+    columns = [column for column in model.__table__.columns if not (model is Character and column.key == 'planet_id')]
+    if model is Character:
+        return select(*columns, Planet.name.label('planet')).join(Planet, Planet.id == Character.planet_id)
+    return select(*columns)
+
+def export_table(model, path, file_format, batch_size, restart):
+    checkpoint = Checkpoint(path, restart)
+    state = checkpoint.load() or {'last_id': 0, 'offset': 0, 'rows': 0}
+    statement = export_statement(model)
+    header = list(statement.selected_columns.keys())
+    with open(path, 'r+b' if state['offset'] else 'wb') as out:
+        out.truncate(state['offset']) #Descarta lo escrito después del último lote guardado.
+        out.seek(state['offset'])
+        if file_format == 'csv' and not state['offset']:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(header)
+            out.write(buffer.getvalue().encode())
+        while True:
+            #Keyset por id: cada lote cuesta lo mismo aunque la tabla tenga millones de filas.
+            rows = db.session.execute(statement.where(model.id > state['last_id']).order_by(model.id).limit(batch_size)).all()
+            if not rows:
+                break
+            if file_format == 'ndjson':
+                out.write(b''.join(dumps_line(dict(row._mapping)) for row in rows))
+            else:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows([csv_value(value) for value in row] for row in rows)
+                out.write(buffer.getvalue().encode())
+            out.flush()
+            state = {'last_id': rows[-1].id, 'offset': out.tell(), 'rows': state['rows'] + len(rows)}
+            checkpoint.save(**state)
+    db.session.rollback() #Cierra la transacción de lectura.
+    checkpoint.clear()
+    return state['rows']
+
+
+def read_records(source, file_format, offset):
+    #Devuelve (registro, posición del archivo después del registro) a partir de offset.
+    if file_format == 'ndjson':
+        source.seek(offset)
+        for line in iter(source.readline, b''):
+            if line.strip():
+                yield loads_line(line), source.tell()
+        return
+    header = next(csv.reader([source.readline().decode('utf-8-sig')]))
+    source.seek(max(offset, source.tell()))
+    position = [source.tell()]
+
+    def lines():
+        #csv.reader pide líneas de a una: al devolver un registro, position apunta justo después de él.
+        for line in iter(source.readline, b''):
+            position[0] = source.tell()
+            yield line.decode()
+
+    for values in csv.reader(lines()):
+        if values:
+            yield dict(zip(header, values)), position[0]
+
+def prepare_rows(model, plan, records, path, first_row, planet_ids):
+    #Registros del archivo -> filas de la tabla: tipos, valores por defecto y planet -> planet_id.
+    rows = []
+    for number, record in enumerate(records, start=first_row):
+        row = {}
+        for key, convert, default in plan:
+            value = record.get(key)
+            if value is not None and value != '':
+                row[key] = convert(value)
+            elif key == 'planet_id' and record.get('planet'):
+                row['planet_id'] = record['planet']
+            elif default is not None:
+                row[key] = default()
+            else:
+                raise click.ClickException(f'{path}, fila {number}: falta el campo {key}')
+        rows.append(row)
+    if model is Character:
+        resolve_planets(rows, path, first_row, planet_ids)
+    return rows
+
+def resolve_planets(rows, path, first_row, planet_ids):
+    #planet_ids (nombre -> id) se comparte entre los lotes de un archivo: solo se buscan los nombres nuevos,
+    #con un único SELECT ... WHERE name IN (...) por lote.
+    names = {row['planet_id'] for row in rows if isinstance(row['planet_id'], str)} - planet_ids.keys()
+    if names:
+        planet_ids.update(db.session.execute(select(Planet.name, Planet.id).where(Planet.name.in_(names))).all())
+    for number, row in enumerate(rows, start=first_row):
+        if isinstance(row['planet_id'], str):
+            if row['planet_id'] not in planet_ids:
+                raise click.ClickException(f'{path}, fila {number}: el planeta {row["planet_id"]} no existe')
+            row['planet_id'] = planet_ids[row['planet_id']]
+
+def write_rows(model, rows):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        copy_rows(model, rows)
+    elif dialect == 'sqlite':
+        db.session.execute(sqlite.insert(model.__table__).on_conflict_do_nothing(), rows)
+    elif dialect in ('mysql', 'mariadb'):
+        db.session.execute(insert(model.__table__).prefix_with('IGNORE'), rows)
+    else:
+        db.session.execute(insert(model.__table__), rows) #Sin ON CONFLICT: reanudar puede repetir el último lote.
+
+def copy_rows(model, rows):
+    #COPY a una tabla temporal y de ahí INSERT ... ON CONFLICT DO NOTHING: COPY no sabe saltarse duplicados.
+    quote = db.engine.dialect.identifier_preparer.quote
+    table = quote(model.__tablename__)
+    stage = f'catalog_stage_{model.__tablename__}'
+    columns = list(rows[0])
+    names = ', '.join(quote(column) for column in columns)
+    connection = db.session.connection()
+    connection.exec_driver_sql(f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+    data = ''.join('\t'.join(copy_value(row[column]) for column in columns) + '\n' for row in rows)
+    cursor = connection.connection.cursor()
+    if hasattr(cursor, 'copy_expert'): #psycopg2
+        cursor.copy_expert(f'COPY {stage} ({names}) FROM STDIN', io.StringIO(data))
+    else: #psycopg 3
+        with cursor.copy(f'COPY {stage} ({names}) FROM STDIN') as copy:
+            copy.write(data)
+    connection.exec_driver_sql(f'INSERT INTO {table} ({names}) SELECT {names} FROM {stage} ON CONFLICT DO NOTHING')
+
+def reset_sequence(model):
+    #Después de cargar ids explícitos, la secuencia de PostgreSQL tiene que seguir desde el mayor id.
+    if db.engine.dialect.name == 'postgresql':
+        table = db.engine.dialect.identifier_preparer.quote(model.__tablename__)
+        db.session.execute(text(f"SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                                f"(SELECT coalesce(max(id), 0) + 1 FROM {table}), false)"), {'table': table})
+        db.session.commit()
+
+def import_table(model, path, file_format, batch_size, restart):
+    checkpoint = Checkpoint(path, restart)
+    state = checkpoint.load() or {'offset': 0, 'rows': 0}
+    resumed = state['rows']
+    plan = None
+    planet_ids = {}
+    with open(path, 'rb') as source:
+        batch = []
+        for record, offset in read_records(source, file_format, state['offset']):
+            if plan is None: #Con o sin ids se decide con la primera fila: todas tienen que ser iguales.
+                with_ids = record.get('id') not in (None, '')
+                plan = column_plan(model, with_ids)
+            batch.append(record)
+            if len(batch) >= batch_size:
+                rows = prepare_rows(model, plan, batch, path, state['rows'] + 1, planet_ids)
+                state = import_batch(model, rows, state, offset, checkpoint)
+                batch = []
+        if batch:
+            rows = prepare_rows(model, plan, batch, path, state['rows'] + 1, planet_ids)
+            state = import_batch(model, rows, state, offset, checkpoint)
+    if plan is not None and with_ids:
+        reset_sequence(model)
+    checkpoint.clear()
+    return state['rows'], resumed
+
+def import_batch(model, rows, state, offset, checkpoint):
+    write_rows(model, rows)
+    if model in (Planet, Character):
+        snapshot_changed_all() #Cada lote, en su transacción: los workers con CATALOG_SNAPSHOT=1 recargan todo.
+    db.session.commit()
+    state = {'offset': offset, 'rows': state['rows'] + len(rows)}
+    checkpoint.save(**state)
+    return state
+
+
+def setup_catalog(app):
+    catalog = AppGroup('catalog', help='Exporta e importa planetas, personajes, usuarios y favoritos (NDJSON o CSV).')
+    directory_argument = click.argument('directory', type=click.Path(file_okay=False))
+    options = [
+        click.option('--format', 'file_format', type=click.Choice(FORMATS), default='ndjson'),
+        click.option('--table', 'tables', type=click.Choice(list(CATALOG_TABLES)), multiple=True,
+                     help='Solo estas tablas (se puede repetir). Por defecto, todas.'),
+        click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Filas por lote.'),
+        click.option('--restart', is_flag=True, help='Ignora los checkpoints y empieza de cero.'),
+    ]
+
+    def with_options(command):
+        for option in reversed(options):
+            command = option(command)
+        return directory_argument(command)
+
+    @catalog.command('export')
+    @with_options
+    def catalog_export(directory, file_format, tables, batch_size, restart):
+        """Escribe un archivo por tabla en DIRECTORY."""
+        os.makedirs(directory, exist_ok=True)
+        for name, model in CATALOG_TABLES.items():
+            if tables and name not in tables:
+                continue
+            started = time.perf_counter()
+            rows = export_table(model, os.path.join(directory, f'{name}.{file_format}'), file_format, batch_size, restart)
+            click.echo(f'{name}: {rows} filas exportadas en {time.perf_counter() - started:.1f} s')
+
+    @catalog.command('import')
+    @with_options
+    def catalog_import(directory, file_format, tables, batch_size, restart):
+        """Carga los archivos de DIRECTORY que existan, en orden de dependencias."""
+        imported = []
+        for name, model in CATALOG_TABLES.items():
+            path = os.path.join(directory, f'{name}.{file_format}')
+            if (tables and name not in tables) or not os.path.exists(path):
+                continue
+            started = time.perf_counter()
+            rows, resumed = import_table(model, path, file_format, batch_size, restart)
+            elapsed = time.perf_counter() - started
+            rate = (rows - resumed) / elapsed if elapsed else 0
+            resumed_note = f', reanudado desde la fila {resumed + 1}' if resumed else ''
+            click.echo(f'{name}: {rows} filas leídas en {elapsed:.1f} s ({rate:.0f} filas/s{resumed_note})')
+            imported.append(model)
+        #Las filas no pasaron por los handlers: los contadores se recalculan una vez al final. El índice de búsqueda
+        #no hace falta: PostgreSQL y los triggers de SQLite lo actualizan en cada lote, y el índice en memoria de
+        #cada worker se pone al día solo.
+        if FavoritePlanets in imported or FavoriteCharacters in imported:
+            for model in (Planet, Character):
+                click.echo(f'{model.__tablename__}: {reconcile_favorite_counts(model)} contadores corregidos')
+
+    app.cli.add_command(catalog)
+    return catalog
@@ -0,0 +1,247 @@
+"""
+Response compression negotiated with Accept-Encoding: zstd (pip install zstandard), brotli (pip install brotli)
+and gzip, preferred in that order when the client accepts several. Only JSON/text bodies of at least
+COMPRESSION_MIN_SIZE bytes are compressed; streamed responses (?stream=true) are compressed chunk by chunk.
+Compressed bodies are kept in an LRU keyed by a digest of the body and coding, so a popular response
+is compressed once and then served from memory. Bytes saved and CPU spent per route are on /compression/stats.
+The async read routes of asgi.py compress through the same ResponseCompression (app.extensions).
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+import zlib
+from flask import request, jsonify
+from werkzeug.http import parse_accept_header
+from cache import LRUCache
+from utils import CONTENT_CODINGS
+
+try:
+    import brotli
+except ImportError: #Sin brotli no ofrecemos "br".
+    brotli = None
+try:
+    import zstandard
+except ImportError: #Sin zstandard no ofrecemos "zstd".
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+DEFAULT_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+#Las entradas se guardan por contenido (digest del body): el TTL solo libera memoria de las que nadie pide.
+COMPRESSED_TTL = 3600
+
+
+class GzipCodec:
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, self.level, mtime=0)
+
+    def stream_compressor(self):
+        #Devuelve (comprimir una parte, terminar). Z_SYNC_FLUSH después de cada parte: el cliente puede ir
+        #descomprimiendo mientras llega el resto.
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+class BrotliCodec:
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream_compressor(self):
+        compressor = brotli.Compressor(quality=self.level)
+        return lambda chunk: compressor.process(chunk) + compressor.flush(), compressor.finish
+
+
+class ZstdCodec:
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        #ZstdCompressor no se puede compartir entre hilos: creamos uno por llamada (es barato).
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream_compressor(self):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+
+
+def available_codecs(levels):
+    codecs = {'gzip': GzipCodec(levels['gzip'])}
+    if brotli is not None:
+        codecs['br'] = BrotliCodec(levels['br'])
+    if zstandard is not None:
+        codecs['zstd'] = ZstdCodec(levels['zstd'])
+    return codecs
+
+
+class CompressionStats:
+    #Por ruta y codificación: respuestas, aciertos de la cache de bodies comprimidos, bytes antes/después y CPU.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, coding, bytes_in, bytes_out, cpu_seconds, cache_hit=False):
+        with self._lock:
+            entry = self._routes.setdefault((route, coding), {'responses': 0, 'cache_hits': 0, 'bytes_in': 0,
+                                                              'bytes_out': 0, 'cpu_seconds': 0.0})
+            entry['responses'] += 1
+            entry['cache_hits'] += int(cache_hit)
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            entry['cpu_seconds'] += cpu_seconds
+
+    def snapshot(self):
+        data = {}
+        with self._lock:
+            for (route, coding), entry in sorted(self._routes.items()):
+                data.setdefault(route, {})[coding] = dict(
+                    entry,
+                    bytes_saved=entry['bytes_in'] - entry['bytes_out'],
+                    ratio=round(entry['bytes_out'] / entry['bytes_in'], 4) if entry['bytes_in'] else 0.0,
+                    cpu_seconds=round(entry['cpu_seconds'], 6))
+        return data
+
+
+class StreamCompressor:
+    #Comprime una respuesta en streaming parte a parte. Los contadores se registran en close(), al terminar de
+    #enviarla. La CPU medida es solo la de comprimir, no la de generar cada parte (consulta y JSON).
+    def __init__(self, codec, stats, route, coding):
+        self._process, self._finish = codec.stream_compressor()
+        self.stats = stats
+        self.route = route
+        self.coding = coding
+        self.bytes_in = self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def _run(self, function, *args):
+        started = time.thread_time()
+        part = function(*args)
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_out += len(part)
+        return part
+
+    def compress(self, chunk):
+        chunk = chunk.encode() if isinstance(chunk, str) else chunk
+        self.bytes_in += len(chunk)
+        return self._run(self._process, chunk)
+
+    def finish(self):
+        return self._run(self._finish)
+
+    def close(self):
+        self.stats.record(self.route, self.coding, self.bytes_in, self.bytes_out, self.cpu_seconds)
+
+
+class ResponseCompression:
+    #Negociación, codecs, cache de bodies comprimidos y estadísticas. La usan el after_request de Flask y las
+    #rutas async de asgi.py, así las dos dan los mismos bytes y los mismos ETag.
+    def __init__(self, min_size, levels, cache_entries):
+        self.min_size = min_size
+        self.levels = levels
+        self.codecs = available_codecs(levels)
+        self.offered = [coding for coding in CONTENT_CODINGS if coding in self.codecs]
+        self.cache_entries = cache_entries
+        self.compressed_cache = LRUCache(max_entries=cache_entries) if cache_entries > 0 else None
+        self.stats = CompressionStats()
+
+    def negotiate(self, accept_encoding):
+        #Valor de la cabecera Accept-Encoding -> codificación preferida que ofrecemos, o None.
+        return parse_accept_header(accept_encoding).best_match(self.offered)
+
+    def compress_body(self, route, coding, body):
+        #La clave de la cache es el digest del body y no el ETag: el ETag de algunas rutas no cubre todo lo que va
+        #en la respuesta (p. ej. ?expand) y serviria un body viejo.
+        key = (coding, hashlib.blake2b(body, digest_size=16).digest(), len(body))
+        compressed = self.compressed_cache.get(key) if self.compressed_cache is not None else None
+        cache_hit = compressed is not None
+        cpu_seconds = 0.0
+        if not cache_hit:
+            started = time.thread_time()
+            compressed = self.codecs[coding].compress(body)
+            cpu_seconds = time.thread_time() - started
+            if self.compressed_cache is not None:
+                self.compressed_cache.set(key, compressed, COMPRESSED_TTL)
+        self.stats.record(route, coding, len(body), len(compressed), cpu_seconds, cache_hit)
+        return compressed
+
+    def stream_compressor(self, route, coding):
+        return StreamCompressor(self.codecs[coding], self.stats, route, coding)
+
+    def compress_stream(self, route, coding, chunks):
+        stream = self.stream_compressor(route, coding)
+        try:
+            for chunk in chunks:
+                part = stream.compress(chunk)
+                if part:
+                    yield part
+            yield stream.finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            stream.close()
+
+
+def levels_from_env():
+    #COMPRESSION_LEVEL_GZIP (1-9), COMPRESSION_LEVEL_BR (0-11) y COMPRESSION_LEVEL_ZSTD (1-22).
+    return {coding: int(os.getenv(f'COMPRESSION_LEVEL_{coding.upper()}', level)) for coding, level in DEFAULT_LEVELS.items()}
+
+
+def setup_compression(app):
+    #Se llama después de setup_metrics(app) para que /metrics mida el tamaño ya comprimido.
+    #COMPRESSION_MIN_SIZE=bytes (1024 por defecto); COMPRESSION_CACHE_ENTRIES=0 desactiva la cache de bodies comprimidos.
+    compression = ResponseCompression(int(os.getenv('COMPRESSION_MIN_SIZE', 1024)), levels_from_env(),
+                                      int(os.getenv('COMPRESSION_CACHE_ENTRIES', 256)))
+
+    @app.after_request
+    def compress_response(response):
+        if request.url_rule is None or 'Content-Encoding' in response.headers or response.direct_passthrough:
+            return response
+        etag, weak = response.get_etag()
+        coding = request.accept_encodings.best_match(compression.offered)
+        if response.status_code == 304:
+            #El cliente revalida la versión comprimida: el 304 lleva el mismo ETag que tendría el 200.
+            if etag and coding and request.if_none_match.contains(f'{etag}-{coding}'):
+                response.set_etag(f'{etag}-{coding}', weak)
+                response.vary.add('Accept-Encoding')
+            return response
+        if response.status_code < 200 or response.status_code == 204 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        route = request.url_rule.rule
+        if response.is_streamed:
+            response.vary.add('Accept-Encoding')
+            if coding is None:
+                return response
+            response.response = compression.compress_stream(route, coding, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < compression.min_size:
+                return response
+            response.vary.add('Accept-Encoding')
+            if coding is None:
+                return response
+            response.set_data(compression.compress_body(route, coding, body))
+        response.headers['Content-Encoding'] = coding
+        if etag:
+            response.set_etag(f'{etag}-{coding}', weak)
+        return response
+
+    @app.route('/compression/stats', methods=['GET'])
+    def compression_stats():
+        return jsonify({'msg': 'ok', 'data': {
+            'codings': compression.offered,
+            'levels': {coding: compression.levels[coding] for coding in compression.offered},
+            'min_size': compression.min_size,
+            'cache_entries': compression.cache_entries,
+            'routes': compression.stats.snapshot()
+        }}), 200
+
+    app.extensions['response_compression'] = compression
+    return compression
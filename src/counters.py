@@ -0,0 +1,53 @@
+"""
+Denormalized favorite counters (Planet.favorite_count, Character.favorite_count).
+The favorite handlers change them in the same transaction as the favorite row, with an atomic
+UPDATE ... SET favorite_count = favorite_count + n, so concurrent requests never lose an update.
+'flask favorites-reconcile' recomputes them from the favorites tables.
+"""
+import click
+from sqlalchemy import func, select, update
+from models import db, Planet, Character, FavoritePlanets, FavoriteCharacters
+
+#modelo -> (tabla de favoritos, columna que apunta al modelo)
+FAVORITE_TABLES = {
+    Planet: (FavoritePlanets, FavoritePlanets.planet_id),
+    Character: (FavoriteCharacters, FavoriteCharacters.character_id),
+}
+TOP_DEFAULT_LIMIT = 10
+TOP_MAX_LIMIT = 100
+
+
+def bump_favorites(model, ids, delta):
+    #No hace commit: se ejecuta dentro de la transacción del handler.
+    #updated_at no cambia porque favorite_count no forma parte de la representación del recurso (ETag, cache).
+    ids = list(ids)
+    if ids:
+        db.session.execute(update(model).where(model.id.in_(ids))
+                           .values(favorite_count=model.favorite_count + delta, updated_at=model.updated_at)
+                           .execution_options(synchronize_session=False))
+
+def actual_count(model):
+    favorite_model, column = FAVORITE_TABLES[model]
+    return select(func.count(favorite_model.id)).where(column == model.id).scalar_subquery()
+
+def reconcile_favorite_counts(model):
+    #Un solo UPDATE por tabla que solo toca las filas desviadas. Devuelve cuántas se corrigieron.
+    count = actual_count(model)
+    result = db.session.execute(update(model).where(model.favorite_count != count)
+                                .values(favorite_count=count, updated_at=model.updated_at)
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+def top_favorites(model, limit):
+    #Recorre el índice (favorite_count, id) desde el final: cuesta O(limit) sin importar el tamaño de la tabla.
+    return (model.query.filter(model.favorite_count > 0)
+            .order_by(model.favorite_count.desc(), model.id.desc()).limit(limit).all())
+
+
+def setup_counters(app):
+    @app.cli.command('favorites-reconcile')
+    def favorites_reconcile():
+        """Recalcula favorite_count de planetas y personajes a partir de las tablas de favoritos."""
+        for model in FAVORITE_TABLES:
+            click.echo(f'{model.__tablename__}: {reconcile_favorite_counts(model)} contadores corregidos')
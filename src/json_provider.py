@@ -0,0 +1,44 @@
+"""
+Flask JSON provider that encodes with orjson when it is installed (pip install orjson) and with the
+standard library otherwise. The output keeps Flask's format: sorted keys, compact separators,
+indentation in debug mode and the same encoding of dates, Decimal and UUID.
+The only difference: orjson writes non-ASCII characters as UTF-8 instead of \\uXXXX escapes.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError: #Sin orjson usamos el encoder de la librería estándar.
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def _options(self, sort_keys=None, indent=None):
+        #Las fechas pasan por default() (http_date) igual que con el provider de Flask.
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        #separators se ignora: orjson siempre escribe el formato compacto (',' y ':').
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default,
+                            option=self._options(kwargs.get('sort_keys'), kwargs.get('indent'))).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        #Igual que DefaultJSONProvider.response pero sin pasar el body por str: orjson ya devuelve bytes.
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent=indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
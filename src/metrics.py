@@ -0,0 +1,165 @@
+"""
+Per-endpoint request metrics: wall time, DB time, query count and response size,
+collected with Flask request hooks and SQLAlchemy engine events and exposed on /metrics (Prometheus text format).
+The async read routes of asgi.py report to the same metrics through track_queries() and RequestMetrics.finish().
+Metrics live in each process, so under gunicorn every worker reports its own numbers.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+#Consultas y tiempo de base de datos de la solicitud async en curso (asgi.py), fuera del contexto de Flask.
+_async_counters = ContextVar('metrics_async_counters', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class RequestMetrics:
+    METRICS = {
+        'http_request_duration_seconds': ('Tiempo total de la solicitud', TIME_BUCKETS),
+        'http_request_db_seconds': ('Tiempo de la solicitud esperando a la base de datos', TIME_BUCKETS),
+        'http_request_queries': ('Consultas SQL por solicitud', QUERY_BUCKETS),
+        'http_response_size_bytes': ('Tamaño del body de la respuesta', SIZE_BUCKETS),
+    }
+
+    def __init__(self, server_timing=False, query_threshold=None):
+        self.server_timing = server_timing
+        self.query_threshold = query_threshold
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in self.METRICS}
+
+    def finish(self, method, route, path, status, elapsed, db_time, queries, size=None):
+        #Registra una solicitud terminada. Devuelve el valor de la cabecera Server-Timing, o None si está apagada.
+        values = {
+            'http_request_duration_seconds': elapsed,
+            'http_request_db_seconds': db_time,
+            'http_request_queries': queries,
+        }
+        if size is not None: #Las respuestas en streaming no tienen tamaño conocido.
+            values['http_response_size_bytes'] = size
+        self.observe((method, route, status), values)
+        if self.query_threshold is not None and queries > self.query_threshold:
+            logger.warning('%s %s ejecutó %d consultas (límite %d)', method, path, queries, self.query_threshold)
+        if self.server_timing:
+            return f'app;dur={elapsed * 1000:.1f}, db;dur={db_time * 1000:.1f};desc="{queries} queries"'
+        return None
+
+    def observe(self, labels, values):
+        with self._lock:
+            for name, value in values.items():
+                histograms = self._histograms[name]
+                if labels not in histograms:
+                    histograms[labels] = Histogram(self.METRICS[name][1])
+                histograms[labels].observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in self.METRICS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (method, route, status), histogram in sorted(self._histograms[name].items()):
+                    labels = f'method="{method}",route="{route}",status="{status}"'
+                    for bound, count in zip(buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _count_query(elapsed):
+    counters = _async_counters.get()
+    if counters is not None:
+        counters[0] += 1
+        counters[1] += elapsed
+    elif has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_db_time += elapsed
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _count_query(time.perf_counter() - conn.info['query_start'].pop())
+
+def _handle_error(context):
+    #La consulta falló: descartamos su marca de inicio para no desbalancear la pila. Igual cuenta como consulta
+    #(p. ej. un INSERT rechazado por una restricción única también es un viaje a la base de datos).
+    if context.connection is not None and context.connection.info.get('query_start'):
+        _count_query(time.perf_counter() - context.connection.info['query_start'].pop())
+
+@contextmanager
+def track_queries():
+    #Para las solicitudes de asgi.py: dentro del with, las consultas de la tarea actual se cuentan en la lista
+    #[consultas, segundos]. Los eventos del engine async se ejecutan en la misma tarea y ven el ContextVar.
+    counters = [0, 0.0]
+    token = _async_counters.set(counters)
+    try:
+        yield counters
+    finally:
+        _async_counters.reset(token)
+
+def install_query_events():
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def setup_metrics(app):
+    #METRICS_SERVER_TIMING=1 agrega la cabecera Server-Timing.
+    #METRICS_QUERY_THRESHOLD=N registra en el log las solicitudes con más de N consultas (para detectar N+1).
+    server_timing = os.getenv('METRICS_SERVER_TIMING', '0').lower() in ('1', 'true')
+    query_threshold = os.getenv('METRICS_QUERY_THRESHOLD')
+    metrics = RequestMetrics(server_timing, int(query_threshold) if query_threshold else None)
+    install_query_events()
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_start' not in g or request.url_rule is None:
+            return response
+        timing = metrics.finish(request.method, request.url_rule.rule, request.path, response.status_code,
+                                time.perf_counter() - g.metrics_start, g.metrics_db_time, g.metrics_queries,
+                                response.content_length)
+        if timing is not None:
+            response.headers['Server-Timing'] = timing
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.extensions['request_metrics'] = metrics
+    return metrics
@@ -1,7 +1,14 @@
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from replicas import RoutingSession
 #1) Crear las tablas con las columnas necesarias.
 #2) Serializar las columnas necesarias para convertirlas en un diccionario python.
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession}) #RoutingSession envía las lecturas marcadas a las réplicas.
+
+def utcnow():
+    #Fecha en UTC sin zona horaria (así se guarda igual en SQLite y PostgreSQL).
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 #Definimos la tabla "User" que contiene columnas con todos los datos de registro del usuario además de su PK.
 class User(db.Model):
     __tablename__ = 'user'
@@ -19,7 +26,15 @@ class User(db.Model):
     def __repr__(self):
         return f'User {self.name} with email {self.email}'
 #El método "serialize" sirve para convertir los objetos en un diccionario python para que pueda ser leído.
-    def serialize(self):
+    #Campos que se pueden pedir con ?fields= (los mismos que devuelve serialize()).
+    SERIALIZE_FIELDS = ('id', 'name', 'email', 'password', 'is_active')
+    EXPANDABLE = {}
+    FILTERS = {}
+    SORTABLE = ('id',)
+
+    def serialize(self, fields=None):
+        if fields is not None: #Serialización parcial: solo leemos los atributos pedidos (cargados con load_only).
+            return {field: getattr(self, field) for field in fields}
         return {
             'id': self.id,
             'name': self.name,
@@ -30,19 +45,44 @@ class User(db.Model):
     
 class Planet(db.Model):
     __tablename__ = 'planet'
+    #Índices (columna, id) para ordenar y paginar por cursor con ?sort= sin ordenar toda la tabla.
+    __table_args__ = (db.Index('ix_planet_population_id', 'population', 'id'),
+                      db.Index('ix_planet_diameter_id', 'diameter', 'id'),
+                      db.Index('ix_planet_favorite_count_id', 'favorite_count', 'id'))
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(20), unique=True, nullable=False)
+    name = db.Column(db.String(20), unique=True, nullable=False) #El índice único de name sirve también para ?name_prefix= y ?sort=name.
     population = db.Column(db.Integer, unique=False, nullable=False)
     diameter = db.Column(db.Integer, unique=False, nullable=False)
-    climated = db.Column(db.String(20), unique=False, nullable=False)
-    terrain = db.Column(db.String(20), unique=False, nullable=False)
+    climated = db.Column(db.String(20), unique=False, nullable=False, index=True)
+    terrain = db.Column(db.String(20), unique=False, nullable=False, index=True)
+    #Cuántos usuarios tienen el planeta en favoritos. Lo mantienen los handlers de favoritos (ver counters.py).
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    #Fecha de la última modificación: alimenta Last-Modified y los ETag. Indexada para calcular max() sin recorrer la tabla.
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow, index=True)
     residents = db.relationship('Character', back_populates='planet_relationship')
     favorite_by = db.relationship('FavoritePlanets', back_populates='planet_relationship')
 
     def __repr__(self):
         return f'Planeta {self.name}'
     
-    def serialize(self):
+    SERIALIZE_FIELDS = ('id', 'name', 'population', 'diameter', 'climated', 'terrain')
+    EXPANDABLE = {'residents': 'residents'} #?expand=residents -> relación que hay que cargar.
+    #Filtros de GET /planets: parámetro -> (columna, operador). Columnas que se pueden usar en ?sort=.
+    FILTERS = {
+        'name_prefix': ('name', 'prefix'),
+        'climated': ('climated', 'eq'),
+        'terrain': ('terrain', 'eq'),
+        'min_population': ('population', 'min'),
+        'max_population': ('population', 'max'),
+        'min_diameter': ('diameter', 'min'),
+        'max_diameter': ('diameter', 'max')
+    }
+    SORTABLE = ('id', 'name', 'population', 'diameter')
+    SEARCHABLE = ('name', 'climated', 'terrain') #Columnas de GET /search. name (la primera) pesa más en el ranking.
+
+    def serialize(self, fields=None):
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
         return{
             'id': self.id,
             'name': self.name,
@@ -54,14 +94,20 @@ class Planet(db.Model):
     
 class Character(db.Model):
     __tablename__ = 'character'
+    __table_args__ = (db.Index('ix_character_age_id', 'age', 'id'),
+                      db.Index('ix_character_height_id', 'height', 'id'),
+                      db.Index('ix_character_weight_id', 'weight', 'id'),
+                      db.Index('ix_character_favorite_count_id', 'favorite_count', 'id'))
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(20), unique=True, nullable=False)
-    specie = db.Column(db.String(20), unique=False, nullable=False)
-    gender = db.Column(db.String(20), unique=False,nullable=False)
+    specie = db.Column(db.String(20), unique=False, nullable=False, index=True)
+    gender = db.Column(db.String(20), unique=False,nullable=False, index=True)
     age = db.Column(db.Integer, unique=False, nullable=False)
     height = db.Column(db.Integer, unique=False, nullable=False)
     weight = db.Column(db.Integer, unique=False, nullable=False)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False) #FK que se relaciona con "Planet".
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow, index=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False, index=True) #FK que se relaciona con "Planet". Indexada porque alimenta Planet.residents.
 #Relación bidireccional:Podemos acceder desde cualquiera de las dos clases a los objetos relacionados de la otra.
     planet_relationship = db.relationship('Planet', back_populates='residents') #Relación bidireccional: Tabla "Planet" columna "residents"(relación).
     favorite_by = db.relationship('FavoriteCharacters', back_populates='character_relationship')
@@ -69,7 +115,26 @@ class Character(db.Model):
     def __repr__(self):
         return f'Personaje {self.name}'
     
-    def serialize(self):
+    SERIALIZE_FIELDS = ('id', 'name', 'specie', 'gender', 'age', 'height', 'weight')
+    EXPANDABLE = {'planet': 'planet_relationship'}
+    FILTERS = {
+        'name_prefix': ('name', 'prefix'),
+        'specie': ('specie', 'eq'),
+        'gender': ('gender', 'eq'),
+        'planet_id': ('planet_id', 'eq'),
+        'min_age': ('age', 'min'),
+        'max_age': ('age', 'max'),
+        'min_height': ('height', 'min'),
+        'max_height': ('height', 'max'),
+        'min_weight': ('weight', 'min'),
+        'max_weight': ('weight', 'max')
+    }
+    SORTABLE = ('id', 'name', 'age', 'height', 'weight')
+    SEARCHABLE = ('name', 'specie', 'gender')
+
+    def serialize(self, fields=None):
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
         return{
             'id': self.id,
             'name': self.name,
@@ -82,10 +147,12 @@ class Character(db.Model):
     
 class FavoritePlanets(db.Model):
     __tablename__ = 'favoriteplanets'
+    #Un usuario solo puede tener cada planeta una vez en favoritos. El índice único también acelera las búsquedas por (user_id, planet_id).
+    __table_args__ = (db.UniqueConstraint('user_id', 'planet_id', name='uq_favoriteplanets_user_planet'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user_relationship = db.relationship('User', back_populates='planets_favorites')
-    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planet.id'), nullable=False, index=True) #Indexada para contar los favoritos de un planeta (favorites-reconcile).
     planet_relationship = db.relationship('Planet', back_populates='favorite_by')
 
     def __repr__(self):
@@ -100,10 +167,11 @@ class FavoritePlanets(db.Model):
     
 class FavoriteCharacters(db.Model):
     __tablename__ = 'favoritecharacters'
+    __table_args__ = (db.UniqueConstraint('user_id', 'character_id', name='uq_favoritecharacters_user_character'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user_relationship = db.relationship('User', back_populates='characters_favorites')
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False)
+    character_id = db.Column(db.Integer, db.ForeignKey('character.id'), nullable=False, index=True)
     character_relationship = db.relationship('Character', back_populates='favorite_by')
 
     def __repr__(self):
@@ -115,4 +183,20 @@ class FavoriteCharacters(db.Model):
             'user_id': self.user_id,
             'character_id': self.character_id
         }
+
+#Versión del catálogo para los snapshots en memoria (snapshot.py): una sola fila con un contador que cada escritura
+#incrementa en su misma transacción, y el registro de qué ids cambiaron en cada versión.
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+#La fila del contador, igual que la inserta la migración, también cuando la tabla se crea con db.create_all().
+event.listen(CatalogVersion.__table__, 'after_create', DDL('INSERT INTO catalog_version (id, version) VALUES (1, 0)'))
+
+class CatalogChange(db.Model):
+    __tablename__ = 'catalog_change'
+    version = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    kind = db.Column(db.String(20), nullable=False) #'planet', 'character' o '*' (hay que recargar todo).
+    ids = db.Column(db.Text, nullable=False, default='') #Ids separados por comas.
  #Recuerda actualizar PSQL: Migrate, updgrate.  
\ No newline at end of file
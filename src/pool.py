@@ -0,0 +1,125 @@
+"""
+Connection pool settings read from the environment, pool statistics fed by SQLAlchemy pool events
+and a fork hook so gunicorn workers never share connections opened by the master (--preload).
+"""
+import os
+import threading
+import time
+from flask import jsonify
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    #QueuePool que mide cuánto espera cada checkout a que haya una conexión libre.
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = getattr(self, 'stats', None)
+            if stats is not None:
+                stats.record_wait(time.perf_counter() - started)
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.connect_errors = 0
+        self.disconnects = 0
+        self.invalidations = 0
+        self.checkouts = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self, pool):
+        with self._lock:
+            data = {
+                'connects': self.connects,
+                'connect_errors': self.connect_errors,
+                'disconnects': self.disconnects,
+                'invalidations': self.invalidations,
+                'checkouts': self.checkouts,
+                'wait': {
+                    'count': self.wait_count,
+                    'total_seconds': round(self.wait_total, 6),
+                    'max_seconds': round(self.wait_max, 6),
+                    'mean_seconds': round(self.wait_total / self.wait_count, 6) if self.wait_count else 0.0,
+                },
+            }
+        data['pool'] = type(pool).__name__
+        if isinstance(pool, QueuePool):
+            data.update({'size': pool.size(), 'checked_in': pool.checkedin(),
+                         'checked_out': pool.checkedout(), 'overflow': pool.overflow()})
+        return data
+
+
+def engine_options_from_env(database_uri):
+    #DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT, DATABASE_POOL_RECYCLE y DATABASE_POOL_PRE_PING.
+    #pre_ping está activo por defecto para recuperarse de conexiones cortadas por PostgreSQL.
+    options = {'pool_pre_ping': os.getenv('DATABASE_POOL_PRE_PING', '1').lower() in ('1', 'true')}
+    if database_uri.startswith('sqlite') and ':memory:' in database_uri:
+        return options #SQLite en memoria usa su propio pool de una conexión.
+    options['poolclass'] = TimedQueuePool
+    for env, option, cast in (('DATABASE_POOL_SIZE', 'pool_size', int),
+                              ('DATABASE_MAX_OVERFLOW', 'max_overflow', int),
+                              ('DATABASE_POOL_TIMEOUT', 'pool_timeout', float),
+                              ('DATABASE_POOL_RECYCLE', 'pool_recycle', int)):
+        value = os.getenv(env)
+        if value is not None:
+            options[option] = cast(value)
+    return options
+
+
+def instrument_engine(engine, stats):
+    pool = engine.pool
+    pool.stats = stats
+    event.listen(pool, 'connect', lambda dbapi_connection, record: stats.increment('connects'))
+    event.listen(pool, 'checkout', lambda dbapi_connection, record, proxy: stats.increment('checkouts'))
+    event.listen(pool, 'invalidate', lambda dbapi_connection, record, exception: stats.increment('invalidations'))
+
+    @event.listens_for(engine, 'handle_error')
+    def count_errors(context):
+        if context.is_disconnect:
+            stats.increment('disconnects')
+        if context.connection is None: #El error ocurrió al abrir la conexión.
+            stats.increment('connect_errors')
+
+
+def setup_pool(app, db):
+    #Se llama después de db.init_app(app). Devuelve {nombre del engine: PoolStats}.
+    with app.app_context():
+        engines = {name or 'default': engine for name, engine in db.engines.items()}
+    pool_stats = {name: PoolStats() for name in engines}
+    for name, engine in engines.items():
+        instrument_engine(engine, pool_stats[name])
+
+    def reset_after_fork():
+        #Con gunicorn --preload el master importa la app antes del fork: cada worker descarta las conexiones
+        #heredadas (sin cerrarlas, siguen siendo del master) y abre las suyas.
+        for name, engine in engines.items():
+            engine.dispose(close=False)
+            engine.pool.stats = pool_stats[name]
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=reset_after_fork)
+
+    @app.route('/pool/stats', methods=['GET'])
+    def pool_stats_endpoint():
+        data = {name: stats.snapshot(engines[name].pool) for name, stats in pool_stats.items()}
+        return jsonify({'msg': 'ok', 'pid': os.getpid(), 'data': data}), 200
+
+    app.extensions['pool_stats'] = pool_stats
+    return pool_stats
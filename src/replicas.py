@@ -0,0 +1,77 @@
+"""
+Optional read replicas (DATABASE_REPLICA_URLS, comma separated).
+Routes marked with @read_only send their queries round-robin to the replicas; everything else,
+and every flush, stays on the primary. After a client writes, its reads go to the primary for
+DATABASE_REPLICA_RYW_SECONDS (read-your-writes), tracked with a cookie.
+"""
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+from flask import g, request, has_request_context, current_app
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_PREFIX = 'replica_'
+RYW_COOKIE = 'ryw_until'
+MUTATING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_cycle_lock = threading.Lock()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reading_from_replica():
+            if 'replica_bind' not in g: #Todas las consultas de una misma solicitud van a la misma réplica.
+                with _cycle_lock:
+                    g.replica_bind = next(current_app.extensions['replica_binds'])
+            return self._db.engines[g.replica_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_urls_from_env():
+    urls = os.getenv('DATABASE_REPLICA_URLS', '')
+    return [url.strip().replace('postgres://', 'postgresql://') for url in urls.split(',') if url.strip()]
+
+
+def setup_replicas(app):
+    #Se llama antes de db.init_app(app): registra cada réplica como un bind de Flask-SQLAlchemy.
+    urls = replica_urls_from_env()
+    ryw_seconds = float(os.getenv('DATABASE_REPLICA_RYW_SECONDS', 5))
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    names = []
+    for index, url in enumerate(urls):
+        names.append(f'{REPLICA_BIND_PREFIX}{index}')
+        binds[names[-1]] = url
+    app.extensions['replica_binds'] = itertools.cycle(names) if names else None
+
+    if names:
+        @app.after_request
+        def remember_write(response):
+            if request.method in MUTATING_METHODS and response.status_code < 400:
+                response.set_cookie(RYW_COOKIE, str(time.time() + ryw_seconds), max_age=int(ryw_seconds) + 1, httponly=True)
+            return response
+    return names
+
+
+def recent_write(cookies):
+    #True dentro de la ventana read-your-writes: el cliente escribió hace menos de DATABASE_REPLICA_RYW_SECONDS.
+    try:
+        return float(cookies.get(RYW_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def reading_from_replica():
+    #True si las consultas de la solicitud actual van a una réplica: ruta @read_only, hay réplicas configuradas
+    #y el cliente no está dentro de su ventana read-your-writes.
+    return has_request_context() and bool(g.get('use_replica')) and bool(current_app.extensions.get('replica_binds'))
+
+
+def read_only(view):
+    #Marca una ruta GET segura para leer desde una réplica, salvo dentro de la ventana read-your-writes.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = not recent_write(request.cookies)
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,341 @@
+"""
+Full-text search over planets and characters (GET /search?q=).
+
+Three backends, chosen from the database dialect:
+- PostgreSQL: tsvector expressions with GIN indexes (migration e9b1c4f7a2d5). PostgreSQL keeps them up to date.
+- SQLite: an FTS5 table (search_fts) created on first use, on the primary, with triggers on planet and
+  character that update it in the same transaction as every write (handlers, bulk endpoints, admin, flask
+  catalog import), so it cannot fall behind the tables.
+- Anything else, or SQLite built without FTS5: an inverted index in the memory of each worker. It is
+  updated by the handlers of that worker and catches up with other workers through updated_at.
+SEARCH_BACKEND=memory forces the in-process index.
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import click
+from bisect import bisect_left, insort
+from collections import defaultdict
+from sqlalchemy import func, select, text
+from utils import APIException
+from models import db, Planet, Character
+
+#type -> modelo. El código es el resto de rowid % 2 en la tabla FTS5 (rowid = id * 2 + código).
+KINDS = {'planet': Planet, 'character': Character}
+KIND_CODES = {'planet': 0, 'character': 1}
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_TERMS = 10
+WRITE_BATCH_SIZE = 10000
+NAME_WEIGHT = 2.0 #Una coincidencia en name vale el doble que en el resto de columnas.
+
+#Misma expresión que los índices GIN de la migración: si cambia aquí hay que cambiarla allí.
+PG_VECTORS = {
+    'planet': "setweight(to_tsvector('simple', name), 'A') || to_tsvector('simple', climated || ' ' || terrain)",
+    'character': "setweight(to_tsvector('simple', name), 'A') || to_tsvector('simple', specie || ' ' || gender)",
+}
+
+
+def tokenize(value):
+    return re.findall(r'\w+', value.lower())
+
+def document(model, row):
+    #(texto de name, texto del resto de columnas de model.SEARCHABLE).
+    name, *details = model.SEARCHABLE
+    return getattr(row, name), ' '.join(str(getattr(row, column)) for column in details)
+
+def load_documents(session, model, ids=None):
+    statement = select(model.id, *[getattr(model, column) for column in model.SEARCHABLE])
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    return session.execute(statement)
+
+def parse_search_args(args):
+    #?q=luke sky -> ['luke', 'sky']: todas las palabras tienen que aparecer y la última se busca como prefijo.
+    terms = tokenize(args.get('q', ''))[:MAX_TERMS]
+    if not terms:
+        raise APIException('El parámetro q es obligatorio', status_code=400)
+    kinds = list(dict.fromkeys(kind.strip() for kind in args.get('type', ','.join(KINDS)).split(',') if kind.strip()))
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown or not kinds:
+        raise APIException(f'El parámetro type debe ser uno de: {", ".join(KINDS)}', status_code=400)
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise APIException('El parámetro limit debe ser un número entero', status_code=400)
+    if limit < 1 or limit > MAX_LIMIT:
+        raise APIException(f'El parámetro limit debe estar entre 1 y {MAX_LIMIT}', status_code=400)
+    return terms, kinds, limit
+
+
+class SearchBackend:
+    #search() devuelve [(type, id, rank)] ordenado de mayor a menor rank.
+    def search(self, session, terms, kinds, limit):
+        raise NotImplementedError
+
+    def upsert(self, session, model, ids):
+        pass
+
+    def remove(self, session, model, ids):
+        pass
+
+    def rebuild(self, session):
+        pass
+
+
+class PostgresSearch(SearchBackend):
+    #Los índices GIN sobre las expresiones tsvector se mantienen solos en cada INSERT/UPDATE/DELETE.
+    def search(self, session, terms, kinds, limit):
+        query = ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+        selects = [f"SELECT '{kind}' AS kind, id, ts_rank({PG_VECTORS[kind]}, query) AS rank "
+                   f"FROM {KINDS[kind].__tablename__}, to_tsquery('simple', :query) AS query "
+                   f"WHERE {PG_VECTORS[kind]} @@ query" for kind in kinds]
+        sql = ' UNION ALL '.join(selects) + ' ORDER BY rank DESC, kind, id LIMIT :limit'
+        return session.execute(text(sql), {'query': query, 'limit': limit}).all()
+
+
+class SQLiteSearch(SearchBackend):
+    TABLE = 'search_fts'
+
+    def __init__(self):
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        #El módulo sqlite3 de Python usa la misma biblioteca SQLite que el engine, sin abrir la base de datos.
+        try:
+            sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(content)')
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def ensure(self, session):
+        #Crea la tabla FTS5 y sus triggers la primera vez y la llena con las filas que ya existen. Siempre en el
+        #primario, aunque llegue desde /search (@read_only). Una tabla creada antes de los triggers se vuelve a
+        #llenar al crearlos: pudo quedar desfasada (admin, flask catalog import).
+        url = db.engine.url
+        if url in self._ready:
+            return
+        with self._lock:
+            if url in self._ready:
+                return
+            connection = session.connection(bind_arguments={'bind': db.engine})
+            triggers = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'").scalars())
+            if not set(self._triggers()) <= triggers:
+                connection.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} USING fts5(name, details, tokenize = 'unicode61')")
+                connection.exec_driver_sql(f'DELETE FROM {self.TABLE}')
+                for kind, model in KINDS.items():
+                    self._write(connection, kind, load_documents(connection, model))
+                for statement in self._triggers().values():
+                    connection.exec_driver_sql(statement)
+            session.commit()
+            self._ready.add(url)
+
+    def _triggers(self):
+        #nombre -> CREATE TRIGGER. Misma fila que document(): rowid = id * 2 + código, name y el resto de columnas.
+        triggers = {}
+        for kind, model in KINDS.items():
+            table = model.__tablename__
+            name_column, *detail_columns = model.SEARCHABLE
+            details = " || ' ' || ".join(f'new.{column}' for column in detail_columns)
+            values = f'new.id * 2 + {KIND_CODES[kind]}, new.{name_column}, {details}'
+            upsert = f'INSERT OR REPLACE INTO {self.TABLE} (rowid, name, details) VALUES ({values})'
+            triggers[f'{self.TABLE}_{table}_insert'] = f'AFTER INSERT ON {table} BEGIN {upsert}; END'
+            triggers[f'{self.TABLE}_{table}_update'] = (f'AFTER UPDATE OF {", ".join(model.SEARCHABLE)} ON {table} '
+                                                        f'BEGIN {upsert}; END')
+            triggers[f'{self.TABLE}_{table}_delete'] = (f'AFTER DELETE ON {table} BEGIN DELETE FROM {self.TABLE} '
+                                                        f'WHERE rowid = old.id * 2 + {KIND_CODES[kind]}; END')
+        return {name: f'CREATE TRIGGER IF NOT EXISTS {name} {body}' for name, body in triggers.items()}
+
+    def _write(self, connection, kind, rows):
+        code = KIND_CODES[kind]
+        model = KINDS[kind]
+        batch = []
+        for row in rows:
+            batch.append((row.id * 2 + code, *document(model, row)))
+            if len(batch) >= WRITE_BATCH_SIZE:
+                self._insert(connection, batch)
+                batch = []
+        self._insert(connection, batch)
+
+    def _insert(self, connection, batch):
+        if batch:
+            connection.exec_driver_sql(f'INSERT OR REPLACE INTO {self.TABLE} (rowid, name, details) VALUES (?, ?, ?)', batch)
+
+    def search(self, session, terms, kinds, limit):
+        self.ensure(session)
+        query = ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}" *'])
+        kind_filter = '' if len(kinds) == len(KINDS) else f' AND rowid % 2 = {KIND_CODES[kinds[0]]}'
+        rows = session.execute(text(
+            f"SELECT rowid, rank FROM {self.TABLE} WHERE {self.TABLE} MATCH :query AND rank MATCH 'bm25({NAME_WEIGHT}, 1.0)'"
+            f"{kind_filter} ORDER BY rank LIMIT :limit"), {'query': query, 'limit': limit})
+        names = {code: kind for kind, code in KIND_CODES.items()}
+        #bm25() es negativo (más negativo = más relevante): lo invertimos para que rank crezca con la relevancia.
+        return [(names[rowid % 2], rowid // 2, -rank) for rowid, rank in rows]
+
+    #upsert() y remove() no hacen nada: los triggers ya actualizaron la tabla en la transacción de la escritura.
+
+    def rebuild(self, session):
+        connection = session.connection(bind_arguments={'bind': db.engine})
+        for name in self._triggers():
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {self.TABLE}')
+        self._ready.clear()
+        self.ensure(session) #Vuelve a crear la tabla y los triggers en la misma transacción que el DROP.
+
+
+class MemorySearch(SearchBackend):
+    #Índice invertido en memoria: token -> {(type, id): peso}. Cada worker tiene el suyo.
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._vocabulary = [] #Tokens ordenados para buscar prefijos con bisect.
+        self._versions = {} #type -> (max(updated_at), count) que refleja el índice.
+
+    def _add(self, kind, id, name, details):
+        key = (kind, id)
+        self._discard(key)
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(details):
+            weights[token] += 1.0
+        for token, weight in weights.items():
+            if token not in self._postings:
+                insort(self._vocabulary, token)
+            self._postings[token][key] = weight
+        self._documents[key] = tuple(weights)
+
+    def _discard(self, key):
+        for token in self._documents.pop(key, ()):
+            postings = self._postings[token]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary.pop(bisect_left(self._vocabulary, token))
+
+    def _load(self, session, kind, ids=None):
+        model = KINDS[kind]
+        for row in load_documents(session, model, ids):
+            self._add(kind, row.id, *document(model, row))
+
+    def _refresh(self, session):
+        #Dos agregados indexados por tabla: si otro worker escribió, traemos solo las filas con updated_at >= la marca.
+        #Si el número de filas no cuadra (borrados de otro worker) reconstruimos ese type.
+        for kind, model in KINDS.items():
+            version = session.execute(select(func.max(model.updated_at), func.count(model.id))).one()
+            known = self._versions.get(kind)
+            if known == tuple(version):
+                continue
+            if known is not None and known[0] is not None and version[0] is not None:
+                ids = session.scalars(select(model.id).where(model.updated_at >= known[0])).all()
+                self._load(session, kind, ids)
+            count = sum(1 for key in self._documents if key[0] == kind)
+            if known is None or count != version[1]:
+                for key in [key for key in self._documents if key[0] == kind]:
+                    self._discard(key)
+                self._load(session, kind)
+            self._versions[kind] = tuple(version)
+
+    def _matches(self, term, prefix):
+        if not prefix:
+            return self._postings.get(term, {})
+        merged = {}
+        position = bisect_left(self._vocabulary, term)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(term):
+            for key, weight in self._postings[self._vocabulary[position]].items():
+                merged[key] = max(merged.get(key, 0.0), weight)
+            position += 1
+        return merged
+
+    def search(self, session, terms, kinds, limit):
+        with self._lock:
+            self._refresh(session)
+            total = len(self._documents) or 1
+            matches = [self._matches(term, prefix=index == len(terms) - 1) for index, term in enumerate(terms)]
+            matches.sort(key=len) #Empezamos por el término más raro: el resto solo se consulta para sus candidatos.
+            scores = None
+            for postings in matches:
+                idf = math.log(1 + total / (len(postings) or 1))
+                if scores is None:
+                    scores = {key: weight * idf for key, weight in postings.items() if key[0] in kinds}
+                else:
+                    scores = {key: score + postings[key] * idf for key, score in scores.items() if key in postings}
+                if not scores:
+                    return []
+            best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(kind, id, score) for (kind, id), score in best]
+
+    def upsert(self, session, model, ids):
+        with self._lock:
+            if model.__tablename__ in self._versions:
+                self._load(session, model.__tablename__, ids)
+
+    def remove(self, session, model, ids):
+        with self._lock:
+            for id in ids:
+                self._discard((model.__tablename__, id))
+
+    def rebuild(self, session):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._vocabulary.clear()
+            self._versions.clear()
+            self._refresh(session)
+
+
+class SearchIndex:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def search(self, terms, kinds, limit):
+        #Una consulta de ranking y luego una consulta IN por type para serializar los resultados.
+        hits = self.backend.search(db.session, terms, kinds, limit)
+        rows = {}
+        for kind in kinds:
+            ids = [id for hit_kind, id, rank in hits if hit_kind == kind]
+            if ids:
+                model = KINDS[kind]
+                rows.update({(kind, row.id): row for row in model.query.filter(model.id.in_(ids))})
+        return [{'type': kind, 'id': id, 'rank': round(float(rank), 6), 'data': rows[(kind, id)].serialize()}
+                for kind, id, rank in hits if (kind, id) in rows]
+
+    #Los handlers de escritura y el admin llaman a estos métodos después del commit, igual que con la cache. Solo
+    #los usa el índice en memoria: PostgreSQL y SQLite se actualizan en la misma transacción que la escritura.
+    def upsert(self, model, ids):
+        if ids and model.__tablename__ in KINDS:
+            self.backend.upsert(db.session, model, list(ids))
+
+    def remove(self, model, ids):
+        if ids and model.__tablename__ in KINDS:
+            self.backend.remove(db.session, model, list(ids))
+
+    def rebuild(self):
+        self.backend.rebuild(db.session)
+
+
+def setup_search(app):
+    #Se llama después de db.init_app(app).
+    with app.app_context():
+        engine = db.engine #Solo mira el dialecto, no abre ninguna conexión.
+        backend = None
+        if os.getenv('SEARCH_BACKEND') != 'memory':
+            if engine.dialect.name == 'postgresql':
+                backend = PostgresSearch()
+            elif engine.dialect.name == 'sqlite' and SQLiteSearch.available():
+                backend = SQLiteSearch()
+        index = SearchIndex(backend or MemorySearch())
+
+    @app.cli.command('search-rebuild')
+    def search_rebuild():
+        """Reconstruye el índice de búsqueda (por ejemplo, después de cargar datos fuera de la API)."""
+        index.rebuild()
+        click.echo(f'Índice de búsqueda reconstruido ({type(index.backend).__name__})')
+
+    app.extensions['search_index'] = index
+    return index
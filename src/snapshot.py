@@ -0,0 +1,388 @@
+"""
+In-memory snapshot of the catalog (planets and characters) that serves GET /planets, /planet/<id>, /characters
+and /character/<id> without querying the tables. CATALOG_SNAPSHOT=1 turns it on.
+- Each worker loads both tables on its first catalog request into __slots__ records indexed by id, plus the
+  residents of every planet (character ids in order). Every ?sort= column gets an array of ids in (column, id)
+  order the first time it is used, which is then kept up to date: filters, sort, cursors, ?fields=/?expand=
+  and the ETags give the same results as the SQL path.
+- Every write to planets or characters (handlers, bulk endpoints, admin, flask catalog import) bumps a version
+  counter (catalog_version) and logs the changed ids (catalog_change) in the transaction of the write, right before
+  the commit, whether or not that process has CATALOG_SNAPSHOT=1. Before answering, a worker compares its
+  version with the counter (one primary-key lookup) and reloads only the logged ids. If the log no longer
+  reaches back to its version it reloads everything. Every gunicorn worker therefore serves what the database
+  had at its last commit. The counter, the log and the rows are always read from the primary, also on
+  @read_only routes, and a worker never goes back to a lower version (after restoring the database, restart
+  the workers). Writes made with plain SQL outside the app are not logged.
+CATALOG_SNAPSHOT_MAX_LAG=seconds skips that lookup for that long (0: on every request).
+Strings sort by code point, like SQLite and PostgreSQL with the C collation.
+"""
+import os
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from flask import request, jsonify, current_app
+from sqlalchemy import select, update, insert, delete, inspect
+from sqlalchemy.exc import IntegrityError
+from utils import parse_filter_values, parse_page_args, wants_stream, stream_json_items, next_page
+from models import db, Planet, Character, CatalogVersion, CatalogChange
+
+LOAD_BATCH_SIZE = 5000 #Ids por consulta IN al recargar las filas cambiadas.
+CHANGE_RETENTION = 10000 #Versiones que se guardan en catalog_change. Un worker más atrasado recarga todo.
+FULL_RELOAD = '*'
+
+
+def primary_bind():
+    #El snapshot lee siempre del primario, aunque la ruta sea @read_only: con dos réplicas con distinto retraso
+    #la versión subiría y bajaría de una solicitud a otra.
+    return {'bind': db.engine}
+
+FILTER_TESTS = {
+    'eq': lambda value, expected: value == expected,
+    'min': lambda value, expected: value >= expected,
+    'max': lambda value, expected: value <= expected,
+    'prefix': lambda value, expected: value.startswith(expected), #Mismo rango que prefix_match.
+}
+
+
+class PlanetRecord:
+    __slots__ = ('id', 'name', 'population', 'diameter', 'climated', 'terrain', 'updated_at')
+    model = Planet
+
+    def __init__(self, id, name, population, diameter, climated, terrain, updated_at):
+        self.id = id
+        self.name = name
+        self.population = population
+        self.diameter = diameter
+        self.climated = sys.intern(climated) #Pocos valores distintos: una sola copia de cada string.
+        self.terrain = sys.intern(terrain)
+        self.updated_at = updated_at
+
+    def serialize(self, fields=None):
+        return {field: getattr(self, field) for field in fields or Planet.SERIALIZE_FIELDS}
+
+
+class CharacterRecord:
+    __slots__ = ('id', 'name', 'specie', 'gender', 'age', 'height', 'weight', 'planet_id', 'updated_at')
+    model = Character
+
+    def __init__(self, id, name, specie, gender, age, height, weight, planet_id, updated_at):
+        self.id = id
+        self.name = name
+        self.specie = sys.intern(specie)
+        self.gender = sys.intern(gender)
+        self.age = age
+        self.height = height
+        self.weight = weight
+        self.planet_id = planet_id
+        self.updated_at = updated_at
+
+    def serialize(self, fields=None):
+        return {field: getattr(self, field) for field in fields or Character.SERIALIZE_FIELDS}
+
+
+class Table:
+    #Registros de un modelo por id y, por cada columna de ?sort= ya usada, un array de ids en orden (columna, id).
+    def __init__(self, record_class):
+        self.record_class = record_class
+        self.model = record_class.model
+        self.rows = {}
+        self.orders = {}
+        self._last_modified = None
+        self._last_modified_stale = True
+
+    def columns(self):
+        return [getattr(self.model, column) for column in self.record_class.__slots__]
+
+    def sort_key(self, column):
+        if column == 'id':
+            return None
+        rows = self.rows
+        return lambda id: (getattr(rows[id], column), id)
+
+    def order(self, column):
+        #Se construye la primera vez que se pide ese orden (ordenar 1M de ids tarda alrededor de un segundo).
+        ids = self.orders.get(column)
+        if ids is None:
+            ids = self.orders[column] = array('i', sorted(self.rows, key=self.sort_key(column)))
+        return ids
+
+    def load(self, rows):
+        self.rows = {row[0]: self.record_class(*row) for row in rows}
+        self.orders = {'id': array('i', sorted(self.rows))}
+        self._last_modified_stale = True
+
+    def put(self, record):
+        #Devuelve el registro anterior (o None). Las posiciones viejas se quitan antes de reemplazarlo en rows.
+        old = self.rows.get(record.id)
+        if old is not None:
+            self._unlink(old)
+        self.rows[record.id] = record
+        for column, ids in self.orders.items():
+            insort(ids, record.id, key=self.sort_key(column))
+        if not self._last_modified_stale:
+            if old is not None and old.updated_at == self._last_modified and record.updated_at < old.updated_at:
+                self._last_modified_stale = True
+            elif self._last_modified is None or record.updated_at > self._last_modified:
+                self._last_modified = record.updated_at
+        return old
+
+    def drop(self, id):
+        old = self.rows.get(id)
+        if old is not None:
+            self._unlink(old)
+            del self.rows[id]
+            if old.updated_at == self._last_modified:
+                self._last_modified_stale = True
+        return old
+
+    def _unlink(self, record):
+        for column, ids in self.orders.items():
+            key = self.sort_key(column)
+            ids.pop(bisect_left(ids, key(record.id) if key else record.id, key=key))
+
+    def version(self):
+        #(max(updated_at), count), los mismos valores que la consulta agregada de collection_validators.
+        #El máximo solo se recorre de nuevo cuando se borra o retrocede la fila más reciente.
+        if self._last_modified_stale:
+            self._last_modified = max((record.updated_at for record in self.rows.values()), default=None)
+            self._last_modified_stale = False
+        return self._last_modified, len(self.rows)
+
+    def scan(self, ids, filters, sort, after=None):
+        #Recorre ids (en orden ascendente de sort) en el orden pedido desde el cursor y devuelve los registros
+        #que cumplen los filtros.
+        column, descending = sort
+        key = self.sort_key(column)
+        if after is None:
+            start = len(ids) if descending else 0
+        else:
+            position = tuple(after) if key is not None else after[1] if isinstance(after, tuple) else after
+            start = bisect_left(ids, position, key=key) if descending else bisect_right(ids, position, key=key)
+        positions = range(start - 1, -1, -1) if descending else range(start, len(ids))
+        tests = [(name, FILTER_TESTS[operator], value) for name, operator, value in filters]
+        rows = self.rows
+        for position in positions:
+            record = rows[ids[position]]
+            if all(test(getattr(record, name), value) for name, test, value in tests):
+                yield record
+
+
+class CatalogSnapshot:
+    def __init__(self, max_lag=0.0):
+        self.max_lag = max_lag
+        self.planets = Table(PlanetRecord)
+        self.characters = Table(CharacterRecord)
+        self.residents = {} #planet_id -> [ids de sus personajes], ordenados.
+        self.version = None #None: todavía no se cargó en este worker.
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self.full_loads = 0
+        self.refreshes = 0
+        self.rows_reloaded = 0
+        self.last_full_load_seconds = None
+
+    def table(self, model):
+        return self.planets if model is Planet else self.characters
+
+    #Lectura.
+    def refresh(self):
+        now = time.monotonic()
+        if self.version is not None and now - self._checked < self.max_lag:
+            return
+        with self._lock:
+            session = db.session
+            current = session.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1),
+                                     bind_arguments=primary_bind()) or 0
+            self._checked = now
+            if self.version is None:
+                self._load_all(session, current)
+                return
+            if current <= self.version:
+                return
+            changes = session.execute(select(CatalogChange.kind, CatalogChange.version, CatalogChange.ids)
+                                      .where(CatalogChange.version > self.version)
+                                      .order_by(CatalogChange.version), bind_arguments=primary_bind()).all()
+            if not changes or changes[0].version != self.version + 1 or any(change.kind == FULL_RELOAD for change in changes):
+                self._load_all(session, max(current, changes[-1].version if changes else 0))
+                return
+            changed = {Planet.__tablename__: set(), Character.__tablename__: set()}
+            for change in changes:
+                changed[change.kind].update(int(id) for id in change.ids.split(','))
+            #Primero los planetas: los personajes expandidos apuntan a ellos.
+            self._reload(session, self.planets, changed[Planet.__tablename__])
+            self._reload(session, self.characters, changed[Character.__tablename__])
+            self.version = max(current, changes[-1].version)
+            self.refreshes += 1
+
+    def _load_all(self, session, version):
+        #La versión se lee antes que las filas: lo que se confirme mientras tanto se vuelve a aplicar en la
+        #siguiente recarga, y aplicar dos veces la misma fila no cambia nada.
+        started = time.perf_counter()
+        self.planets.load(session.execute(select(*self.planets.columns()), bind_arguments=primary_bind()))
+        self.characters.load(session.execute(select(*self.characters.columns()), bind_arguments=primary_bind()))
+        residents = {}
+        for id in self.characters.orders['id']:
+            residents.setdefault(self.characters.rows[id].planet_id, array('i')).append(id)
+        self.residents = residents
+        self.version = version
+        self.full_loads += 1
+        self.last_full_load_seconds = round(time.perf_counter() - started, 3)
+
+    def _reload(self, session, table, ids):
+        ids = sorted(ids)
+        for start in range(0, len(ids), LOAD_BATCH_SIZE):
+            batch = ids[start:start + LOAD_BATCH_SIZE]
+            found = set()
+            for row in session.execute(select(*table.columns()).where(table.model.id.in_(batch)),
+                                       bind_arguments=primary_bind()):
+                record = table.record_class(*row)
+                found.add(record.id)
+                self._move_resident(table.put(record), record)
+            for id in batch:
+                if id not in found:
+                    self._move_resident(table.drop(id), None)
+            self.rows_reloaded += len(batch)
+
+    def _move_resident(self, old, new):
+        if not isinstance(old or new, CharacterRecord):
+            return
+        if old is not None and (new is None or old.planet_id != new.planet_id):
+            ids = self.residents[old.planet_id]
+            ids.pop(bisect_left(ids, old.id))
+        if new is not None and (old is None or old.planet_id != new.planet_id):
+            insort(self.residents.setdefault(new.planet_id, array('i')), new.id)
+
+    def serializer(self, fields, expand):
+        def serialize(record):
+            data = record.serialize(fields)
+            if 'residents' in expand:
+                characters = self.characters.rows
+                data['residents'] = [characters[id].serialize() for id in self.residents.get(record.id, ()) if id in characters]
+            if 'planet' in expand:
+                planet = self.planets.rows.get(record.planet_id)
+                data['planet'] = planet.serialize() if planet is not None else None
+            return data
+        return serialize
+
+    def candidates(self, table, filters, sort):
+        #Ids en orden ascendente de sort. Con ?planet_id= partimos de los residentes del planeta.
+        planet_id = [value for name, operator, value in filters if name == 'planet_id' and operator == 'eq']
+        if table is not self.characters or not planet_id:
+            return table.order(sort[0])
+        ids = self.residents.get(planet_id[0], ())
+        return ids if sort[0] == 'id' else sorted(ids, key=table.sort_key(sort[0]))
+
+    def page(self, model, filters, sort, limit, after, fields, expand):
+        with self._lock:
+            table = self.table(model)
+            rows = list(islice(table.scan(self.candidates(table, filters, sort), filters, sort, after), limit + 1))
+            rows, next_cursor = next_page(rows, limit, sort)
+            return [self.serializer(fields, expand)(row) for row in rows], next_cursor
+
+    def records(self, model, filters, sort):
+        #Todos los registros del listado (?stream=true). Los registros no se modifican, se reemplazan: se pueden
+        #serializar fuera del lock mientras otro hilo aplica cambios.
+        with self._lock:
+            table = self.table(model)
+            return list(table.scan(self.candidates(table, filters, sort), filters, sort))
+
+    def get(self, model, id, fields, expand):
+        with self._lock:
+            record = self.table(model).rows.get(id)
+            return self.serializer(fields, expand)(record) if record is not None else None
+
+    def planet_version(self, id):
+        #(updated_at del planeta, max(updated_at) de sus residentes, número de residentes) como en single_planet.
+        with self._lock:
+            planet = self.planets.rows.get(id)
+            if planet is None:
+                return None
+            characters = self.characters.rows
+            residents = [characters[resident].updated_at for resident in self.residents.get(id, ()) if resident in characters]
+            return planet.updated_at, max(residents, default=None), len(residents)
+
+    def stats(self):
+        with self._lock:
+            return {'version': self.version, 'planets': len(self.planets.rows), 'characters': len(self.characters.rows),
+                    'sort_orders': {table.model.__tablename__: sorted(table.orders) for table in (self.planets, self.characters)},
+                    'full_loads': self.full_loads, 'refreshes': self.refreshes, 'rows_reloaded': self.rows_reloaded,
+                    'last_full_load_seconds': self.last_full_load_seconds, 'max_lag_seconds': self.max_lag}
+
+
+def current_snapshot():
+    #El snapshot al día, o None si CATALOG_SNAPSHOT no está activo.
+    snapshot = current_app.extensions.get('catalog_snapshot')
+    if snapshot is not None:
+        snapshot.refresh()
+    return snapshot
+
+def snapshot_changed(model, ids):
+    #Registra que esas filas cambiaron para que los workers con CATALOG_SNAPSHOT=1 las recarguen. Se llama antes
+    #del commit del que escribe, en su misma transacción: o se confirman los datos y el registro, o ninguno.
+    if model not in (Planet, Character):
+        return
+    ids = sorted(set(ids))
+    if ids:
+        log_catalog_change(model.__tablename__, ','.join(str(id) for id in ids))
+
+def snapshot_changed_all():
+    #Para cargas que no pasan por los handlers (flask catalog import): todos los workers recargan todo.
+    log_catalog_change(FULL_RELOAD, '')
+
+def catalog_log_enabled():
+    #Se registra siempre que exista la tabla catalog_version, aunque este proceso no tenga CATALOG_SNAPSHOT=1:
+    #los demás workers sí pueden tenerlo. Solo se recuerda el sí: la tabla puede aparecer con una migración.
+    if current_app.extensions.get('catalog_change_log'):
+        return True
+    enabled = inspect(db.session.connection()).has_table(CatalogVersion.__tablename__)
+    current_app.extensions['catalog_change_log'] = enabled
+    return enabled
+
+def log_catalog_change(kind, ids):
+    #UPDATE ... RETURNING bloquea la fila del contador hasta el commit: las versiones no se repiten, no se saltan
+    #y se confirman en orden aunque escriban varios workers a la vez. Por eso se llama justo antes del commit.
+    if not catalog_log_enabled():
+        return
+    session = db.session
+    bump = (update(CatalogVersion).where(CatalogVersion.id == 1)
+            .values(version=CatalogVersion.version + 1).returning(CatalogVersion.version))
+    version = session.execute(bump).scalar()
+    if version is None: #Base de antes de que catalog_version creara su fila (ver models.py).
+        try:
+            with session.begin_nested():
+                session.execute(insert(CatalogVersion).values(id=1, version=0))
+        except IntegrityError: #Otro worker la creó a la vez.
+            pass
+        version = session.execute(bump).scalar()
+    session.execute(insert(CatalogChange).values(version=version, kind=kind, ids=ids))
+    if version % 100 == 0:
+        session.execute(delete(CatalogChange).where(CatalogChange.version <= version - CHANGE_RETENTION))
+
+def snapshot_list(snapshot, model, fields, expand, sort):
+    #Respuesta de GET /planets o /characters desde memoria, con el mismo formato que el camino SQL.
+    filters = parse_filter_values(request.args, model)
+    if wants_stream(request.args):
+        serialize = snapshot.serializer(fields, expand)
+        records = snapshot.records(model, filters, sort)
+        return stream_json_items((serialize(record) for record in records), {'msg': 'ok', 'next': None})
+    limit, after = parse_page_args(request.args, sort)
+    data, next_cursor = snapshot.page(model, filters, sort, limit, after, fields, expand)
+    return jsonify({'msg': 'ok', 'data': data, 'next': next_cursor})
+
+
+def setup_snapshot(app):
+    #CATALOG_SNAPSHOT=1 activa el snapshot. Cada worker lo carga en su primera solicitud al catálogo, no al arrancar:
+    #con --preload el master no abre conexiones y cada worker tiene su propia copia (ver la medición en bench.py).
+    if os.getenv('CATALOG_SNAPSHOT', '0').lower() not in ('1', 'true'):
+        return None
+    snapshot = CatalogSnapshot(max_lag=float(os.getenv('CATALOG_SNAPSHOT_MAX_LAG', 0)))
+
+    @app.route('/snapshot/stats', methods=['GET'])
+    def snapshot_stats():
+        return jsonify({'msg': 'ok', 'pid': os.getpid(), 'data': snapshot.stats()}), 200
+
+    app.extensions['catalog_snapshot'] = snapshot
+    return snapshot
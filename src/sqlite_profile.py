@@ -0,0 +1,164 @@
+"""
+SQLite profile for running the app with several gunicorn workers on one database file.
+Every connection gets WAL (readers never block the writer), synchronous=NORMAL, a memory-mapped file,
+a larger page cache and a busy_timeout, all set from the pool's connect event (SQLITE_* variables).
+Transactions of POST/PUT/PATCH/DELETE requests start with BEGIN IMMEDIATE: they take the write lock
+up front and wait for it (busy_timeout) instead of failing with "database is locked" when a read
+transaction tries to become a write transaction.
+SQLITE_WRITE_QUEUE=1 also queues those transactions in the app, one writer at a time across threads
+and worker processes (flock on <database>-writer), so they wait in line instead of polling SQLite.
+"""
+import os
+import threading
+import time
+from flask import request, has_request_context, jsonify
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError: #Sin fcntl (Windows) la cola solo ordena los hilos de cada proceso.
+    fcntl = None
+
+MUTATING_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+#PRAGMA -> (variable de entorno, valor por defecto).
+PRAGMA_ENV = {
+    'journal_mode': ('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': ('SQLITE_SYNCHRONOUS', 'NORMAL'), #Con WAL, NORMAL no corrompe la base; solo puede perder el último commit si se cae el sistema.
+    'mmap_size': ('SQLITE_MMAP_SIZE', '268435456'), #256 MB leídos directamente del page cache del sistema.
+    'cache_size': ('SQLITE_CACHE_SIZE', '-65536'), #Negativo = KiB: 64 MB por conexión.
+    'busy_timeout': ('SQLITE_BUSY_TIMEOUT', '5000'), #ms esperando el lock antes de "database is locked".
+    'temp_store': ('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
+
+def pragmas_from_env():
+    return {pragma: os.getenv(env, default) for pragma, (env, default) in PRAGMA_ENV.items()}
+
+def sqlite_file(engine):
+    #Ruta del archivo, o None para bases en memoria y motores que no son SQLite.
+    if engine.dialect.name != 'sqlite':
+        return None
+    database = engine.url.database
+    if not database or database == ':memory:' or database.startswith('file::memory:'):
+        return None
+    return database
+
+
+class WriteQueue:
+    #Un solo writer a la vez: threading.Lock entre los hilos del proceso y flock entre procesos.
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._file = None
+        self._pid = None
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _lock_file(self):
+        #El archivo se abre en cada proceso: un descriptor heredado del master (--preload) compartiría el flock.
+        if self._pid != os.getpid():
+            self._file = open(self.path, 'a')
+            self._pid = os.getpid()
+        return self._file
+
+    def acquire(self):
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file(), fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.acquired += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file(), fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def snapshot(self):
+        with self._stats_lock:
+            return {'acquired': self.acquired, 'wait_total_seconds': round(self.wait_total, 6),
+                    'wait_max_seconds': round(self.wait_max, 6),
+                    'wait_mean_seconds': round(self.wait_total / self.acquired, 6) if self.acquired else 0.0}
+
+
+def is_write_request():
+    return has_request_context() and request.method in MUTATING_METHODS
+
+def apply_pragmas(engine, pragmas):
+    #También sirve para el engine async de asgi.py (engine.sync_engine): solo los PRAGMA, sin BEGIN IMMEDIATE.
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+def begin_immediate_for_writes(engine, queue=None):
+    #pysqlite abre las transacciones por su cuenta (BEGIN diferido, justo antes del primer INSERT/UPDATE):
+    #lo desactivamos y las abrimos nosotros para poder elegir BEGIN IMMEDIATE.
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        if not is_write_request():
+            conn.exec_driver_sql('BEGIN')
+            return
+        if queue is not None:
+            queue.acquire()
+            conn.info['sqlite_write_queue'] = True
+        try:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        except Exception:
+            release(conn)
+            raise
+
+    def release(conn, *args):
+        if conn.info.pop('sqlite_write_queue', False):
+            queue.release()
+
+    if queue is not None:
+        event.listen(engine, 'commit', release)
+        event.listen(engine, 'rollback', release)
+
+
+def setup_sqlite(app, db):
+    #Se llama después de db.init_app(app). SQLITE_PROFILE=0 deja SQLite con su configuración por defecto.
+    if os.getenv('SQLITE_PROFILE', '1').lower() not in ('1', 'true'):
+        return None
+    use_queue = os.getenv('SQLITE_WRITE_QUEUE', '0').lower() in ('1', 'true')
+    pragmas = pragmas_from_env()
+    with app.app_context():
+        engines = {name or 'default': engine for name, engine in db.engines.items() if sqlite_file(engine)}
+    if not engines:
+        return None
+    queues = {}
+    for name, engine in engines.items():
+        queues[name] = WriteQueue(sqlite_file(engine) + '-writer') if use_queue else None
+        apply_pragmas(engine, pragmas)
+        begin_immediate_for_writes(engine, queues[name])
+
+    @app.route('/sqlite/stats', methods=['GET'])
+    def sqlite_stats():
+        data = {}
+        for name, engine in engines.items():
+            with engine.connect() as connection:
+                current = {pragma: connection.exec_driver_sql(f'PRAGMA {pragma}').scalar() for pragma in pragmas}
+            data[name] = {'pragmas': current,
+                          'write_queue': queues[name].snapshot() if queues[name] is not None else None}
+        return jsonify({'msg': 'ok', 'pid': os.getpid(), 'data': data}), 200
+
+    app.extensions['sqlite_pragmas'] = pragmas
+    return queues
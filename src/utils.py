@@ -1,4 +1,17 @@
-from flask import jsonify, url_for
+import base64
+import binascii
+import hashlib
+import json
+from datetime import timezone
+from flask import jsonify, url_for, current_app, request, Response, stream_with_context
+from sqlalchemy import and_, tuple_, func, select
+from sqlalchemy.orm import load_only, joinedload, selectinload
+
+#Tamaño de página por defecto y máximo para los listados paginados.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+#Filas que se traen de la base de datos por cada lote en las respuestas en streaming.
+STREAM_BATCH_SIZE = 1000
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +28,21 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def is_unique_violation(error):
+    #True si el IntegrityError viene de una restricción UNIQUE (y no de un NOT NULL o de una clave foránea).
+    #PostgreSQL: SQLSTATE 23505. SQLite: "UNIQUE constraint failed". MySQL: "Duplicate entry".
+    orig = error.orig
+    if getattr(orig, 'pgcode', None) == '23505' or getattr(orig, 'sqlstate', None) == '23505':
+        return True
+    return 'UNIQUE constraint failed' in str(orig) or 'Duplicate entry' in str(orig)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if 'admin' in app.extensions else [] #El admin es opcional (ADMIN_ENABLED).
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -39,3 +60,259 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+DEFAULT_SORT = ('id', False)
+
+def encode_cursor(last_id, sort=DEFAULT_SORT, sort_value=None):
+    #El cursor es opaco para el cliente: el último id de la página en base64.
+    #Si se ordena por otra columna guardamos también el orden y su valor: [sort, valor, id].
+    raw = str(last_id) if sort == DEFAULT_SORT else json.dumps([format_sort(sort), sort_value, last_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort=DEFAULT_SORT):
+    padding = '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + padding).decode()
+        if sort == DEFAULT_SORT:
+            return int(raw)
+        cursor_sort, sort_value, last_id = json.loads(raw)
+        if cursor_sort != format_sort(sort) or not isinstance(last_id, int):
+            raise ValueError(cursor_sort)
+        return sort_value, last_id
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise APIException('El cursor enviado no es válido', status_code=400)
+
+def format_sort(sort):
+    name, descending = sort
+    return f'-{name}' if descending else name
+
+def parse_sort(args, model):
+    #?sort=height (ascendente) o ?sort=-height (descendente). Solo columnas de model.SORTABLE, que están indexadas.
+    raw = args.get('sort', 'id')
+    sort = (raw[1:], True) if raw.startswith('-') else (raw, False)
+    if sort[0] not in model.SORTABLE:
+        raise APIException(f'No se puede ordenar por {raw}. Opciones: {", ".join(model.SORTABLE)}', status_code=400)
+    return sort
+
+def sort_order(model, sort=DEFAULT_SORT):
+    #El id desempata para que el orden sea total y el cursor no se salte ni repita filas.
+    name, descending = sort
+    columns = [getattr(model, name)] if name == 'id' else [getattr(model, name), model.id]
+    return [column.desc() if descending else column.asc() for column in columns]
+
+def keyset_after(model, sort, after):
+    #Condición "fila posterior al cursor" en el orden pedido: (columna, id) > (valor, último id).
+    name, descending = sort
+    if name == 'id':
+        last_id = after[1] if isinstance(after, tuple) else after #Con ?sort=-id el cursor es [sort, id, id].
+        return model.id < last_id if descending else model.id > last_id
+    key, position = tuple_(getattr(model, name), model.id), tuple_(*after)
+    return key < position if descending else key > position
+
+def next_page(rows, limit, sort=DEFAULT_SORT):
+    #rows trae una fila de más (limit + 1): si está, hay otra página y el cursor apunta a la última fila devuelta.
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].id, sort, getattr(rows[-1], sort[0]))
+
+def prefix_match(column, prefix):
+    #name >= 'Luk' AND name < 'Lul' en vez de LIKE 'Luk%': el rango usa el índice de la columna en SQLite y PostgreSQL
+    #sin depender de la collation ni de case_sensitive_like. Distingue mayúsculas y minúsculas.
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+def parse_filter_values(args, model):
+    #model.FILTERS = {parámetro: (columna, operador)}. Devuelve [(columna, operador, valor)] ya convertidos al tipo
+    #de la columna; parse_filters los pasa a SQL y el snapshot en memoria (snapshot.py) a Python.
+    values = []
+    for param, (name, operator) in model.FILTERS.items():
+        raw = args.get(param)
+        if raw is None or raw == '':
+            continue
+        if operator == 'prefix':
+            values.append((name, operator, raw))
+            continue
+        try:
+            value = getattr(model, name).type.python_type(raw)
+        except ValueError:
+            raise APIException(f'El parámetro {param} no es válido', status_code=400)
+        values.append((name, operator, value))
+    return values
+
+def parse_filters(args, model):
+    #Devuelve las condiciones para .filter()/.where().
+    criteria = []
+    for name, operator, value in parse_filter_values(args, model):
+        column = getattr(model, name)
+        if operator == 'prefix':
+            criteria.append(prefix_match(column, value))
+        elif operator == 'eq':
+            criteria.append(column == value)
+        elif operator == 'min':
+            criteria.append(column >= value)
+        elif operator == 'max':
+            criteria.append(column <= value)
+    return criteria
+
+def parse_page_args(args, sort=DEFAULT_SORT):
+    limit = args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise APIException('El parámetro limit debe ser un número entero', status_code=400)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise APIException(f'El parámetro limit debe estar entre 1 y {MAX_PAGE_SIZE}', status_code=400)
+    after = args.get('after')
+    if after is not None:
+        after = decode_cursor(after, sort)
+    return limit, after
+
+def keyset_paginate(query, model, args, sort=DEFAULT_SORT):
+    #Paginación por cursor: buscamos por PK (id > after) en vez de usar OFFSET,
+    #así cada página cuesta lo mismo sin importar lo profunda que sea.
+    #Con ?sort= el cursor es (valor, id) y la búsqueda usa el índice (columna, id).
+    limit, after = parse_page_args(args, sort)
+    query = query.order_by(*sort_order(model, sort))
+    if after is not None:
+        query = query.filter(keyset_after(model, sort, after))
+    rows = query.limit(limit + 1).all() #Pedimos una fila de más para saber si hay otra página.
+    return next_page(rows, limit, sort)
+
+def wants_stream(args):
+    return args.get('stream', '').lower() in ('1', 'true')
+
+def stream_json_list(query, model, envelope, serialize=None, sort=DEFAULT_SORT):
+    #Escribe {"data": [...], ...} por partes mientras recorremos la consulta con yield_per,
+    #así no tenemos en memoria a la vez todos los objetos, los diccionarios y el JSON completo.
+    rows = query.order_by(*sort_order(model, sort)).yield_per(STREAM_BATCH_SIZE) #Se ejecuta al empezar a enviar.
+    return stream_json_items((serialize(row) if serialize else row.serialize() for row in rows), envelope)
+
+def stream_json_items(items, envelope):
+    #items: diccionarios ya serializados, en orden. Usamos el mismo encoder y separadores que jsonify para que los
+    #bytes sean idénticos. Cada lote se codifica con una sola llamada a dumps() y se le quitan los corchetes.
+    dumps = current_app.json.dumps
+    head, tail = dumps(dict(envelope, data=[]), separators=(',', ':')).split('[]', 1)
+
+    def generate():
+        yield head + '['
+        separator = ''
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield separator + dumps(batch, separators=(',', ':'))[1:-1]
+                separator = ','
+                batch = []
+        if batch:
+            yield separator + dumps(batch, separators=(',', ':'))[1:-1]
+        yield ']' + tail + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+#Codificaciones de Content-Encoding en orden de preferencia del servidor (ver compression.py).
+CONTENT_CODINGS = ('zstd', 'br', 'gzip')
+
+def etag_variants(etag):
+    #Una respuesta comprimida lleva el ETag del body sin comprimir con el sufijo de la codificación ("abc-gzip").
+    return (etag, *[f'{etag}-{coding}' for coding in CONTENT_CODINGS])
+
+def make_etag(*parts):
+    #ETag calculado a partir de datos baratos (max(updated_at), count, url) y no del body ya renderizado.
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return response
+
+def conditional_response(etag, last_modified=None):
+    #Devuelve un 304 si el cliente ya tiene la versión actual (If-None-Match o If-Modified-Since), si no None.
+    #last_modified=None desactiva If-Modified-Since (los listados no lo usan: borrar filas no cambia max(updated_at)).
+    if request.if_none_match:
+        fresh = any(request.if_none_match.contains(tag) for tag in etag_variants(etag))
+    elif request.if_modified_since is not None and last_modified is not None:
+        fresh = last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
+
+def parse_fields(args, allowed):
+    #?fields=name,climated -> ('id', 'name', 'climated'). El id siempre va incluido. None si no se envía.
+    raw = args.get('fields')
+    if raw is None:
+        return None
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise APIException(f'Campos desconocidos en fields: {", ".join(unknown)}', status_code=400)
+    return tuple(dict.fromkeys(['id'] + fields))
+
+def parse_expand(args, model, default=()):
+    #?expand=residents,planet -> relaciones a incluir. Sin el parámetro se usa default.
+    raw = args.get('expand')
+    if raw is None:
+        return set(default)
+    expand = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = expand - set(model.EXPANDABLE)
+    if unknown:
+        raise APIException(f'Relaciones desconocidas en expand: {", ".join(sorted(unknown))}', status_code=400)
+    return expand
+
+def collection_version_query(model, expand=()):
+    #(max(updated_at), count) del listado y de cada relación expandida, en una sola consulta: con ?expand=residents
+    #el body cambia cuando cambia un residente aunque ningún planeta se haya modificado.
+    statement = select(func.max(model.updated_at), func.count(model.id))
+    for related in expanded_models(model, expand):
+        statement = statement.add_columns(select(func.max(related.updated_at)).scalar_subquery(),
+                                          select(func.count(related.id)).scalar_subquery())
+    return statement
+
+def expanded_models(model, expand):
+    return [getattr(model, model.EXPANDABLE[name]).property.mapper.class_ for name in sorted(expand)]
+
+def version_last_modified(version):
+    #version = (max(updated_at), count, max(updated_at), count, ...): la fecha más reciente de todas.
+    return max((date for date in version[::2] if date is not None), default=None)
+
+def sparse_options(model, fields, expand, sort=DEFAULT_SORT):
+    #Opciones de carga: load_only empuja la proyección al SELECT y las relaciones solo se cargan si se piden.
+    #La columna de orden también se carga (aunque no se serialice) porque el cursor la necesita.
+    options = []
+    if fields is not None:
+        options.append(load_only(*[getattr(model, field) for field in dict.fromkeys(fields + (sort[0],))]))
+    for name in sorted(expand):
+        relationship = getattr(model, model.EXPANDABLE[name])
+        options.append(selectinload(relationship) if relationship.property.uselist else joinedload(relationship))
+    return options
+
+def row_columns(model, fields, sort=DEFAULT_SORT):
+    #Columnas a seleccionar en el camino rápido y la función que convierte cada fila (tupla) en dict.
+    #Los campos van primero, así zip ignora el id y la columna de orden que solo necesita el cursor.
+    fields = fields or model.SERIALIZE_FIELDS
+    columns = [getattr(model, column) for column in dict.fromkeys(fields + ('id', sort[0]))]
+    return columns, lambda row: dict(zip(fields, row))
+
+def list_query(query, model, fields, expand, sort=DEFAULT_SORT):
+    #Con ?expand= hacen falta objetos del ORM para cargar las relaciones. Sin él seleccionamos solo las columnas:
+    #no se construyen objetos del ORM ni los diccionarios de serialize(), cada fila va directa a un dict.
+    #Devuelve (query, serialize).
+    if expand:
+        return query.options(*sparse_options(model, fields, expand, sort)), sparse_serializer(fields, expand, model)
+    columns, serialize = row_columns(model, fields, sort)
+    return query.with_entities(*columns), serialize
+
+def sparse_serializer(fields, expand, model):
+    def serialize(row):
+        data = row.serialize(fields)
+        for name in expand:
+            related = getattr(row, model.EXPANDABLE[name])
+            if isinstance(related, list):
+                data[name] = [item.serialize() for item in related]
+            else:
+                data[name] = related.serialize() if related is not None else None
+        return data
+    return serialize
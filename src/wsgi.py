@@ -1,7 +1,11 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+from app import create_app
+
+# Workers never run migrations (the release phase runs "flask db upgrade"), so alembic is not loaded here.
+# Admin and swagger follow ENABLE_ADMIN / ENABLE_SWAGGER.
+application = create_app({'MIGRATE_ENABLED': False})
 
 if __name__ == "__main__":
     application.run()
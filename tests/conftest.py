@@ -0,0 +1,70 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from app import create_app
+from models import db, User, Planet, Character
+
+IGNORED_STATEMENTS = ('PRAGMA', 'BEGIN')
+
+
+@pytest.fixture
+def app(tmp_path):
+    #Una base SQLite nueva por test, en un archivo como en desarrollo (WAL y PRAGMAs de sqlite_profile).
+    #TEST_DATABASE_URL=postgresql://... corre los tests contra una base PostgreSQL vacía (se borran las tablas al final).
+    url = os.getenv('TEST_DATABASE_URL', f'sqlite:///{tmp_path / "test.db"}').replace('postgres://', 'postgresql://')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': url})
+    with app.app_context():
+        db.create_all(bind_key=None) #Solo el primario: las réplicas de otros tests quedan en db.metadatas.
+    yield app
+    with app.app_context():
+        db.session.remove()
+        if db.engine.dialect.name != 'sqlite':
+            db.drop_all(bind_key=None)
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def seed(app):
+    def seed(planets=3, characters=5, users=2):
+        with app.app_context():
+            for i in range(planets):
+                db.session.add(Planet(name=f'planet{i}', population=i, diameter=i, climated='arid', terrain='desert'))
+            db.session.flush()
+            for i in range(characters):
+                db.session.add(Character(name=f'character{i}', specie='human', gender='female', age=i, height=i,
+                                         weight=i, planet_id=1 + i % planets))
+            for i in range(users):
+                db.session.add(User(name=f'user{i}', email=f'user{i}@example.com', password='secret', is_active=True))
+            db.session.commit()
+    return seed
+
+
+@pytest.fixture
+def statements(app):
+    #with statements() as executed: ... -> lista con cada consulta que llegó a la base de datos. Se omiten los
+    #PRAGMA de cada conexión nueva y el BEGIN explícito de sqlite_profile: no dependen del handler.
+    @contextmanager
+    def capture():
+        executed = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not statement.startswith(IGNORED_STATEMENTS):
+                executed.append(statement)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield executed
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+    return capture
@@ -0,0 +1,59 @@
+import pytest
+
+from app import create_app
+from models import db, Planet, Character
+
+
+class Form:
+    #Lo mínimo que usa ModelView.update_model/create_model: populate_obj copia los campos al modelo.
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def populate_obj(self, model):
+        for name, value in self.fields.items():
+            setattr(model, name, value)
+
+
+@pytest.fixture
+def admin_app(app):
+    app = create_app({'TESTING': True, 'ADMIN_ENABLED': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI']})
+    return app
+
+
+def admin_view(app, model):
+    return next(view for admin in app.extensions['admin'] for view in admin._views if getattr(view, 'model', None) is model)
+
+
+def test_admin_edit_invalidates_cached_payloads(admin_app, seed):
+    seed(planets=2, characters=1)
+    client = admin_app.test_client()
+    assert client.get('/character/1').json['data']['planet']['id'] == 1
+    assert [resident['id'] for resident in client.get('/planet/1').json['data']['residents']] == [1]
+    assert client.get('/planet/2').json['data']['residents'] == []
+    with admin_app.test_request_context():
+        view = admin_view(admin_app, Character)
+        character = db.session.get(Character, 1)
+        assert view.update_model(Form(name='Yoda', planet_relationship=db.session.get(Planet, 2)), character)
+    assert client.get('/character/1').json['data']['name'] == 'Yoda'
+    assert client.get('/planet/1').json['data']['residents'] == []
+    assert [resident['name'] for resident in client.get('/planet/2').json['data']['residents']] == ['Yoda']
+
+
+def test_admin_planet_edit_invalidates_its_residents(admin_app, seed):
+    seed(planets=1, characters=2)
+    client = admin_app.test_client()
+    assert client.get('/character/1').json['data']['planet']['name'] == 'planet0'
+    with admin_app.test_request_context():
+        assert admin_view(admin_app, Planet).update_model(Form(name='Tatooine'), db.session.get(Planet, 1))
+    assert client.get('/planet/1').json['data']['name'] == 'Tatooine'
+    assert client.get('/character/1').json['data']['planet']['name'] == 'Tatooine'
+
+
+def test_admin_delete_invalidates_cached_payloads(admin_app, seed):
+    seed(planets=1, characters=2)
+    client = admin_app.test_client()
+    assert len(client.get('/planet/1').json['data']['residents']) == 2
+    assert client.get('/character/1').status_code == 200
+    assert client.post('/admin/character/delete/', data={'id': '1'}).status_code == 302
+    assert client.get('/character/1').status_code == 404
+    assert [resident['id'] for resident in client.get('/planet/1').json['data']['residents']] == [2]
@@ -0,0 +1,114 @@
+import asyncio
+import gzip
+import importlib
+import json
+import shutil
+import sys
+
+import pytest
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('asgiref')
+httpx = pytest.importorskip('httpx')
+
+from models import db
+
+#Cabeceras que tienen que coincidir entre los dos modos (además del status y del body).
+COMPARED_HEADERS = ('content-type', 'content-encoding', 'etag', 'last-modified', 'vary')
+URLS = ['/users', '/user/1', '/user/0', '/user/1/favorites', '/planets', '/planets?expand=residents',
+        '/planet/1', '/planet/1?fields=name', '/planet/0', '/characters', '/characters?stream=true',
+        '/characters?stream=true&expand=planet', '/character/1', '/characters?sort=bad']
+
+
+@pytest.fixture
+def load_asgi(app, monkeypatch):
+    #asgi.py crea su app Flask al importarse, con la configuración del entorno.
+    modules = []
+
+    def load(**env):
+        monkeypatch.setenv('DATABASE_URL', app.config['SQLALCHEMY_DATABASE_URI'])
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        sys.modules.pop('asgi', None)
+        modules.append(importlib.import_module('asgi'))
+        return modules[-1]
+    yield load
+    for module in modules:
+        for sessionmaker in module._sessionmakers.values():
+            asyncio.run(sessionmaker.kw['bind'].dispose())
+    sys.modules.pop('asgi', None)
+
+
+def get_async(module, url, headers=None, cookies=None):
+    async def get():
+        transport = httpx.ASGITransport(app=module.application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test', cookies=cookies) as client:
+            response = await client.send(client.build_request('GET', url, headers=headers), stream=True)
+            body = b''.join([chunk async for chunk in response.aiter_raw()])
+            return response, body
+    return asyncio.run(get())
+
+
+def decoded(headers, body):
+    #Las respuestas en streaming se comprimen por partes: se comparan descomprimidas.
+    return gzip.decompress(body) if headers.get('content-encoding') == 'gzip' else body
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip'])
+def test_async_routes_match_the_flask_routes(load_asgi, seed, encoding):
+    seed(planets=5, characters=40, users=2)
+    module = load_asgi()
+    sync_client = module.flask_app.test_client()
+    assert sync_client.post('/favorite/planets/1/1').status_code == 200
+    headers = {'Accept-Encoding': encoding} #httpx pide gzip, br y zstd si no se indica.
+    for url in URLS:
+        sync = sync_client.get(url, headers=headers)
+        response, body = get_async(module, url, headers)
+        assert response.status_code == sync.status_code, url
+        for header in COMPARED_HEADERS:
+            assert response.headers.get(header) == sync.headers.get(header), (url, header)
+        assert decoded(response.headers, body) == decoded(sync.headers, sync.data), url
+        if sync.headers.get('ETag'):
+            revalidate = dict(headers, **{'If-None-Match': sync.headers['ETag']})
+            sync = sync_client.get(url, headers=revalidate)
+            response, body = get_async(module, url, revalidate)
+            assert response.status_code == sync.status_code == 304, url
+            assert response.headers.get('etag') == sync.headers.get('ETag'), url
+    assert get_async(module, '/characters', {'Accept-Encoding': 'gzip'})[0].headers['content-encoding'] == 'gzip'
+
+
+def test_async_routes_report_metrics_and_compression(load_asgi, seed):
+    seed(planets=5, characters=40)
+    module = load_asgi()
+    get_async(module, '/characters', {'Accept-Encoding': 'gzip'})
+    get_async(module, '/planet/1', {'Accept-Encoding': 'identity'}) #Versión, planeta y residentes.
+    metrics = module.flask_app.test_client().get('/metrics').get_data(as_text=True)
+    assert 'http_request_queries_count{method="GET",route="/characters",status="200"} 1' in metrics
+    assert 'http_request_queries_sum{method="GET",route="/planet/<int:id>",status="200"} 3' in metrics
+    stats = module.flask_app.test_client().get('/compression/stats').json['data']['routes']
+    assert stats['/characters']['gzip']['responses'] == 1
+
+
+def test_async_routes_use_the_replicas(app, load_asgi, seed, tmp_path):
+    #La réplica es una copia atrasada: sin la cookie se lee de ella, dentro de la ventana read-your-writes del primario.
+    seed(planets=1, characters=1)
+    replica = tmp_path / 'replica.db'
+    with app.app_context():
+        db.engine.dispose()
+    shutil.copy(app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///'), replica)
+    module = load_asgi(DATABASE_REPLICA_URLS=f'sqlite:///{replica}')
+    writer = module.flask_app.test_client()
+    response = writer.put('/character/1', json={'name': 'new', 'specie': 'human', 'gender': 'female', 'age': 1,
+                                                'height': 1, 'weight': 1})
+    assert response.status_code == 200
+    cookies = {'ryw_until': writer.get_cookie('ryw_until').value}
+    assert json.loads(get_async(module, '/character/1')[1])['data']['name'] == 'character0'
+    assert json.loads(get_async(module, '/character/1', cookies=cookies)[1])['data']['name'] == 'new'
+
+
+def test_async_catalog_routes_use_the_snapshot(load_asgi, seed):
+    seed(planets=3, characters=5)
+    module = load_asgi(CATALOG_SNAPSHOT='1')
+    response, body = get_async(module, '/planets', {'Accept-Encoding': 'identity'})
+    assert response.status_code == 200 and len(json.loads(body)['data']) == 3
+    assert module.flask_app.extensions['catalog_snapshot'].full_loads == 1
@@ -0,0 +1,45 @@
+import shutil
+
+from app import create_app
+from models import db
+
+PLANET = {'name': 'new', 'population': 1, 'diameter': 1, 'climated': 'arid', 'terrain': 'desert'}
+CHARACTER = {'name': 'new', 'specie': 'human', 'gender': 'female', 'age': 1, 'height': 1, 'weight': 1, 'planet_id': 1}
+
+
+def test_planet_body_matches_its_etag_across_workers(app, seed):
+    #Dos workers con su propia LRU sobre la misma base: B tiene en cache el planeta de antes del PUT de A.
+    seed(planets=1, characters=1)
+    worker_a = app.test_client()
+    worker_b = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI']}).test_client()
+    old_etag = worker_b.get('/planet/1').headers['ETag']
+    assert worker_a.put('/planet/1', json=PLANET).status_code == 200
+    response = worker_b.get('/planet/1')
+    assert response.json['data']['name'] == 'new'
+    assert response.headers['ETag'] != old_etag
+    assert worker_b.get('/planet/1', headers={'If-None-Match': old_etag}).status_code == 200
+
+
+def test_replica_reads_do_not_fill_the_cache(tmp_path, monkeypatch):
+    #La réplica es una copia de antes del PUT (atrasada). Otro cliente lee de ella después de la invalidación:
+    #el que escribió, dentro de su ventana read-your-writes, tiene que ver su cambio.
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica.db'
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', f'sqlite:///{replica}')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}'})
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.engine.dispose()
+    writer, reader = app.test_client(), app.test_client()
+    assert writer.post('/planets', json=dict(PLANET, name='planet0')).status_code == 201
+    assert writer.post('/characters', json=dict(CHARACTER, name='character0')).status_code == 201
+    assert writer.post('/user', json={'name': 'user0', 'email': 'user0@example.com', 'password': 'secret'}).status_code == 201
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.copy(primary, replica)
+    assert writer.put('/character/1', json=CHARACTER).status_code == 200
+    assert writer.put('/users/1', json={'name': 'new', 'email': 'user0@example.com', 'password': 'secret'}).status_code == 200
+    assert reader.get('/character/1').json['data']['name'] == 'character0'
+    assert reader.get('/user/1').json['data']['name'] == 'user0'
+    assert writer.get('/character/1').json['data']['name'] == 'new'
+    assert writer.get('/user/1').json['data']['name'] == 'new'
@@ -0,0 +1,64 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from counters import actual_count
+from models import db, User, Planet, Character, FavoritePlanets
+
+from test_admin import Form, admin_view
+
+
+def mismatches(app, model, ids):
+    with app.app_context():
+        rows = db.session.execute(db.select(model.id, model.favorite_count, actual_count(model)).where(model.id.in_(ids)))
+        return [(id, stored, actual) for id, stored, actual in rows if stored != actual]
+
+
+def test_concurrent_favorite_writes_keep_counters_exact(app, seed):
+    #Muchos hilos agregan y quitan favoritos de pocos planetas/personajes (máxima contención) por las rutas
+    #individuales y la ruta batch: al final cada contador coincide con las filas de las tablas de favoritos.
+    #SQLite serializa las escrituras (BEGIN IMMEDIATE); con TEST_DATABASE_URL=postgresql://... las transacciones
+    #sí se solapan y el test comprueba el UPDATE atómico.
+    seed(planets=3, characters=3, users=20)
+
+    def operation(i):
+        local = random.Random(i)
+        user, planet, character = local.randint(1, 20), local.randint(1, 3), local.randint(1, 3)
+        method, path, body = local.choice([
+            ('POST', f'/favorite/planets/{planet}/{user}', None),
+            ('DELETE', f'/favorite/planet/{planet}/{user}', None),
+            ('POST', f'/favorite/characters/{character}/{user}', None),
+            ('DELETE', f'/favorite/character/{character}/{user}', None),
+            ('POST', f'/user/{user}/favorites/batch', {'add_planets': [planet], 'remove_characters': [character]}),
+            ('POST', f'/user/{user}/favorites/batch', {'remove_planets': [planet], 'add_characters': [character]}),
+        ])
+        return app.test_client().open(path, method=method, json=body).status_code
+
+    with ThreadPoolExecutor(8) as pool:
+        statuses = list(pool.map(operation, range(400)))
+    assert not [status for status in statuses if status >= 500]
+    assert mismatches(app, Planet, [1, 2, 3]) == []
+    assert mismatches(app, Character, [1, 2, 3]) == []
+
+
+def test_admin_favorites_update_counters(app, seed):
+    seed(planets=2, characters=1, users=1)
+    admin_app = create_app({'TESTING': True, 'ADMIN_ENABLED': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI']})
+    counts = lambda: dict(db.session.execute(db.select(Planet.id, Planet.favorite_count)).all())
+    with admin_app.test_request_context():
+        view = admin_view(admin_app, FavoritePlanets)
+        favorite = view.create_model(Form(user_relationship=db.session.get(User, 1),
+                                          planet_relationship=db.session.get(Planet, 1)))
+        assert counts() == {1: 1, 2: 0}
+        assert view.update_model(Form(planet_relationship=db.session.get(Planet, 2)), favorite)
+        assert counts() == {1: 0, 2: 1}
+        #Repetido: la restricción única lo rechaza y el contador tampoco cambia.
+        assert not view.create_model(Form(user_relationship=db.session.get(User, 1),
+                                          planet_relationship=db.session.get(Planet, 2)))
+        assert counts() == {1: 0, 2: 1}
+        favorite_id = favorite.id
+    client = admin_app.test_client()
+    assert client.post('/admin/favoriteplanets/delete/', data={'id': str(favorite_id)}).status_code == 302
+    with admin_app.app_context():
+        assert counts() == {1: 0, 2: 0}
+    assert mismatches(app, Planet, [1, 2]) == []
@@ -0,0 +1,50 @@
+import pytest
+
+
+def queries(statements, client, url):
+    with statements() as executed:
+        response = client.get(url)
+    assert response.status_code == 200
+    return executed
+
+
+@pytest.mark.parametrize('favorites', [0, 1, 25])
+def test_get_favorites_query_count_is_constant(client, seed, statements, favorites):
+    #Usuario + favoritos de planetas + favoritos de personajes, sin importar cuántos favoritos tenga (sin N+1).
+    seed(planets=30, characters=30)
+    for id in range(1, favorites + 1):
+        assert client.post(f'/favorite/planets/{id}/1').status_code == 200
+        assert client.post(f'/favorite/characters/{id}/1').status_code == 200
+    executed = queries(statements, client, '/user/1/favorites')
+    assert len(executed) == 3
+    body = client.get('/user/1/favorites').json
+    assert len(body['favorite_planets']) == len(body['favorite_characters']) == favorites
+
+
+def test_get_favorites_with_fields_query_count(client, seed, statements):
+    seed(planets=10, characters=10)
+    for id in range(1, 6):
+        client.post(f'/favorite/planets/{id}/1')
+    assert len(queries(statements, client, '/user/1/favorites?fields=id,name')) == 3
+
+
+@pytest.mark.parametrize('kind, url', [('planets', '/planet/4'), ('planets', '/planets/bulk'),
+                                       ('characters', '/character/1'), ('characters', '/characters/bulk')])
+def test_deleting_a_favorite_removes_it_from_the_user(client, seed, kind, url):
+    #Los borrados de una fila y los bulk borran los favoritos en la misma transacción.
+    seed(planets=6, characters=3) #Los planetas 4 a 6 no tienen residentes.
+    id = 4 if kind == 'planets' else 1
+    assert client.post(f'/favorite/{kind}/{id}/1').status_code == 200
+    if url.endswith('/bulk'):
+        response = client.delete(url, json={'ids': [id]})
+        assert response.status_code == 200 and response.json['results'] == [{'id': id, 'status': 204}]
+    else:
+        assert client.delete(url).status_code == 204
+    body = client.get('/user/1/favorites').json
+    assert body['favorite_planets'] == body['favorite_characters'] == []
+
+
+def test_planet_with_residents_is_not_deleted(client, seed):
+    seed(planets=1, characters=1)
+    assert client.delete('/planet/1').status_code == 400
+    assert client.get('/planet/1').status_code == 200
@@ -0,0 +1,76 @@
+import shutil
+import sqlite3
+
+import pytest
+from flask import g
+
+from app import create_app
+from models import db, Planet, Character
+
+
+def search(client, q):
+    response = client.get(f'/search?q={q}')
+    assert response.status_code == 200
+    return [(hit['type'], hit['data']['name']) for hit in response.json['data']]
+
+
+@pytest.mark.parametrize('backend', ['fts5', 'memory'])
+def test_writes_outside_the_handlers_reach_the_index(app, client, seed, monkeypatch, tmp_path, backend):
+    #Admin, flask catalog import u otro proceso: escriben con el ORM o con Core y no llaman a SEARCH.
+    if backend == 'memory':
+        monkeypatch.setenv('SEARCH_BACKEND', 'memory')
+        app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI']})
+        client = app.test_client()
+    seed(planets=2, characters=2)
+    assert search(client, 'planet0') == [('planet', 'planet0')]
+    with app.app_context():
+        db.session.add(Planet(name='Dagobah', population=1, diameter=1, climated='murky', terrain='swamp'))
+        db.session.get(Character, 1).name = 'Yoda'
+        db.session.execute(db.insert(Planet), [{'name': 'Hoth', 'population': 1, 'diameter': 1, 'climated': 'frozen',
+                                                'terrain': 'tundra'}])
+        db.session.execute(db.delete(Character).where(Character.id == 2))
+        db.session.commit()
+    assert search(client, 'dagobah') == [('planet', 'Dagobah')]
+    assert search(client, 'hoth') == [('planet', 'Hoth')]
+    assert search(client, 'yoda') == [('character', 'Yoda')]
+    assert search(client, 'character0') == []
+    assert search(client, 'character1') == []
+
+
+def test_bulk_endpoints_update_the_index(client, seed):
+    seed()
+    items = [{'name': f'Naboo{i}', 'population': 1, 'diameter': 1, 'climated': 'temperate', 'terrain': 'swamp'}
+             for i in range(3)]
+    ids = [result['id'] for result in client.post('/planets/bulk', json=items).json['results']]
+    assert len(search(client, 'naboo')) == 3
+    client.delete('/planets/bulk', json={'ids': ids})
+    assert search(client, 'naboo') == []
+
+
+def test_failed_write_leaves_the_index_untouched(app, client, seed):
+    seed()
+    assert search(client, 'planet0') == [('planet', 'planet0')]
+    with app.app_context():
+        db.session.get(Planet, 1).name = 'Alderaan'
+        db.session.flush()
+        db.session.rollback()
+    assert search(client, 'alderaan') == []
+    assert search(client, 'planet0') == [('planet', 'planet0')]
+
+
+def test_index_is_created_on_the_primary(tmp_path, monkeypatch):
+    #/search es @read_only: la tabla FTS5 y sus triggers se crean en el primario, nunca en una réplica.
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica.db'
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', f'sqlite:///{replica}')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}'})
+    with app.app_context():
+        db.create_all(bind_key=None)
+        db.engine.dispose()
+    shutil.copy(primary, replica)
+    with app.test_request_context('/search?q=x'):
+        g.use_replica = True
+        app.extensions['search_index'].backend.ensure(db.session)
+        db.session.remove()
+    tables = lambda path: {row[0] for row in sqlite3.connect(path).execute('SELECT name FROM sqlite_master')}
+    assert {'search_fts', 'search_fts_planet_insert', 'search_fts_character_delete'} <= tables(primary)
+    assert 'search_fts' not in tables(replica)
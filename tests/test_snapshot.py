@@ -0,0 +1,35 @@
+from app import create_app
+from models import db, CatalogVersion
+
+PLANET = {'name': 'new', 'population': 1, 'diameter': 1, 'climated': 'arid', 'terrain': 'desert'}
+
+
+def catalog_version(app):
+    with app.app_context():
+        return db.session.scalar(db.select(CatalogVersion.version))
+
+
+def test_writes_from_a_process_without_the_snapshot_reach_it(app, seed, monkeypatch):
+    #app no tiene CATALOG_SNAPSHOT=1 (p. ej. otro worker o flask catalog import); reader sí.
+    seed(planets=2, characters=1)
+    monkeypatch.setenv('CATALOG_SNAPSHOT', '1')
+    reader = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI']}).test_client()
+    writer = app.test_client()
+    assert reader.get('/planet/1').json['data']['name'] == 'planet0'
+    assert writer.put('/planet/1', json=PLANET).status_code == 200
+    assert writer.post('/planets/bulk', json=[dict(PLANET, name='bulk')]).status_code == 200
+    assert writer.delete('/planet/2').status_code == 204
+    assert reader.get('/planet/1').json['data']['name'] == 'new'
+    assert reader.get('/planet/3').json['data']['name'] == 'bulk'
+    assert reader.get('/planet/2').status_code == 404
+
+
+def test_rejected_write_does_not_bump_the_version(app, client, seed):
+    #El contador y el registro van en la transacción de la escritura: si se deshace, no queda nada.
+    seed(planets=2, characters=1)
+    before = catalog_version(app)
+    assert client.put('/planet/1', json=dict(PLANET, name='planet1')).status_code == 400
+    assert client.post('/planets', json=dict(PLANET, name='planet1')).status_code == 400
+    assert catalog_version(app) == before
+    assert client.put('/planet/1', json=PLANET).status_code == 200
+    assert catalog_version(app) == before + 1
@@ -0,0 +1,54 @@
+import pytest
+
+USER = {'name': 'user', 'email': 'user0@example.com', 'password': 'secret'}
+PLANET = {'name': 'planet0', 'population': 2, 'diameter': 2, 'climated': 'arid', 'terrain': 'desert'}
+CHARACTER = {'name': 'character0', 'specie': 'human', 'gender': 'female', 'age': 2, 'height': 2, 'weight': 2}
+NEW_PLANET = dict(PLANET, name='new-planet')
+NEW_CHARACTER = dict(CHARACTER, name='new-character', planet_id=1)
+
+#(nombre, método, ruta, body, status, consultas). Los mismos casos que bench.py write-queries, en orden: cada paso
+#parte del estado que dejó el anterior. Las consultas no incluyen el BEGIN ni los PRAGMA de SQLite. Las escrituras
+#de planetas y personajes suman dos: el contador de catalog_version y la fila de catalog_change (snapshot.py).
+WRITE_STEPS = [
+    ('POST /user', 'POST', '/user', dict(USER, email='new@example.com'), 201, 2),
+    ('POST /user (email repetido)', 'POST', '/user', USER, 400, 1),
+    ('PUT /users/<id>', 'PUT', '/users/1', USER, 200, 1),
+    ('PUT /users/<id> (email de otro)', 'PUT', '/users/1', dict(USER, email='user1@example.com'), 400, 1),
+    ('PUT /users/<id> (no existe)', 'PUT', '/users/0', USER, 404, 1),
+    ('POST /favorite/planets', 'POST', '/favorite/planets/1/1', None, 200, 2),
+    ('POST /favorite/planets (repetido)', 'POST', '/favorite/planets/1/1', None, 400, 1),
+    ('POST /favorite/planets (sin planeta)', 'POST', '/favorite/planets/0/1', None, 404, 2),
+    ('DELETE /favorite/planet', 'DELETE', '/favorite/planet/1/1', None, 204, 2),
+    ('DELETE /favorite/planet (no existe)', 'DELETE', '/favorite/planet/1/1', None, 404, 2),
+    ('DELETE /favorite/planet (sin usuario)', 'DELETE', '/favorite/planet/1/0', None, 404, 2),
+    ('POST /favorite/characters', 'POST', '/favorite/characters/1/1', None, 200, 2),
+    ('POST /favorite/characters (repetido)', 'POST', '/favorite/characters/1/1', None, 400, 1),
+    ('DELETE /favorite/character', 'DELETE', '/favorite/character/1/1', None, 204, 2),
+    ('DELETE /favorite/character (no existe)', 'DELETE', '/favorite/character/1/1', None, 404, 2),
+    ('POST /planets', 'POST', '/planets', NEW_PLANET, 201, 4),
+    ('POST /planets (name repetido)', 'POST', '/planets', PLANET, 400, 1),
+    ('PUT /planet/<id>', 'PUT', '/planet/1', PLANET, 200, 6),
+    ('PUT /planet/<id> (name de otro)', 'PUT', '/planet/2', PLANET, 400, 2),
+    ('POST /characters', 'POST', '/characters', NEW_CHARACTER, 201, 5),
+    ('POST /characters (name repetido)', 'POST', '/characters', NEW_CHARACTER, 400, 2),
+    ('PUT /character/<id>', 'PUT', '/character/1', CHARACTER, 200, 5),
+    ('PUT /character/<id> (name de otro)', 'PUT', '/character/1', NEW_CHARACTER, 400, 3),
+    ('POST /favorite/planets (antes de borrar)', 'POST', '/favorite/planets/1/1', None, 200, 2),
+    ('DELETE /user/<id> (con favoritos)', 'DELETE', '/user/1', None, 204, 4),
+    ('DELETE /user/<id> (no existe)', 'DELETE', '/user/0', None, 404, 3),
+]
+
+
+def test_write_handlers_query_counts(app, client, seed, statements):
+    if app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0] != 'sqlite':
+        pytest.skip('Los números son los de SQLite (FTS5 y sqlite_profile)')
+    seed(planets=2, characters=1, users=2)
+    with app.app_context():
+        app.extensions['search_index'].rebuild() #Crea el índice antes de medir: la primera escritura no lo paga.
+    measured, expected = {}, {}
+    for name, method, path, body, status, queries in WRITE_STEPS:
+        with statements() as executed:
+            response = client.open(path, method=method, json=body)
+        assert response.status_code == status, name
+        measured[name], expected[name] = len(executed), queries
+    assert measured == expected